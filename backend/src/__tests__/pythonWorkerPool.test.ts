@@ -0,0 +1,138 @@
+import { EventEmitter } from 'events';
+import { PassThrough } from 'stream';
+import { jest } from '@jest/globals';
+
+/**
+ * Stand-in for a `check_interactions.py --worker` process: records what is
+ * written to stdin and only answers when the test says so
+ */
+class StubChild extends EventEmitter {
+  stdin = new PassThrough();
+  stdout = new PassThrough();
+  stderr = new PassThrough();
+  written: any[] = [];
+  kill = jest.fn(() => {
+    setImmediate(() => this.emit('exit', null));
+    return true;
+  });
+
+  constructor() {
+    super();
+    this.stdin.on('data', (chunk) => {
+      chunk
+        .toString()
+        .split('\n')
+        .filter(Boolean)
+        .forEach((line: string) => this.written.push(JSON.parse(line)));
+    });
+  }
+
+  reply(message: Record<string, any>) {
+    this.stdout.write(JSON.stringify(message) + '\n');
+  }
+}
+
+const children: StubChild[] = [];
+const spawn = jest.fn(() => {
+  const child = new StubChild();
+  children.push(child);
+  return child;
+});
+
+jest.unstable_mockModule('child_process', () => ({ spawn }));
+
+const { PythonWorkerPool } = await import('../services/pythonWorkerPool.js');
+
+const flush = () => new Promise((resolve) => setImmediate(resolve));
+
+describe('PythonWorkerPool', () => {
+  beforeEach(() => {
+    children.length = 0;
+    spawn.mockClear();
+  });
+
+  it('should resolve a request with the matching worker response', async () => {
+    const pool = new PythonWorkerPool('python', 'check_interactions.py', 1);
+    const result = pool.request({ drugs: ['warfarin', 'aspirin'] });
+    await flush();
+
+    const [child] = children;
+    expect(child.written).toHaveLength(1);
+    child.reply({ id: child.written[0].id, success: true, type: 'result' });
+
+    await expect(result).resolves.toMatchObject({ success: true });
+    pool.shutdown();
+  });
+
+  it('should send a worker one request at a time and queue the rest', async () => {
+    const pool = new PythonWorkerPool('python', 'check_interactions.py', 1);
+    const first = pool.request({ drugs: ['warfarin', 'aspirin'] });
+    const second = pool.request({ drugs: ['simvastatin', 'clarithromycin'] });
+    await flush();
+
+    const [child] = children;
+    expect(child.written).toHaveLength(1);
+    child.reply({ id: child.written[0].id, success: true, type: 'result' });
+    await expect(first).resolves.toMatchObject({ success: true });
+    await flush();
+
+    expect(child.written).toHaveLength(2);
+    child.reply({ id: child.written[1].id, success: true, type: 'result' });
+    await expect(second).resolves.toMatchObject({ success: true });
+    pool.shutdown();
+  });
+
+  it('should start the timeout when a worker takes the request, not when it is queued', async () => {
+    const pool = new PythonWorkerPool('python', 'check_interactions.py', 1);
+    const slow = pool.request({ drugs: ['warfarin', 'aspirin'] }, 1000);
+    const queued = pool.request({ drugs: ['simvastatin', 'clarithromycin'] }, 50);
+
+    // Longer than the queued request's timeout
+    await new Promise((resolve) => setTimeout(resolve, 100));
+    const [child] = children;
+    child.reply({ id: child.written[0].id, success: true, type: 'result' });
+    await expect(slow).resolves.toMatchObject({ success: true });
+    await flush();
+
+    child.reply({ id: child.written[1].id, success: true, type: 'result' });
+    await expect(queued).resolves.toMatchObject({ success: true });
+    expect(child.kill).not.toHaveBeenCalled();
+    pool.shutdown();
+  });
+
+  it('should kill a timed-out worker and run the queued requests on a fresh process', async () => {
+    const pool = new PythonWorkerPool('python', 'check_interactions.py', 1);
+    const stuck = pool.request({ drugs: ['warfarin', 'aspirin'] }, 50);
+    const queued = pool.request({ drugs: ['simvastatin', 'clarithromycin'] });
+
+    await expect(stuck).rejects.toThrow('Python process timeout');
+    const [child] = children;
+    expect(child.kill).toHaveBeenCalledTimes(1);
+
+    // A late answer from the killed process is ignored
+    child.reply({ id: child.written[0].id, success: true, type: 'result' });
+    await flush();
+
+    expect(spawn).toHaveBeenCalledTimes(2);
+    const fresh = children[1];
+    expect(fresh.written).toHaveLength(1);
+    fresh.reply({ id: fresh.written[0].id, success: true, type: 'result' });
+    await expect(queued).resolves.toMatchObject({ success: true, id: fresh.written[0].id });
+    pool.shutdown();
+  });
+
+  it('should give queued requests to another worker while one is stuck', async () => {
+    const pool = new PythonWorkerPool('python', 'check_interactions.py', 2);
+    const stuck = pool.request({ drugs: ['warfarin', 'aspirin'] }, 60000);
+    const other = pool.request({ drugs: ['simvastatin', 'clarithromycin'] });
+    await flush();
+
+    expect(children).toHaveLength(2);
+    const [, second] = children;
+    second.reply({ id: second.written[0].id, success: true, type: 'result' });
+    await expect(other).resolves.toMatchObject({ success: true });
+
+    pool.shutdown();
+    await expect(stuck).rejects.toThrow('Python worker pool is shut down');
+  });
+});
@@ -22,4 +22,6 @@ export const env = {
   CLOUDINARY_API_KEY: process.env.CLOUDINARY_API_KEY || '',
   CLOUDINARY_API_SECRET: process.env.CLOUDINARY_API_SECRET || '',
   GOOGLE_VISION_API_KEY: process.env.GOOGLE_VISION_API_KEY || '',
+  PYTHON_BIN: process.env.PYTHON_BIN || 'python',
+  DRUG_CHECKER_WORKERS: Number(process.env.DRUG_CHECKER_WORKERS || 2),
 };
@@ -1,10 +1,11 @@
-import { spawn } from 'child_process';
+import fs from 'fs';
 import path from 'path';
 import { env } from '../server/config/env.js';
 import { prisma } from './prisma.js';
 import { db, collections } from '../config/firebase.js';
 import { sendAlertToDoctor, sendCriticalInteractionAlert } from './alerts.js';
 import { generateInteractionExplanation } from './ai.js';
+import { PythonWorkerPool } from './pythonWorkerPool.js';
 
 export interface DrugInteractionInput {
   drugs: string[];
@@ -344,62 +345,42 @@ export async function checkInteractionsWithActiveMeds(
   return await checkDrugInteractions({ drugs: allDrugs, userId });
 }
 
-/**
- * Calls the Python drug-interaction-checker script
- */
-async function callPythonChecker(drugs: string[]): Promise<DrugInteractionResult> {
-  return new Promise((resolve, reject) => {
-    const pythonScriptPath = path.join(
-      process.cwd(),
-      '..',
-      'drug-interaction-checker',
-      'drug-interaction-checker',
-      'src',
-      'check_interactions.py'
-    );
-
-    // Check if Python script exists, otherwise use fallback
-    const fs = require('fs');
-    if (!fs.existsSync(pythonScriptPath)) {
-      return reject(new Error('Python script not found'));
-    }
+const pythonScriptPath = path.join(
+  process.cwd(),
+  '..',
+  'drug-interaction-checker',
+  'drug-interaction-checker',
+  'src',
+  'check_interactions.py'
+);
 
-    const pythonProcess = spawn('python', [pythonScriptPath, JSON.stringify(drugs)]);
-
-    let stdout = '';
-    let stderr = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-      stdout += data.toString();
-    });
-
-    pythonProcess.stderr.on('data', (data) => {
-      stderr += data.toString();
-    });
-
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        return reject(new Error(`Python process exited with code ${code}: ${stderr}`));
-      }
+let workerPool: PythonWorkerPool | null = null;
 
-      try {
-        const result = JSON.parse(stdout);
-        resolve(parsePythonResult(result));
-      } catch (e) {
-        reject(new Error(`Failed to parse Python output: ${e}`));
-      }
-    });
+/**
+ * Lazily create the pool of long-lived Python workers
+ */
+function getWorkerPool(): PythonWorkerPool {
+  if (!workerPool) {
+    workerPool = new PythonWorkerPool(env.PYTHON_BIN, pythonScriptPath, env.DRUG_CHECKER_WORKERS);
+  }
+  return workerPool;
+}
 
-    pythonProcess.on('error', (error) => {
-      reject(new Error(`Failed to start Python process: ${error.message}`));
-    });
+/**
+ * Calls the Python drug-interaction-checker via a warm worker process
+ */
+async function callPythonChecker(drugs: string[]): Promise<DrugInteractionResult> {
+  // Check if Python script exists, otherwise use fallback
+  if (!fs.existsSync(pythonScriptPath)) {
+    throw new Error('Python script not found');
+  }
 
-    // Timeout after 30 seconds
-    setTimeout(() => {
-      pythonProcess.kill();
-      reject(new Error('Python process timeout'));
-    }, 30000);
-  });
+  // Timeout after 30 seconds
+  const result = await getWorkerPool().request({ drugs }, 30000);
+  if (!result.success) {
+    throw new Error(result.error || 'Python checker failed');
+  }
+  return parsePythonResult(result);
 }
 
 /**
@@ -0,0 +1,178 @@
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
+import readline from 'readline';
+
+/**
+ * Event sent ahead of the result when a request asks to stream: the
+ * rule-based screen first, then partial answer text
+ */
+export interface StreamEvent {
+  type: 'screen' | 'delta' | 'reset';
+  text?: string;
+  screen?: Record<string, any>;
+}
+
+interface Job {
+  id: string;
+  payload: Record<string, any>;
+  timeoutMs: number;
+  onEvent?: (event: StreamEvent) => void;
+  resolve: (value: any) => void;
+  reject: (reason: Error) => void;
+}
+
+/**
+ * One long-lived `check_interactions.py --worker` process speaking NDJSON.
+ * The process handles one request at a time, so it is only ever sent one;
+ * the pool queues the rest
+ */
+class PythonWorker {
+  private proc: ChildProcessWithoutNullStreams | null = null;
+  private current: { job: Job; timer: NodeJS.Timeout } | null = null;
+  private stderr = '';
+
+  constructor(
+    private readonly pythonBin: string,
+    private readonly scriptPath: string,
+    private readonly onIdle: () => void
+  ) {}
+
+  get busy(): boolean {
+    return this.current !== null;
+  }
+
+  private ensureStarted(): ChildProcessWithoutNullStreams {
+    if (this.proc) return this.proc;
+
+    const proc = spawn(this.pythonBin, [this.scriptPath, '--worker']);
+    this.proc = proc;
+    this.stderr = '';
+
+    readline.createInterface({ input: proc.stdout }).on('line', (line) => {
+      if (this.proc !== proc) return;
+      let message: any;
+      try {
+        message = JSON.parse(line);
+      } catch (e) {
+        console.warn('Ignoring non-JSON output from Python worker:', line.slice(0, 200));
+        return;
+      }
+      const current = this.current;
+      if (!current || message?.id == null || String(message.id) !== current.job.id) return;
+      if (message.type === 'screen' || message.type === 'delta' || message.type === 'reset') {
+        current.job.onEvent?.({ type: message.type, text: message.text, screen: message.screen });
+        return;
+      }
+      clearTimeout(current.timer);
+      this.current = null;
+      current.job.resolve(message);
+      this.onIdle();
+    });
+
+    proc.stderr.on('data', (data) => {
+      // Keep only the tail; it is surfaced if the worker dies
+      this.stderr = (this.stderr + data.toString()).slice(-4000);
+    });
+
+    // Write failures surface through the 'exit' handler below
+    proc.stdin.on('error', () => {});
+
+    proc.on('error', (error) => {
+      if (this.proc === proc) this.fail(new Error(`Failed to start Python process: ${error.message}`));
+    });
+
+    proc.on('exit', (code) => {
+      if (this.proc === proc) this.fail(new Error(`Python worker exited with code ${code}: ${this.stderr}`));
+    });
+
+    return proc;
+  }
+
+  /**
+   * Drop the process and reject the request it was running, then let the
+   * pool hand this worker (and a fresh process) the next queued request
+   */
+  private fail(error: Error) {
+    this.proc = null;
+    const current = this.current;
+    this.current = null;
+    if (current) {
+      clearTimeout(current.timer);
+      current.job.reject(error);
+    }
+    this.onIdle();
+  }
+
+  /**
+   * Send one request; its timeout starts now, not when it was queued
+   */
+  run(job: Job) {
+    const proc = this.ensureStarted();
+    const timer = setTimeout(() => {
+      // A stuck worker would block everything queued behind it; restart it
+      this.kill(new Error('Python process timeout'));
+    }, job.timeoutMs);
+    this.current = { job, timer };
+    const message = job.onEvent ? { id: job.id, ...job.payload, stream: true } : { id: job.id, ...job.payload };
+    proc.stdin.write(JSON.stringify(message) + '\n');
+  }
+
+  kill(error = new Error('Python worker restarted')) {
+    const proc = this.proc;
+    if (proc) {
+      this.fail(error);
+      proc.kill();
+    }
+  }
+}
+
+/**
+ * Small pool of warm Python workers so each check avoids interpreter start-up.
+ * Requests wait in one queue and go to the next idle worker, so a slow or
+ * killed worker only affects the request it was running
+ */
+export class PythonWorkerPool {
+  private workers: PythonWorker[];
+  private queue: Job[] = [];
+  private counter = 0;
+  private closed = false;
+
+  constructor(pythonBin: string, scriptPath: string, size: number) {
+    this.workers = Array.from(
+      { length: Math.max(1, size) },
+      () => new PythonWorker(pythonBin, scriptPath, () => this.dispatch())
+    );
+  }
+
+  /**
+   * Queue one request for the next idle worker. `timeoutMs` counts from the
+   * moment a worker starts it. With `onEvent` the answer is streamed:
+   * screen/delta/reset events arrive before the promise resolves
+   */
+  request(
+    payload: Record<string, any>,
+    timeoutMs = 30000,
+    onEvent?: (event: StreamEvent) => void
+  ): Promise<any> {
+    if (this.closed) return Promise.reject(new Error('Python worker pool is shut down'));
+    const id = `${process.pid}-${++this.counter}`;
+    return new Promise((resolve, reject) => {
+      this.queue.push({ id, payload, timeoutMs, onEvent, resolve, reject });
+      this.dispatch();
+    });
+  }
+
+  private dispatch() {
+    if (this.closed) return;
+    for (const worker of this.workers) {
+      if (this.queue.length === 0) return;
+      if (!worker.busy) worker.run(this.queue.shift()!);
+    }
+  }
+
+  shutdown() {
+    this.closed = true;
+    const error = new Error('Python worker pool is shut down');
+    this.queue.splice(0).forEach(job => job.reject(error));
+    this.workers.forEach(w => w.kill(error));
+  }
+}
@@ -3,9 +3,10 @@ import json
 import traceback
 import streamlit as st
 from dotenv import load_dotenv
-from src.fda_api import fetch_fda_label
-from src.rag_pipeline import run_rag_pipeline
-from src.utils import load_sample_labels, logger, show_api_status
+from src.fda_api import fetch_fda_labels
+from src.rag_pipeline import preload, stream_rag_pipeline
+from src.utils import LOG_FILE, check_api_status, load_sample_labels, logger, show_api_status, tail_lines
+from src.cache_store import get_cache
 
 # -------------------------------
 # Load environment
@@ -27,11 +28,40 @@ All steps are logged and visible in the Debug panel.
 """
 )
 
+# -------------------------------
+# Cached across reruns (Streamlit re-executes this file on every interaction)
+# -------------------------------
+API_STATUS_TTL = int(os.getenv("API_STATUS_TTL_S", "600"))
+LOG_TAIL_LINES = 200
+
+
+@st.cache_data(ttl=API_STATUS_TTL, show_spinner="Checking LLM providers...")
+def cached_api_status():
+    # Real completions against every provider; only on first load, expiry or refresh
+    return check_api_status()
+
+
+@st.cache_resource
+def cached_sample_labels():
+    return load_sample_labels()
+
+
+@st.cache_resource
+def warm_pipeline():
+    # Imports the optional LLM/LangChain clients once per server process
+    preload()
+    return True
+
+
+warm_pipeline()
+
 # -------------------------------
 # 🔍 API Connectivity Check (NEW)
 # -------------------------------
 st.markdown("---")
-show_api_status()
+if st.button("Re-check APIs"):
+    cached_api_status.clear()
+show_api_status(cached_api_status())
 st.markdown("---")
 
 # -------------------------------
@@ -54,8 +84,7 @@ drug_input = st.text_input(
 # -------------------------------
 # Sample labels
 # -------------------------------
-sample_labels_path = os.path.join("data", "sample_labels.json")
-sample_labels = load_sample_labels(sample_labels_path)
+sample_labels = cached_sample_labels()
 
 # -------------------------------
 # Columns
@@ -69,20 +98,19 @@ with col1:
 
         all_texts = []
         fetch_results = {}
-        for d in drug_list:
-            try:
-                res = fetch_fda_label(d)
-                fetch_results[d] = res
-                if res.get("success") and res.get("text"):
-                    all_texts.append(f"{d}:\n{res.get('text')}")
-                else:
-                    st.warning(
-                        f"No label text for '{d}'. "
-                        f"Reason: {res.get('error')[:200] if res.get('error') else 'unknown'}"
-                    )
-            except Exception as e:
-                logger.exception("Unhandled exception while fetching %s: %s", d, e)
-                st.error(f"Unhandled error fetching {d}: {e}")
+        try:
+            fetch_results = fetch_fda_labels(drug_list)
+        except Exception as e:
+            logger.exception("Unhandled exception while fetching %s: %s", drug_list, e)
+            st.error(f"Unhandled error fetching labels: {e}")
+        for d, res in fetch_results.items():
+            if res.get("success") and res.get("text"):
+                all_texts.append(f"{d}:\n{res.get('text')}")
+            else:
+                st.warning(
+                    f"No label text for '{d}'. "
+                    f"Reason: {res.get('error')[:200] if res.get('error') else 'unknown'}"
+                )
 
         if not all_texts:
             # fallback to sample_labels
@@ -104,12 +132,42 @@ with col1:
         # Run RAG pipeline
         st.info("Running RAG pipeline (this may take a few seconds)...")
         try:
-            result = run_rag_pipeline(all_texts, drug_list, top_k=5)
+            st.subheader("Label screen:")
+            screen_area = st.empty()
+            st.subheader("Summary (LLM / fallback):")
+            summary_area = st.empty()
+            result = {}
+
+            def show_screen(screen):
+                # Rule-based findings are ready before the LLM starts answering
+                with screen_area.container():
+                    if not screen["findings"]:
+                        st.write("No label mentions the other drugs or their classes.")
+                    for f in screen["findings"]:
+                        via = "" if f["via"] == "drug" else f" ({f['via']})"
+                        mechanisms = f" — {', '.join(f['mechanisms'])}" if f["mechanisms"] else ""
+                        st.write(f"**{f['severity']}**: {f['label']} label mentions {f['mentions']}{via}{mechanisms}")
+                        st.caption(f["evidence"])
+
+            def answer_tokens():
+                # Show tokens as they arrive; keep the final result for below
+                for event in stream_rag_pipeline(all_texts, drug_list, top_k=5):
+                    if event["type"] == "screen":
+                        show_screen(event["screen"])
+                    elif event["type"] == "delta":
+                        yield event["text"]
+                    elif event["type"] == "reset":
+                        yield "\n\n_(provider failed, retrying with the next one)_\n\n"
+                    elif event["type"] == "result":
+                        result.update(event["result"])
+
+            with summary_area.container():
+                streamed = st.write_stream(answer_tokens())
             if result.get("success"):
-                st.subheader("Summary (LLM / fallback):")
-                st.write(result.get("answer"))
+                if result.get("answer") != (streamed or "").strip():
+                    summary_area.write(result.get("answer"))
             else:
-                st.error("RAG pipeline failed. See Debug for details.")
+                summary_area.error("RAG pipeline failed. See Debug for details.")
 
             # Show debug info
             st.subheader("Debug")
@@ -126,16 +184,15 @@ with col1:
             st.write(f"**{d}** — source: {r.get('source')}, success: {r.get('success')}")
             if not r.get("success"):
                 st.write("  Error: " + str(r.get("error") or "unknown"))
+        st.write("Label cache:")
+        st.json(get_cache().stats())
 
 with col2:
     st.subheader("Debug → Logs")
     try:
-        # display last 200 lines of log safely
-        log_path = os.path.join(os.path.dirname(__file__), "logs", "app.log")
-        if os.path.exists(log_path):
-            with open(log_path, "r", encoding="utf-8", errors="ignore") as f:
-                lines = f.readlines()[-200:]
-                st.text("".join(lines))
+        # display the last lines of the log, read backwards from the end
+        if LOG_FILE.exists():
+            st.text("".join(tail_lines(LOG_FILE, LOG_TAIL_LINES)))
         else:
             st.text("No log file yet. Logs will appear here after you run a check.")
     except Exception as e:
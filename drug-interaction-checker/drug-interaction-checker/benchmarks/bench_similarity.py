@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Similarity fallback benchmark: the old pure-Python cosine loop versus the
+batched NumPy top_k_cosine used when FAISS is unavailable.
+
+Usage:
+    python benchmarks/bench_similarity.py [--sizes 1000 2000 5000] [--dim 1536] [--top-k 5]
+"""
+import argparse
+import math
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.embedding_store import top_k_cosine  # noqa: E402
+
+
+def python_loop_top_k(doc_vecs, query_vec, top_k):
+    """The pre-NumPy fallback from run_rag_pipeline, kept as the baseline."""
+    def cosine(a, b):
+        dot = sum(x * y for x, y in zip(a, b))
+        na = math.sqrt(sum(x * x for x in a))
+        nb = math.sqrt(sum(y * y for y in b))
+        return dot / (na * nb + 1e-12)
+    sims = [(i, cosine(query_vec, v)) for i, v in enumerate(doc_vecs)]
+    sims.sort(key=lambda x: x[1], reverse=True)
+    return [i for i, _ in sims[:top_k]]
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2000, 5000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    print(f"{'chunks':>8} {'python loop':>14} {'numpy':>12} {'speedup':>9}  same top-k")
+    for n in args.sizes:
+        matrix = rng.standard_normal((n, args.dim), dtype=np.float32)
+        query = rng.standard_normal(args.dim, dtype=np.float32)
+        as_lists = matrix.tolist()
+        query_list = query.tolist()
+
+        slow, slow_top = best_of(lambda: python_loop_top_k(as_lists, query_list, args.top_k), args.repeat)
+        fast, fast_top = best_of(lambda: top_k_cosine(matrix, query, args.top_k), args.repeat)
+        same = list(slow_top) == [int(i) for i in fast_top]
+        print(f"{n:>8} {slow * 1000:>11.1f} ms {fast * 1000:>9.2f} ms {slow / fast:>8.0f}x  {same}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
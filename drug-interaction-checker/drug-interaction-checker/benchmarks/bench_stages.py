@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Stage-level benchmark for the interaction pipeline, fully offline.
+
+A local stand-in for openFDA (/drug/label.json and /drug/event.json) is
+seeded from the raw labels in cache/*.json; labels can be inflated
+(--sizes, a multiplier on the label sections we read) and padded with
+synthetic drugs (--drugs). The LLM is a stub Gemini model and, for the
+embedding retrieval stage, embeddings come from a stub LangChain class, each
+with configurable latency. The label cache, label mirror, BM25 indexes,
+embedding store and log file live in a temporary directory, so the real
+caches and logs are never touched.
+
+Every stage is timed on its own, cold (its caches emptied) and warm, and the
+median over --repeat runs is reported:
+
+    fetch        fetch_fda_labels
+    split        label_chunks (slicing the chunks stored at cache-write time)
+    bm25         retrieve_contexts via BM25
+    embeddings   retrieve_contexts via the embedding store
+    allergies    allergy_summary_context
+    prompt       pack_contexts + _safe_prompt_for_llm
+    llm          generate_answer (stub provider)
+    pipeline     run_rag_pipeline
+    end_to_end   check_interactions
+
+Usage:
+    python benchmarks/bench_stages.py [--drugs 2 4 6] [--sizes 1 4 16] [--repeat 5]
+    python benchmarks/bench_stages.py --output baseline.json
+    python benchmarks/bench_stages.py --compare baseline.json
+"""
+import argparse
+import copy
+import hashlib
+import json
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+SEED_DIRS = [PROJECT_ROOT / "cache", PROJECT_ROOT / "data" / "cache"]
+TEXT_FIELDS = ["warnings", "drug_interactions", "contraindications", "precautions"]
+STAGES = ["fetch", "split", "bm25", "embeddings", "allergies", "prompt", "llm", "pipeline", "end_to_end"]
+
+_GENERIC_RE = re.compile(r'openfda\.generic_name:"([^"]+)"')
+_EVENT_DRUG_RE = re.compile(r"patient\.drug\.medicinalproduct:([^+ ]+)")
+
+
+# ------------------ Fake openFDA ------------------
+def load_seed_labels():
+    """Raw openFDA label documents from the legacy JSON caches, keyed by drug."""
+    seeds = {}
+    for directory in SEED_DIRS:
+        for path in sorted(directory.glob("*.json")):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    raw = json.load(f).get("raw")
+            except Exception:
+                continue
+            if isinstance(raw, dict):
+                seeds.setdefault(path.stem, raw)
+    return seeds
+
+
+def build_corpus(seeds, n_drugs, size):
+    """``n_drugs`` label documents with their text sections repeated ``size`` times."""
+    names = sorted(seeds)
+    corpus = {}
+    for i in range(n_drugs):
+        base = names[i % len(names)]
+        name = base if i < len(names) else f"synthdrug{i}"
+        raw = copy.deepcopy(seeds[base])
+        raw.setdefault("openfda", {})["generic_name"] = [name.upper()]
+        for field in TEXT_FIELDS:
+            if isinstance(raw.get(field), list):
+                raw[field] = raw[field] * size
+        corpus[name] = raw
+    return corpus
+
+
+def fake_events(drug):
+    """A deterministic handful of FAERS-style reports for ``drug``."""
+    h = int(hashlib.sha1(drug.encode("utf-8")).hexdigest(), 16)
+    reactions = ["Rash", "Urticaria", "Hypersensitivity", "Nausea", "Anaphylactic reaction"]
+    return [
+        {"patient": {"reaction": [{"reactionmeddrapt": reactions[(h >> k) % len(reactions)]}]}}
+        for k in range(h % 6)
+    ]
+
+
+class FakeOpenFDA:
+    """openFDA look-alike on a local port, serving a mutable label corpus."""
+
+    def __init__(self, latency_ms=0.0):
+        self.corpus = {}
+        self.latency = latency_ms / 1000.0
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                url = urlparse(self.path)
+                search = parse_qs(url.query).get("search", [""])[0]
+                if url.path == "/drug/label.json":
+                    wanted = [n.lower() for n in _GENERIC_RE.findall(search)]
+                    results = [
+                        raw for name, raw in server.corpus.items()
+                        if any(w in name.lower() for w in wanted)
+                    ]
+                elif url.path == "/drug/event.json":
+                    match = _EVENT_DRUG_RE.search(search)
+                    results = fake_events(match.group(1).lower()) if match else []
+                else:
+                    results = []
+                if results:
+                    self._reply(200, {"meta": {}, "results": results})
+                else:
+                    self._reply(404, {"error": {"code": "NOT_FOUND", "message": "No matches found!"}})
+
+            def _reply(self, status, body):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.root = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+# ------------------ Stub providers ------------------
+class StubEmbeddings:
+    """Deterministic hashed bag-of-words vectors with per-call latency."""
+    model = "bench-stub"
+    dim = 256
+    latency = 0.0
+
+    def _vec(self, text):
+        v = np.zeros(self.dim, dtype=np.float32)
+        for token in re.findall(r"[a-z0-9]+", text.lower()):
+            v[int(hashlib.md5(token.encode("utf-8")).hexdigest()[:8], 16) % self.dim] += 1.0
+        return v.tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency)
+        return [self._vec(t) for t in texts]
+
+    def embed_query(self, text):
+        time.sleep(self.latency)
+        return self._vec(text)
+
+
+class StubGenAI:
+    """Stands in for the configured google.generativeai module."""
+    latency = 0.0
+
+    class GenerativeModel:
+        def __init__(self, name):
+            self.name = name
+
+        def generate_content(self, prompt, stream=False):
+            time.sleep(StubGenAI.latency)
+            first = prompt.split("\n", 1)[0][:80]
+
+            class Response:
+                text = f"Moderate interaction expected ({len(prompt)} prompt chars). {first}"
+            return [Response()] if stream else Response()
+
+
+# ------------------ Harness ------------------
+def median_ms(fn, repeat, reset=None):
+    samples = []
+    for _ in range(repeat):
+        if reset is not None:
+            reset()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+def run(args):
+    tmp = tempfile.TemporaryDirectory(prefix="bench_stages_")
+    server = FakeOpenFDA(latency_ms=args.openfda_ms)
+    # Must be set before the src modules read them at import time
+    os.environ["OPENFDA_ROOT"] = server.root
+    os.environ["LABEL_CACHE_DB"] = str(Path(tmp.name) / "labels.sqlite3")
+    # Never draw on (or get throttled by) the real openFDA quota
+    os.environ["OPENFDA_RATE_DB"] = str(Path(tmp.name) / "openfda_rate.sqlite3")
+    # A real label mirror would answer the fetch stage instead of the fake server
+    os.environ["LABEL_MIRROR_DB"] = str(Path(tmp.name) / "label_mirror.sqlite3")
+    os.environ["LOG_FILE"] = str(Path(tmp.name) / "app.log")
+    for var in ("OPENAI_API_KEY", "GOOGLE_API_KEY"):
+        os.environ.pop(var, None)
+
+    from src import bm25, embedding_store, interaction_index, name_resolver, rag_pipeline
+    from src.cache_store import get_cache
+    from src.check_interactions import check_interactions
+    from src.fda_api import fetch_fda_labels
+
+    embedding_store.EMBEDDING_CACHE_DIR = Path(tmp.name) / "embeddings"
+    StubEmbeddings.latency = args.embed_ms / 1000.0
+    StubGenAI.latency = args.llm_ms / 1000.0
+    rag_pipeline._gemini = lambda: StubGenAI
+    cache = get_cache()
+
+    def clear(*namespaces):
+        for ns in namespaces:
+            cache._conn().execute("DELETE FROM entries WHERE namespace = ?", (ns,))
+        if "bm25" in namespaces:
+            bm25._memo.clear()
+        if "mentions" in namespaces:
+            interaction_index._memo.clear()
+        if "names" in namespaces:
+            name_resolver._backfill_checked = False
+            name_resolver._fuzzy.invalidate()
+
+    def clear_embeddings():
+        shutil.rmtree(embedding_store.EMBEDDING_CACHE_DIR, ignore_errors=True)
+        embedding_store.get_embedding_store.cache_clear()
+
+    def with_embeddings(fn):
+        saved = rag_pipeline._langchain_installed, rag_pipeline._embeddings_cls
+        rag_pipeline._langchain_installed = lambda: True
+        rag_pipeline._embeddings_cls = lambda: StubEmbeddings
+        os.environ["OPENAI_API_KEY"] = "bench-stub"
+        try:
+            return fn()
+        finally:
+            rag_pipeline._langchain_installed, rag_pipeline._embeddings_cls = saved
+            os.environ.pop("OPENAI_API_KEY", None)
+
+    everything = ("labels", "labels_raw", "labels_missing", "allergies", "bm25", "verdicts", "mentions",
+                  "names", "names_meta")
+    seeds = load_seed_labels()
+    if not seeds:
+        raise SystemExit("No seed labels found in cache/*.json")
+
+    results = []
+    try:
+        for size in args.sizes:
+            for n_drugs in args.drugs:
+                server.corpus = build_corpus(seeds, n_drugs, size)
+                drugs = list(server.corpus)
+                clear(*everything)
+                clear_embeddings()
+
+                labels = fetch_fda_labels(drugs)
+                texts = [f"{d}:\n{r['text']}" for d, r in labels.items() if r.get("success")]
+                contexts, chunk_drugs = rag_pipeline.label_chunks(labels)
+                retrieved = rag_pipeline.retrieve_contexts(contexts, chunk_drugs, drugs)
+                allergy = rag_pipeline.allergy_summary_context(drugs)
+                build_prompt = lambda: rag_pipeline._safe_prompt_for_llm(
+                    drugs, rag_pipeline.pack_contexts(retrieved, allergy))
+                prompt = build_prompt()
+
+                def retrieve_embeddings():
+                    with_embeddings(lambda: rag_pipeline.retrieve_contexts(contexts, chunk_drugs, drugs))
+
+                stages = {
+                    "fetch": (lambda: fetch_fda_labels(drugs), lambda: clear("labels", "labels_raw")),
+                    "split": (lambda: rag_pipeline.label_chunks(labels), None),
+                    "bm25": (lambda: rag_pipeline.retrieve_contexts(contexts, chunk_drugs, drugs),
+                             lambda: clear("bm25")),
+                    "embeddings": (retrieve_embeddings, clear_embeddings),
+                    "allergies": (lambda: rag_pipeline.allergy_summary_context(drugs), lambda: clear("allergies")),
+                    "prompt": (build_prompt, None),
+                    "llm": (lambda: rag_pipeline.generate_answer(prompt), None),
+                    "pipeline": (lambda: rag_pipeline.run_rag_pipeline(texts, drugs, chunks=(contexts, chunk_drugs)),
+                                 lambda: clear("bm25", "allergies", "verdicts")),
+                    "end_to_end": (lambda: check_interactions(drugs), lambda: clear(*everything)),
+                }
+                for stage in args.stages:
+                    fn, reset = stages[stage]
+                    cold = median_ms(fn, args.repeat, reset) if reset else None
+                    warm = median_ms(fn, args.repeat)
+                    results.append({
+                        "drugs": n_drugs, "size": size, "stage": stage,
+                        "cold_ms": cold, "warm_ms": warm,
+                    })
+                results.append({
+                    "drugs": n_drugs, "size": size, "stage": "_shape",
+                    "label_chars": sum(len(t) for t in texts), "chunks": len(contexts),
+                    "prompt_chars": len(prompt),
+                })
+    finally:
+        server.close()
+        tmp.cleanup()
+
+    return {
+        "config": {
+            "drugs": args.drugs, "sizes": args.sizes, "repeat": args.repeat,
+            "openfda_ms": args.openfda_ms, "embed_ms": args.embed_ms, "llm_ms": args.llm_ms,
+        },
+        "results": results,
+    }
+
+
+def _fmt(value):
+    return f"{value:10.2f}" if value is not None else f"{'-':>10}"
+
+
+def report(data, baseline=None):
+    previous = {}
+    for row in (baseline or {}).get("results", []):
+        previous[(row["drugs"], row["size"], row["stage"])] = row
+
+    header = f"{'drugs':>5} {'size':>4} {'stage':<11} {'cold ms':>10} {'warm ms':>10}"
+    if baseline:
+        header += f" {'cold Δ%':>9} {'warm Δ%':>9}"
+    print(header)
+    for row in data["results"]:
+        if row["stage"] == "_shape":
+            print(f"{row['drugs']:>5} {row['size']:>4} {'(shape)':<11} {row['label_chars']} label chars, "
+                  f"{row['chunks']} chunks, {row['prompt_chars']} prompt chars")
+            continue
+        line = f"{row['drugs']:>5} {row['size']:>4} {row['stage']:<11} {_fmt(row['cold_ms'])} {_fmt(row['warm_ms'])}"
+        if baseline:
+            before = previous.get((row["drugs"], row["size"], row["stage"]), {})
+            for field in ("cold_ms", "warm_ms"):
+                old, new = before.get(field), row[field]
+                delta = f"{(new - old) / old * 100:+.1f}" if old and new is not None else "-"
+                line += f" {delta:>9}"
+        print(line)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--drugs", type=int, nargs="+", default=[2, 4, 6], help="Drug counts per check")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 4, 16], help="Label size multipliers")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--openfda-ms", type=float, default=0.0, help="Added latency per fake openFDA request")
+    parser.add_argument("--embed-ms", type=float, default=0.0, help="Added latency per stub embedding call")
+    parser.add_argument("--llm-ms", type=float, default=0.0, help="Added latency per stub LLM call")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Baseline JSON from an earlier --output run to diff against")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    data = run(args)
+    report(data, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
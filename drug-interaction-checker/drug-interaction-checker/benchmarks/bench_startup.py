@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark: time from interpreter start to the first result.
+
+Each run launches a fresh interpreter that imports the pipeline, serves a
+label from the local cache and builds the rule-based fallback summary (the
+cheapest end-to-end path, with no network and no LLM). The child reports
+which heavy optional packages it ended up importing; any of them showing up
+on this path is an import-time regression.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 5] [--drug warfarin] [--max-seconds 2.0]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Packages that must not be imported on the cache -> fallback-summary path
+HEAVY_MODULES = ["openai", "google.generativeai", "langchain", "faiss", "streamlit"]
+
+CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {root!r})
+from src.fda_api import fetch_fda_label
+from src.rag_pipeline import _simple_fallback_summary
+t_import = time.perf_counter()
+label = fetch_fda_label({drug!r})
+summary = _simple_fallback_summary([{drug!r}], [label.get("text") or ""])
+t_done = time.perf_counter()
+print(json.dumps({{
+    "import_s": t_import - t0,
+    "first_result_s": t_done - t0,
+    "source": label.get("source"),
+    "heavy_loaded": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+
+def run_once(drug: str) -> dict:
+    code = CHILD.format(root=str(ROOT), drug=drug, heavy=HEAVY_MODULES)
+    env = dict(os.environ)
+    # Keys would not change this path, but make sure nothing is tempted to use them
+    env.pop("OPENAI_API_KEY", None)
+    env.pop("GOOGLE_API_KEY", None)
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env,
+                          capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"benchmark child failed:\n{proc.stderr}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["wall_s"] = wall
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--drug", default="warfarin", help="A drug present in the label cache")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="Fail if the median wall time exceeds this many seconds")
+    args = parser.parse_args(argv)
+
+    runs = [run_once(args.drug) for _ in range(args.runs)]
+    wall = statistics.median(r["wall_s"] for r in runs)
+    imports = statistics.median(r["import_s"] for r in runs)
+    first = statistics.median(r["first_result_s"] for r in runs)
+    heavy = sorted({m for r in runs for m in r["heavy_loaded"]})
+
+    print(f"runs:                    {args.runs}")
+    print(f"label source:            {runs[-1]['source']}")
+    print(f"median wall (process):   {wall * 1000:.1f} ms")
+    print(f"median import time:      {imports * 1000:.1f} ms")
+    print(f"median to first result:  {first * 1000:.1f} ms")
+    print(f"heavy modules imported:  {', '.join(heavy) if heavy else 'none'}")
+
+    failed = False
+    if heavy:
+        print("FAIL: heavy optional dependencies imported on the cache/fallback path")
+        failed = True
+    if args.max_seconds is not None and wall > args.max_seconds:
+        print(f"FAIL: median wall time {wall:.3f}s exceeds budget {args.max_seconds:.3f}s")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Local BM25 retrieval for when no embedding API is available.
+
+Each label gets an inverted index (term -> [(chunk, term frequency)]) over
+its chunks. Indexes are built once per label text, memoized in-process and
+persisted next to the label cache, so a query only walks the postings of
+its own terms. Several labels are scored together as one corpus. The in-process
+memo keeps the `BM25_MEMO_SIZE` (default 256) most recently used labels.
+"""
+import hashlib
+import heapq
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+from .utils import logger, clean_drug_name, load_cache, save_cache
+
+BM25_CACHE_NAMESPACE = "bm25"
+K1 = 1.5
+B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# drug -> (digest of its chunks, BM25Index), least recently used first. Kept warm in
+# long-lived workers; one entry per drug, so a newer label version replaces the old one.
+MEMO_SIZE = int(os.getenv("BM25_MEMO_SIZE", "256"))
+_memo: "OrderedDict[str, Tuple[str, BM25Index]]" = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    """Inverted index over the chunks of a single label."""
+
+    def __init__(self, postings: Dict[str, List[List[int]]], doc_lens: List[int]):
+        self.postings = postings
+        self.doc_lens = doc_lens
+
+    @classmethod
+    def build(cls, chunks: Sequence[str]) -> "BM25Index":
+        postings: Dict[str, List[List[int]]] = {}
+        doc_lens = []
+        for i, chunk in enumerate(chunks):
+            tokens = tokenize(chunk)
+            doc_lens.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append([i, tf])
+        return cls(postings, doc_lens)
+
+    def to_dict(self) -> dict:
+        return {"postings": self.postings, "doc_lens": self.doc_lens}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        return cls(data["postings"], data["doc_lens"])
+
+
+def _digest(chunks: Sequence[str]) -> str:
+    h = hashlib.sha1()
+    for chunk in chunks:
+        h.update(chunk.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def get_index(drug: str, chunks: Sequence[str]) -> BM25Index:
+    """Index for one label's chunks: from memory, then disk, else built and saved."""
+    drug = clean_drug_name(drug)
+    digest = _digest(chunks)
+    with _memo_lock:
+        entry = _memo.get(drug)
+        if entry is not None and entry[0] == digest:
+            _memo.move_to_end(drug)
+            return entry[1]
+
+    cached = load_cache(drug, namespace=BM25_CACHE_NAMESPACE)
+    if cached and cached.get("digest") == digest:
+        index = BM25Index.from_dict(cached)
+    else:
+        index = BM25Index.build(chunks)
+        try:
+            save_cache(drug, {"digest": digest, **index.to_dict()}, namespace=BM25_CACHE_NAMESPACE)
+        except Exception:
+            logger.exception("Failed to save BM25 index for %s", drug)
+    with _memo_lock:
+        _memo[drug] = (digest, index)
+        _memo.move_to_end(drug)
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+    return index
+
+
+def search(indexes: Sequence[BM25Index], query: str, top_k: int) -> List[Tuple[int, int, float]]:
+    """
+    Score the chunks of several label indexes as a single corpus.
+    Returns up to ``top_k`` (index position, chunk number, score) tuples,
+    best first; chunks sharing no term with the query are never returned.
+    """
+    n_docs = sum(len(ix.doc_lens) for ix in indexes)
+    if n_docs == 0:
+        return []
+    avgdl = sum(sum(ix.doc_lens) for ix in indexes) / n_docs or 1.0
+
+    scores: Dict[Tuple[int, int], float] = defaultdict(float)
+    for term in set(tokenize(query)):
+        df = sum(len(ix.postings.get(term, ())) for ix in indexes)
+        if not df:
+            continue
+        idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        for pos, ix in enumerate(indexes):
+            for doc, tf in ix.postings.get(term, ()):
+                norm = K1 * (1 - B + B * ix.doc_lens[doc] / avgdl)
+                scores[(pos, doc)] += idf * tf * (K1 + 1) / (tf + norm)
+
+    best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+    return [(pos, doc, score) for (pos, doc), score in best]
+
+
+def rank_chunks(contexts: Sequence[str], chunk_drugs: Sequence[str], query: str, top_k: int) -> List[int]:
+    """
+    BM25-rank ``contexts`` (chunks tagged with the drug whose label they
+    came from) against ``query``. Returns positions into ``contexts``.
+    """
+    groups: Dict[str, List[int]] = {}
+    for i, drug in enumerate(chunk_drugs):
+        groups.setdefault(drug, []).append(i)
+
+    drugs = list(groups)
+    indexes = [get_index(d, [contexts[i] for i in groups[d]]) for d in drugs]
+    return [groups[drugs[pos]][doc] for pos, doc, _ in search(indexes, query, top_k)]
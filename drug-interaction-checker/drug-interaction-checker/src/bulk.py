@@ -0,0 +1,181 @@
+"""
+Bulk re-screening: check many prescriptions from a JSONL file in one run.
+
+Each input line is either ``{"id": ..., "drugs": [...]}`` or a bare JSON
+array of drug names. The input is read in chunks of CHUNK_RECORDS: the
+labels of drugs first seen in a chunk are fetched once (so the workers only
+ever hit the cache), then its records are fanned out over a pool of warm
+processes, with at most MAX_PENDING in flight. Results are streamed out as
+JSONL in completion order, each tagged with its record id, and memory stays
+flat however long the input is. A summary with throughput, label cache hit
+rate and failures goes to stderr at the end.
+
+    python src/check_interactions.py --bulk prescriptions.jsonl --processes 4 > results.jsonl
+    cat prescriptions.jsonl | python src/check_interactions.py --bulk -
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Set, TextIO, Union
+
+from .fda_api import fetch_fda_labels
+from .utils import logger
+from .worker import Dispatcher
+
+
+# Records read (and labels prefetched) at a time, and records in flight at most
+CHUNK_RECORDS = int(os.getenv("BULK_CHUNK_RECORDS", "200"))
+MAX_PENDING = int(os.getenv("BULK_MAX_PENDING", "400"))
+
+
+class _InvalidLine:
+    """An input line that is not a record (kept apart from records, which may carry any field)."""
+
+    def __init__(self, lineno: int, error: str):
+        self.id = lineno
+        self.error = error
+
+
+def iter_records(stream: TextIO) -> Iterator[Union[Dict[str, Any], _InvalidLine]]:
+    """Parse JSONL prescriptions lazily; unparseable lines come out as _InvalidLine."""
+    for lineno, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield _InvalidLine(lineno, f"Invalid JSON input: {str(e)}")
+            continue
+        if isinstance(item, list):
+            item = {"drugs": item}
+        if not isinstance(item, dict):
+            yield _InvalidLine(lineno, "Record must be a JSON object or array")
+            continue
+        item.setdefault("id", lineno)
+        yield item
+
+
+def prefetch_labels(records: List[Any], seen: Set[str], labels: Counter):
+    """
+    Fetch each drug not in ``seen`` once so every worker lookup is a cache
+    hit; adds the drugs to ``seen`` and the outcomes to ``labels``.
+    """
+    drugs = list(dict.fromkeys(
+        d for r in records if isinstance(r, dict) and isinstance(r.get("drugs"), list)
+        for d in r["drugs"] if isinstance(d, str) and d not in seen
+    ))
+    if not drugs:
+        return
+    seen.update(drugs)
+    results = fetch_fda_labels(drugs)
+    sources = Counter(r.get("source") if r.get("success") else None for r in results.values())
+    labels["unique_drugs"] += len(drugs)
+    labels["cache_hits"] += sources.get("cache", 0)
+    labels["fetched"] += len(drugs) - sources.get("cache", 0) - sources.get(None, 0)
+    labels["missing"] += sources.get(None, 0)
+
+
+def run_bulk(stream: TextIO, out: TextIO, processes: int = 1) -> Dict[str, Any]:
+    start = time.perf_counter()
+    labels = Counter(unique_drugs=0, cache_hits=0, fetched=0, missing=0)
+    seen: Set[str] = set()
+
+    lock = threading.Lock()
+    pending = threading.BoundedSemaphore(MAX_PENDING)
+    stats = Counter()
+    failures = []
+
+    def write(response: Dict[str, Any]):
+        with lock:
+            out.write(json.dumps(response) + "\n")
+            out.flush()
+            # Streamed requests also emit partial events; only results count
+            if response.get("type", "result") != "result":
+                return
+            if response.get("success"):
+                stats["ok"] += 1
+                stats["verdict_cache_hits"] += 1 if response.get("cached") else 0
+            else:
+                stats["failed"] += 1
+                if len(failures) < 20:
+                    failures.append({"id": response.get("id"), "error": response.get("error")})
+
+    def done(response: Dict[str, Any]):
+        write(response)
+        if response.get("type", "result") == "result":
+            pending.release()
+
+    records = iter_records(stream)
+    dispatcher = Dispatcher(processes)
+    try:
+        while True:
+            chunk = list(itertools.islice(records, CHUNK_RECORDS))
+            if not chunk:
+                break
+            stats["records"] += len(chunk)
+            prefetch_labels(chunk, seen, labels)
+            for record in chunk:
+                if isinstance(record, _InvalidLine):
+                    write({"id": record.id, "success": False, "error": record.error})
+                else:
+                    pending.acquire()
+                    dispatcher.submit(record, done)
+    finally:
+        dispatcher.close()
+
+    elapsed = time.perf_counter() - start
+    lookups = labels["unique_drugs"]
+    return {
+        "records": stats["records"],
+        "succeeded": stats["ok"],
+        "failed": stats["failed"],
+        "elapsed_s": round(elapsed, 3),
+        "records_per_s": round(stats["records"] / elapsed, 2) if elapsed else None,
+        "labels": dict(labels),
+        "label_cache_hit_rate": round(labels["cache_hits"] / lookups, 3) if lookups else None,
+        "verdict_cache_hits": stats["verdict_cache_hits"],
+        "failures": failures,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Check many prescriptions from a JSONL file")
+    parser.add_argument("input", nargs="?", default="-", help="JSONL input file, or - for stdin (default)")
+    parser.add_argument("--output", "-o", help="Write JSONL results here instead of stdout")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    # Keep stray library output off the results stream
+    sys.stdout = sys.stderr
+    stream = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    try:
+        summary = run_bulk(stream, out, processes=max(1, args.processes))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        if args.output:
+            out.close()
+
+    logger.info("Bulk run finished: %s", summary)
+    print(
+        f"Bulk check: {summary['records']} record(s) in {summary['elapsed_s']}s "
+        f"({summary['records_per_s']} records/s); {summary['succeeded']} ok, {summary['failed']} failed\n"
+        f"Labels: {summary['labels']['unique_drugs']} distinct drug(s), "
+        f"cache hit rate {summary['label_cache_hit_rate']}, {summary['labels']['missing']} without a label; "
+        f"verdict cache hits: {summary['verdict_cache_hits']}",
+        file=sys.stderr,
+    )
+    print(json.dumps({"summary": summary}), file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
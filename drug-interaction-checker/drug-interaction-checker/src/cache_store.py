@@ -0,0 +1,276 @@
+"""
+Single-file SQLite cache shared by the CLI, the worker and the Streamlit app.
+
+Replaces the old one-JSON-file-per-drug cache directories, which were
+resolved against the current working directory (and so drifted apart into
+``cache/`` and ``data/cache/``), never expired and had no locking.
+
+* One database at a fixed path (``LABEL_CACHE_DB`` or ``cache/labels.sqlite3``
+  under the project root), in WAL mode so readers never block writers.
+* Entries live in namespaces ("labels", "allergies", ...) and may carry a TTL.
+* Total payload size is kept under a byte budget by evicting the least
+  recently used entries. Triggers keep a running total in ``cache_meta``, so
+  a put never sums the table; access times are written in batches, so a hit
+  is a read only.
+* Every write is a single transaction, so concurrent processes never see a
+  half-written entry.
+* Hit/miss counters are kept per namespace for the life of the process.
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import functools
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .utils import logger, PROJECT_ROOT
+
+CACHE_DB = Path(os.getenv("LABEL_CACHE_DB", PROJECT_ROOT / "cache" / "labels.sqlite3"))
+DEFAULT_MAX_BYTES = int(os.getenv("LABEL_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+DEFAULT_LABEL_TTL = float(os.getenv("LABEL_CACHE_TTL_DAYS", "30")) * 24 * 3600
+
+# Hits record their access time in memory; the times are written (for LRU
+# eviction) once this many have piled up or this many seconds have passed
+ACCESS_FLUSH_BATCH = 256
+ACCESS_FLUSH_S = 30.0
+# Expired entries are dropped on read; a sweep over the table runs at most this often
+EXPIRE_SWEEP_S = 300.0
+
+# Pre-SQLite caches, imported once when the database is first created
+LEGACY_CACHE_DIRS = [PROJECT_ROOT / "cache", PROJECT_ROOT / "data" / "cache"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key       TEXT NOT NULL,
+    value     TEXT NOT NULL,
+    size      INTEGER NOT NULL,
+    created   REAL NOT NULL,
+    accessed  REAL NOT NULL,
+    expires   REAL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE TABLE IF NOT EXISTS cache_meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# Installed in the same transaction that seeds the total (databases predating it)
+_TOTAL_BYTES = """
+BEGIN IMMEDIATE;
+INSERT OR IGNORE INTO cache_meta (key, value) SELECT 'total_bytes', COALESCE(SUM(size), 0) FROM entries;
+CREATE TRIGGER IF NOT EXISTS entries_size_insert AFTER INSERT ON entries BEGIN
+    UPDATE cache_meta SET value = value + NEW.size WHERE key = 'total_bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS entries_size_delete AFTER DELETE ON entries BEGIN
+    UPDATE cache_meta SET value = value - OLD.size WHERE key = 'total_bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS entries_size_update AFTER UPDATE OF size ON entries BEGIN
+    UPDATE cache_meta SET value = value + NEW.size - OLD.size WHERE key = 'total_bytes';
+END;
+COMMIT;
+"""
+
+
+class CacheStore:
+    """Namespaced key -> JSON value cache with TTL and LRU eviction."""
+
+    def __init__(self, path=CACHE_DB, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._counters: Dict[str, Counter] = {}
+        self._counter_lock = threading.Lock()
+        self._touched: Dict[tuple, float] = {}
+        self._touch_lock = threading.Lock()
+        self._last_flush = time.time()
+        self._last_sweep = 0.0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        is_new = not self.path.exists()
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+            if conn.execute("SELECT 1 FROM cache_meta WHERE key = 'total_bytes'").fetchone() is None:
+                conn.executescript(_TOTAL_BYTES)
+        if is_new:
+            self._import_legacy()
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, namespace: str, what: str):
+        with self._counter_lock:
+            self._counters.setdefault(namespace, Counter())[what] += 1
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value, expires FROM entries WHERE namespace = ? AND key = ?",
+            (namespace, key),
+        ).fetchone()
+        if row is None:
+            self._count(namespace, "misses")
+            return None
+        value, expires = row
+        if expires is not None and expires < now:
+            conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+            self._count(namespace, "expired")
+            self._count(namespace, "misses")
+            return None
+        self._count(namespace, "hits")
+        self._touch(namespace, key, now)
+        return json.loads(value)
+
+    def _touch(self, namespace: str, key: str, now: float):
+        with self._touch_lock:
+            self._touched[(namespace, key)] = now
+            due = len(self._touched) >= ACCESS_FLUSH_BATCH or now - self._last_flush >= ACCESS_FLUSH_S
+        if due:
+            self.flush_access_times()
+
+    def _write_access_times(self, conn: sqlite3.Connection):
+        """Write pending access times on ``conn`` (inside the caller's transaction)."""
+        with self._touch_lock:
+            touched, self._touched = self._touched, {}
+            self._last_flush = time.time()
+        if touched:
+            conn.executemany(
+                "UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ? AND accessed < ?",
+                [(at, ns, key, at) for (ns, key), at in touched.items()],
+            )
+
+    def flush_access_times(self):
+        """Write access times recorded by hits since the last flush, in one transaction."""
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_access_times(conn)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            # Only LRU order suffers; never fail a read over it
+            logger.warning("Could not record cache access times: %s", e)
+
+    def put(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        payload = json.dumps(value, separators=(",", ":"))
+        now = time.time()
+        expires = now + ttl if ttl else None
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # An upsert, not INSERT OR REPLACE: REPLACE's implicit delete skips the size triggers
+            conn.execute(
+                "INSERT INTO entries (namespace, key, value, size, created, accessed, expires) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, size = excluded.size, "
+                "created = excluded.created, accessed = excluded.accessed, expires = excluded.expires",
+                (namespace, key, payload, len(payload), now, now, expires),
+            )
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._count(namespace, "writes")
+
+    def keys(self, namespace: str) -> List[str]:
+        """Unexpired keys of a namespace (no values read, no access times touched)."""
+        rows = self._conn().execute(
+            "SELECT key FROM entries WHERE namespace = ? AND (expires IS NULL OR expires >= ?)",
+            (namespace, time.time()),
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def delete(self, namespace: str, key: str):
+        self._conn().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def total_bytes(self, conn: Optional[sqlite3.Connection] = None) -> int:
+        row = (conn or self._conn()).execute("SELECT value FROM cache_meta WHERE key = 'total_bytes'").fetchone()
+        return row[0] if row else 0
+
+    def _evict(self, conn: sqlite3.Connection):
+        now = time.time()
+        total = self.total_bytes(conn)
+        if total > self.max_bytes or now - self._last_sweep >= EXPIRE_SWEEP_S:
+            self._last_sweep = now
+            conn.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires < ?", (now,))
+            total = self.total_bytes(conn)
+        if total <= self.max_bytes:
+            return
+        # Evict by up-to-date recency
+        self._write_access_times(conn)
+        evicted = 0
+        for namespace, key, size in conn.execute(
+            "SELECT namespace, key, size FROM entries ORDER BY accessed ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+            total -= size
+            evicted += 1
+        logger.info("Cache evicted %d entr(ies) to stay under %d bytes", evicted, self.max_bytes)
+
+    def stats(self) -> Dict[str, Any]:
+        rows = self._conn().execute(
+            "SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY namespace"
+        ).fetchall()
+        with self._counter_lock:
+            counters = {ns: dict(c) for ns, c in self._counters.items()}
+        namespaces = {}
+        for ns in set(counters) | {r[0] for r in rows}:
+            c = counters.get(ns, {})
+            hits, misses = c.get("hits", 0), c.get("misses", 0)
+            entry = next((r for r in rows if r[0] == ns), (ns, 0, 0))
+            namespaces[ns] = {
+                "entries": entry[1],
+                "bytes": entry[2],
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+                **{k: v for k, v in c.items() if k not in ("hits", "misses")},
+            }
+        return {"path": str(self.path), "max_bytes": self.max_bytes, "total_bytes": self.total_bytes(),
+                "namespaces": namespaces}
+
+    def _import_legacy(self):
+        """Seed a brand-new database from the old per-drug JSON files (newest wins)."""
+        newest: Dict[str, Path] = {}
+        for directory in LEGACY_CACHE_DIRS:
+            for path in Path(directory).glob("*.json"):
+                if path.stem not in newest or path.stat().st_mtime > newest[path.stem].stat().st_mtime:
+                    newest[path.stem] = path
+        imported = 0
+        for drug, path in newest.items():
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.put("labels", drug, json.load(f), ttl=DEFAULT_LABEL_TTL)
+                imported += 1
+            except Exception as e:
+                logger.warning("Skipping legacy cache file %s: %s", path, e)
+        if imported:
+            logger.info("Imported %d legacy label cache file(s) into %s", imported, self.path)
+
+
+@functools.lru_cache(maxsize=None)
+def get_cache() -> CacheStore:
+    """Process-wide cache store."""
+    store = CacheStore()
+    atexit.register(store.flush_access_times)
+    return store
@@ -2,37 +2,58 @@
 """
 Standalone script to check drug interactions
 Called by Node.js backend via subprocess
+
+Usage:
+    python check_interactions.py '["drug1", "drug2"]' [--raw] [--matrix | --stream]
+    python check_interactions.py --worker [--processes N] [--socket PATH | --port PORT]
+    python check_interactions.py --bulk [FILE | -] [--processes N] [--output FILE]
 """
 import sys
 import json
 import os
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-# Add parent directory to path
-sys.path.insert(0, str(Path(__file__).parent))
+# Add project root to path so the ``src`` package (and its relative imports) resolve
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-from fda_api import fetch_fda_label
-from rag_pipeline import run_rag_pipeline
-from utils import load_sample_labels
+from src.fda_api import fetch_fda_labels, compact_label_result
+from src.interaction_index import screen_interactions
+from src.metrics import span
+from src.rag_pipeline import label_chunks, run_rag_pipeline, stream_rag_pipeline
+from src.utils import load_sample_labels, clean_drug_name, in_context, request_context
+from src.verdict_cache import save_verdict
 
-def check_interactions(drug_list):
+def check_interactions(drug_list, include_raw=False, on_event=None):
     """
     Check interactions for a list of drugs
-    Returns JSON result
+    Returns JSON result; ``fdaData`` holds a compact per-drug summary unless
+    ``include_raw`` asks for the full fetch results with raw openFDA labels.
+    ``on_event`` receives the rule-based screen and then the answer's
+    delta/reset events as they stream in; severity is still parsed from the
+    final text
     """
     try:
-        # Fetch FDA labels
+        # Fetch FDA labels (cache misses are fetched concurrently)
         all_texts = []
         fda_results = {}
+        timing = {}
+        chunks = None
         
-        for drug in drug_list:
-            try:
-                result = fetch_fda_label(drug)
-                fda_results[drug] = result
-                if result.get('success') and result.get('text'):
-                    all_texts.append(f"{drug}:\n{result.get('text')}")
-            except Exception as e:
-                print(f"Error fetching {drug}: {e}", file=sys.stderr)
+        try:
+            with span(timing, "fetch_labels", drugs=len(drug_list)):
+                fda_results = fetch_fda_labels(drug_list, include_raw=include_raw)
+        except Exception as e:
+            print(f"Error fetching labels: {e}", file=sys.stderr)
+        
+        found = {drug: result for drug, result in fda_results.items()
+                 if result.get('success') and result.get('text')}
+        for drug, result in found.items():
+            all_texts.append(f"{drug}:\n{result.get('text')}")
+        if found:
+            # Labels carry the chunk offsets computed when they were cached
+            chunks = label_chunks(found, timing)
         
         # Fallback to sample labels if needed
         if not all_texts:
@@ -43,16 +64,23 @@ def check_interactions(drug_list):
                 all_texts.append(f"{drug}:\n{label_text}")
         
         # Run RAG pipeline
-        rag_result = run_rag_pipeline(all_texts, drug_list, top_k=5)
+        if on_event is None:
+            rag_result = run_rag_pipeline(all_texts, drug_list, top_k=5, chunks=chunks)
+        else:
+            rag_result = {}
+            for event in stream_rag_pipeline(all_texts, drug_list, top_k=5, chunks=chunks):
+                if event['type'] == 'result':
+                    rag_result = event['result']
+                else:
+                    on_event(event)
         
-        # Parse severity from LLM response
-        severity = parse_severity(rag_result.get('answer', ''))
+        severity, safer_alternatives = _verdict_fields(rag_result)
         
         # Determine if interaction detected
         interaction_detected = severity not in ['NONE', 'MILD']
         
-        # Extract alternatives if mentioned
-        safer_alternatives = extract_alternatives(rag_result.get('answer', ''))
+        debug = rag_result.get('debug', {})
+        debug['spans'] = _label_spans(fda_results, timing) + debug.get('spans', [])
         
         return {
             'success': True,
@@ -63,9 +91,13 @@ def check_interactions(drug_list):
             'llm_summary': rag_result.get('answer', ''),
             'saferAlternatives': safer_alternatives,
             'alternatives': safer_alternatives,
-            'fdaData': fda_results,
+            'fdaData': fda_results if include_raw else {
+                drug: compact_label_result(result) for drug, result in fda_results.items()
+            },
             'source': 'openFDA + RAG + LLM',
-            'debug': rag_result.get('debug', {})
+            'cached': rag_result.get('cached', False),
+            'screen': rag_result.get('screen'),
+            'debug': debug
         }
     
     except Exception as e:
@@ -77,6 +109,148 @@ def check_interactions(drug_list):
             'description': f'Error during analysis: {str(e)}'
         }
 
+def _label_spans(fda_results, timing):
+    """Timing spans of the label fetch stage, followed by each drug's own spans"""
+    spans = list(timing.get('spans', []))
+    for result in fda_results.values():
+        spans.extend(result.get('debug', {}).get('spans', []))
+    return spans
+
+def _verdict_fields(rag_result):
+    """Severity and alternatives for a pipeline result, memoized with its verdict"""
+    # A memoized verdict already carries its parsed severity/alternatives
+    verdict = rag_result.get('verdict') or {}
+    answer = rag_result.get('answer') or ''
+    
+    if rag_result.get('verdict_key'):
+        # Parse severity from LLM response
+        severity = verdict.get('severity') or parse_severity(answer)
+    else:
+        # No LLM answered: the fallback is built from the screen, so its
+        # severity (NONE included) is the screen's, not parsed from the text
+        screen = rag_result.get('screen') or {}
+        severity = screen.get('severity') or 'UNKNOWN'
+    
+    # Extract alternatives if mentioned
+    if 'alternatives' in verdict:
+        safer_alternatives = verdict['alternatives']
+    else:
+        safer_alternatives = extract_alternatives(answer)
+    
+    if rag_result.get('verdict_key') and 'severity' not in verdict:
+        try:
+            save_verdict(rag_result['verdict_key'], severity=severity, alternatives=safer_alternatives)
+        except Exception as e:
+            print(f"Error caching verdict: {e}", file=sys.stderr)
+    
+    return severity, safer_alternatives
+
+SEVERITY_ORDER = ['NONE', 'MILD', 'MODERATE', 'SEVERE', 'CRITICAL']
+
+def check_interaction_matrix(drug_list, include_raw=False, previous=None, max_workers=4):
+    """
+    Pairwise (N x N) interaction check for polypharmacy lists
+    Each label is fetched and chunked once and its chunks are reused for
+    every pair it appears in; pairs are evaluated concurrently. Pairs found in
+    ``previous`` (the ``pairs`` of an earlier matrix result) are reused as-is,
+    so adding one drug to a regimen only evaluates the new pairs
+    """
+    try:
+        # "Warfarin" and "warfarin" are one drug, not a pair; the first spelling is kept
+        unique = {}
+        for drug in drug_list:
+            unique.setdefault(clean_drug_name(drug), drug)
+        drugs = list(unique.values())
+        fda_results = {}
+        timing = {}
+        try:
+            with span(timing, "fetch_labels", drugs=len(drugs)):
+                fda_results = fetch_fda_labels(drugs, include_raw=include_raw)
+        except Exception as e:
+            print(f"Error fetching labels: {e}", file=sys.stderr)
+        
+        # Slice every label's stored chunks exactly once
+        chunks_by_drug = {}
+        label_texts = {}
+        for drug in drugs:
+            result = fda_results.get(drug, {})
+            text = result.get('text') if result.get('success') else None
+            chunks_by_drug[drug] = label_chunks({drug: result})
+            if text:
+                label_texts[drug] = text
+        
+        known = {}
+        for pair in previous or []:
+            pair_drugs = pair.get('drugs') if isinstance(pair, dict) else None
+            # Skip malformed entries rather than failing the whole matrix
+            if not (isinstance(pair_drugs, list) and len(pair_drugs) == 2
+                    and all(isinstance(d, str) and d.strip() for d in pair_drugs)
+                    and isinstance(pair.get('severity'), str)):
+                continue
+            known[frozenset(clean_drug_name(d) for d in pair_drugs)] = dict(
+                pair, interactionDetected=pair.get('interactionDetected', pair['severity'] not in ['NONE', 'MILD']))
+        
+        def evaluate(a, b):
+            prior = known.get(frozenset((clean_drug_name(a), clean_drug_name(b))))
+            if prior is not None:
+                return dict(prior, drugs=[a, b], reused=True)
+            contexts = chunks_by_drug[a][0] + chunks_by_drug[b][0]
+            chunk_drugs = chunks_by_drug[a][1] + chunks_by_drug[b][1]
+            # Mention indexes are memoized, so each label is indexed once for all its pairs
+            screen = screen_interactions([a, b], label_texts)
+            rag_result = run_rag_pipeline([], [a, b], top_k=5, chunks=(contexts, chunk_drugs), screen=screen)
+            severity, alternatives = _verdict_fields(rag_result)
+            return {
+                'drugs': [a, b],
+                'severity': severity,
+                'interactionDetected': severity not in ['NONE', 'MILD'],
+                'summary': rag_result.get('answer', ''),
+                'alternatives': alternatives,
+                'cached': rag_result.get('cached', False),
+                'reused': False,
+                'screen': screen,
+                'debug': {'spans': rag_result.get('debug', {}).get('spans', [])},
+            }
+        
+        pairs = list(itertools.combinations(drugs, 2))
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pairs) or 1))) as pool:
+            results = list(pool.map(in_context(lambda p: evaluate(*p)), pairs))
+        
+        index = {drug: i for i, drug in enumerate(drugs)}
+        matrix = [[None] * len(drugs) for _ in drugs]
+        for pair in results:
+            i, j = index[pair['drugs'][0]], index[pair['drugs'][1]]
+            matrix[i][j] = matrix[j][i] = pair['severity']
+        
+        worst = max((p['severity'] for p in results), key=_severity_rank, default='NONE')
+        return {
+            'success': True,
+            'mode': 'matrix',
+            'drugs': drugs,
+            'matrix': matrix,
+            'pairs': results,
+            'interactionDetected': any(p['interactionDetected'] for p in results),
+            'severity': worst,
+            'evaluatedPairs': sum(1 for p in results if not p['reused']),
+            'fdaData': fda_results if include_raw else {
+                drug: compact_label_result(result) for drug, result in fda_results.items()
+            },
+            'source': 'openFDA + RAG + LLM (pairwise)',
+            'debug': {'spans': _label_spans(fda_results, timing)},
+        }
+    
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e),
+            'interactionDetected': False,
+            'severity': 'UNKNOWN',
+            'description': f'Error during analysis: {str(e)}'
+        }
+
+def _severity_rank(severity):
+    return SEVERITY_ORDER.index(severity) if severity in SEVERITY_ORDER else SEVERITY_ORDER.index('MODERATE')
+
 def parse_severity(text):
     """Extract severity from LLM response"""
     text_lower = text.lower()
@@ -119,6 +293,16 @@ if __name__ == '__main__':
         }))
         sys.exit(1)
     
+    if sys.argv[1] == '--worker':
+        # Long-lived NDJSON worker; see src/worker.py
+        from src.worker import main as worker_main
+        sys.exit(worker_main(sys.argv[2:]))
+
+    if sys.argv[1] == '--bulk':
+        # JSONL in, JSONL out; see src/bulk.py
+        from src.bulk import main as bulk_main
+        sys.exit(bulk_main(sys.argv[2:]))
+
     try:
         # Parse drug list from command line argument
         drugs_json = sys.argv[1]
@@ -131,8 +315,20 @@ if __name__ == '__main__':
             }))
             sys.exit(1)
         
-        # Check interactions
-        result = check_interactions(drugs)
+        # Check interactions (--raw ships the full openFDA labels in fdaData,
+        # --matrix evaluates every pair separately, --stream writes the answer
+        # as NDJSON delta lines before the final result line)
+        include_raw = '--raw' in sys.argv[2:]
+        with request_context():
+            if '--matrix' in sys.argv[2:]:
+                result = check_interaction_matrix(drugs, include_raw=include_raw)
+            elif '--stream' in sys.argv[2:]:
+                def emit(event):
+                    print(json.dumps(event), flush=True)
+                result = check_interactions(drugs, include_raw=include_raw, on_event=emit)
+                result['type'] = 'result'
+            else:
+                result = check_interactions(drugs, include_raw=include_raw)
         
         # Output JSON result
         print(json.dumps(result))
@@ -0,0 +1,121 @@
+"""
+Per-provider circuit breakers for the LLM fallback chain.
+
+When a provider is down or rate-limited, every request used to wait for it
+to fail before moving on to the next one. A breaker counts consecutive
+failures per provider; after LLM_BREAKER_FAILURES of them (or a single
+rate-limit error) it opens and the provider is skipped for
+LLM_BREAKER_COOLDOWN_S seconds. After that one request is let through as a
+probe: success closes the breaker, failure opens it again.
+
+State lives in the process, which is what long-lived workers need; a
+one-shot CLI run simply starts with every breaker closed.
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from .utils import logger
+
+FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_S", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """Best-effort detection of HTTP 429 / quota errors across the provider SDKs."""
+    name = type(error).__name__
+    return "RateLimit" in name or "ResourceExhausted" in name or "429" in str(error)
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open probe after a cooldown."""
+
+    def __init__(self, name: str, failure_threshold: int = FAILURE_THRESHOLD,
+                 cooldown: float = COOLDOWN_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.last_error: Optional[str] = None
+        self.counts = {"successes": 0, "failures": 0, "skipped": 0, "opened": 0}
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a request may go to this provider now (claims the probe when half-open)."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            self.counts["skipped"] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("Circuit for %s closed again", self.name)
+            self.state = CLOSED
+            self.failures = 0
+            self.probing = False
+            self.counts["successes"] += 1
+
+    def record_failure(self, error: BaseException):
+        with self._lock:
+            self.failures += 1
+            self.counts["failures"] += 1
+            self.last_error = repr(error)[:200]
+            self.probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold or is_rate_limited(error):
+                if self.state != OPEN:
+                    self.counts["opened"] += 1
+                    logger.warning("Circuit for %s opened for %.0fs after: %s",
+                                   self.name, self.cooldown, self.last_error)
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """Give back a probe that was abandoned without a verdict (e.g. a lost hedge race)."""
+        with self._lock:
+            self.probing = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = max(0.0, self.cooldown - (time.monotonic() - self.opened_at)) if self.state == OPEN else 0.0
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "retry_in_s": round(retry_in, 1),
+                "last_error": self.last_error,
+                **self.counts,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(provider)
+        if breaker is None:
+            breaker = _breakers[provider] = CircuitBreaker(provider)
+        return breaker
+
+
+def breaker_states() -> Dict[str, Dict[str, Any]]:
+    """Snapshot of every provider's breaker, for health endpoints and debugging."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.snapshot() for b in breakers}
@@ -0,0 +1,165 @@
+"""
+Persistent on-disk store for chunk embeddings.
+
+Re-embedding every label chunk on every request is the slowest and most
+expensive part of retrieval, and label text rarely changes. Vectors are
+appended to a flat float32 file that is read back through a NumPy memmap;
+``index.json`` maps ``<drug>/<sha1 of chunk text>`` keys to row numbers.
+Only chunks whose key is not in the index are sent to the embedding API.
+
+Several worker processes share one store, so appending vectors and
+rewriting the index happen under an exclusive lock on ``store.lock``.
+"""
+import hashlib
+import json
+import os
+import threading
+import functools
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, List, Sequence
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+
+from .utils import logger, clean_drug_name, PROJECT_ROOT
+
+EMBEDDING_CACHE_DIR = PROJECT_ROOT / "cache" / "embeddings"
+
+
+class EmbeddingStore:
+    """Append-only embedding store for one embedding model."""
+
+    def __init__(self, directory):
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.dir / "vectors.f32"
+        self.index_path = self.dir / "index.json"
+        self.lock_path = self.dir / "store.lock"
+        self._lock = threading.Lock()
+        self.dim = None
+        self.ids = {}
+        self._load_index()
+
+    @staticmethod
+    def key(drug: str, text: str) -> str:
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        return f"{clean_drug_name(drug)}/{digest}"
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning("Embedding index unreadable, starting empty: %s", e)
+            return
+        self.dim = data.get("dim")
+        self.ids = data.get("ids", {})
+
+    def _matrix(self) -> np.ndarray:
+        if not self.dim or not self.vectors_path.exists():
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        rows = self.vectors_path.stat().st_size // (self.dim * 4)
+        if rows == 0:
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+
+    @contextmanager
+    def _process_lock(self) -> Iterator[None]:
+        """Exclusive lock across processes, held while the files are written."""
+        with open(self.lock_path, "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _append(self, keys: List[str], vectors: np.ndarray):
+        if vectors.ndim != 2 or len(keys) != vectors.shape[0]:
+            raise ValueError("Embedding provider returned an unexpected shape")
+
+        with self._process_lock():
+            # Pick up what other processes wrote meanwhile; their rows win
+            self._load_index()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension changed ({vectors.shape[1]} != {self.dim})")
+            fresh = [i for i, k in enumerate(keys) if k not in self.ids]
+            if not fresh:
+                return
+
+            # Vectors go to disk before the index that points at them
+            with open(self.vectors_path, "ab") as f:
+                f.seek(0, os.SEEK_END)
+                first_row = f.tell() // (self.dim * 4)
+                # Drop a partial row left by a write that crashed midway, or
+                # every row after it would be misaligned with the index
+                f.truncate(first_row * self.dim * 4)
+                f.write(np.ascontiguousarray(vectors[fresh], dtype=np.float32).tobytes())
+            self.ids.update({keys[i]: first_row + n for n, i in enumerate(fresh)})
+
+            tmp = self.index_path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"dim": self.dim, "ids": self.ids}, f)
+            os.replace(tmp, self.index_path)
+
+    def get_or_embed(self, keys: Sequence[str], texts: Sequence[str],
+                     embed_fn: Callable[[List[str]], List[List[float]]]) -> np.ndarray:
+        """
+        Return an (n, dim) float32 array of vectors for ``texts``, calling
+        ``embed_fn`` only for keys not already stored.
+        """
+        with self._lock:
+            if any(k not in self.ids for k in keys):
+                # Another worker may already have embedded them
+                self._load_index()
+            todo = {}
+            for k, t in zip(keys, texts):
+                if k not in self.ids and k not in todo:
+                    todo[k] = t
+            if todo:
+                vectors = np.asarray(embed_fn(list(todo.values())), dtype=np.float32)
+                self._append(list(todo.keys()), vectors)
+                logger.info("Embedded %d new chunk(s) into %s", len(todo), self.dir)
+            matrix = self._matrix()
+            return np.array(matrix[[self.ids[k] for k in keys]])
+
+
+def top_k_cosine(matrix, query, k: int) -> np.ndarray:
+    """
+    Row indices of the ``k`` rows of ``matrix`` most cosine-similar to
+    ``query``, best first. One matrix-vector product scores every row and
+    argpartition picks the top-k without sorting the whole list.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim != 2 or matrix.shape[0] == 0 or k <= 0:
+        return np.empty(0, dtype=np.intp)
+    query = np.asarray(query, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    scores = (matrix @ query) / (norms + 1e-12)
+    k = min(k, scores.shape[0])
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+@functools.lru_cache(maxsize=None)
+def get_embedding_store(model: str = "default") -> EmbeddingStore:
+    """One store per embedding model, shared for the life of the process."""
+    safe_model = "".join(c if c.isalnum() or c in "-_." else "_" for c in model)
+    return EmbeddingStore(Path(EMBEDDING_CACHE_DIR) / safe_model)
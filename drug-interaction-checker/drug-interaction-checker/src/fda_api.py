@@ -1,22 +1,141 @@
 import requests
 import os
+import re
+import functools
+import random
+import time
 import traceback
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 from .utils import (
     clean_drug_name,
+    in_context,
     save_cache,
     load_cache,
     load_sample_labels,
     logger,
 )
+from .metrics import observe, span
+from .rate_limit import OPENFDA_API_KEY, RateLimited, openfda_limiter
+from .name_resolver import base_name, register_label, resolve, suggest
+from .single_flight import Call, SingleFlight
 
-OPENFDA_BASE = "https://api.fda.gov/drug/label.json"
+# OPENFDA_ROOT can point at a local mirror or stand-in server (see benchmarks/)
+OPENFDA_ROOT = os.getenv("OPENFDA_ROOT", "https://api.fda.gov").rstrip("/")
+OPENFDA_BASE = f"{OPENFDA_ROOT}/drug/label.json"
+
+LABEL_FIELDS = ["warnings", "drug_interactions", "contraindications", "precautions"]
+
+# Raw openFDA documents are large (hundreds of KB) and rarely needed, so they
+# are cached under their own namespace and only read when a caller asks.
+RAW_NAMESPACE = "labels_raw"
+
+_SECTION_RE = re.compile(r"(?:^|\n\n)([A-Z][A-Z_]*):\n")
+
+# Labels are chunked once, when they enter the cache, into windows of up to
+# CHUNK_SIZE characters (CHUNK_OVERLAP shared with the previous window) that
+# never cross a section boundary. CHUNKER tags stored chunk lists so a
+# change of settings re-chunks cached labels.
+CHUNK_SIZE = int(os.getenv("LABEL_CHUNK_SIZE", "500"))
+CHUNK_OVERLAP = int(os.getenv("LABEL_CHUNK_OVERLAP", "80"))
+CHUNKER = f"sections-v1:{CHUNK_SIZE}:{CHUNK_OVERLAP}"
+
+# openFDA's "no label for this name" answers are cached for MISSING_TTL
+# seconds, so unknown names (typos, foreign brands) don't cost a round trip
+# on every check. Timeouts and HTTP errors are never cached.
+MISSING_NAMESPACE = "labels_missing"
+MISSING_TTL = float(os.getenv("LABEL_NEGATIVE_TTL_S", "3600"))
+
+# How long a fetch waits for an identical one already in flight before
+# doing its own (see single_flight)
+COALESCE_TIMEOUT = float(os.getenv("LABEL_COALESCE_TIMEOUT_S", "30"))
+_flights = SingleFlight()
+
+# How many generic names go into one OR'ed openFDA search, and how many
+# of those searches run at once in fetch_fda_labels().
+BATCH_SIZE = 5
+MAX_WORKERS = 8
+
+# Only the real API is rate-limited and sent the API key; a local mirror or
+# stand-in server at OPENFDA_ROOT is neither
+OPENFDA_HOST = "api.fda.gov"
+
+# api.fda.gov answers that are worth retrying, after a jittered backoff
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+OPENFDA_RETRIES = int(os.getenv("OPENFDA_RETRIES", "3"))
+BACKOFF_BASE_S = float(os.getenv("OPENFDA_BACKOFF_BASE_S", "0.5"))
+BACKOFF_MAX_S = float(os.getenv("OPENFDA_BACKOFF_MAX_S", "8"))
+
+
+@functools.lru_cache(maxsize=None)
+def http_session() -> requests.Session:
+    """Shared keep-alive session so repeated openFDA calls reuse connections."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def _backoff(attempt: int, resp: Optional[requests.Response]) -> float:
+    """Full-jitter exponential backoff, or the server's Retry-After when it sends one."""
+    retry_after = resp.headers.get("Retry-After") if resp is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), BACKOFF_MAX_S)
+    return random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt))
+
+def redact_url(url: str) -> str:
+    """``url`` without its api_key parameter, for logs and debug output."""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k != "api_key"]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+def openfda_get(url: str, params: Optional[Dict[str, Any]] = None, timeout: float = 10,
+                record: Optional[Dict[str, Any]] = None, **kwargs) -> requests.Response:
+    """
+    GET from openFDA, retrying 429/5xx answers and connection errors with
+    jittered backoff. Requests to api.fda.gov also go through the shared
+    rate limiter (see rate_limit) and carry OPENFDA_API_KEY. The last answer
+    is returned whatever its status. ``record`` (a span) gets ``queued_ms``,
+    ``backoff_ms`` and ``retries``. Raises RateLimited when no token turns
+    up within OPENFDA_MAX_QUEUE_S.
+    """
+    limited = urlsplit(url).hostname == OPENFDA_HOST
+    params = dict(params or {})
+    if OPENFDA_API_KEY and limited:
+        params["api_key"] = OPENFDA_API_KEY
+    queued = backoff = 0.0
+    attempt = 0
+    try:
+        while True:
+            if limited:
+                waited = openfda_limiter().acquire()
+                observe("openfda_queue", waited)
+                queued += waited
+            resp, error = None, None
+            try:
+                resp = http_session().get(url, params=params, timeout=timeout, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                error = e
+            if attempt >= OPENFDA_RETRIES or (error is None and resp.status_code not in RETRY_STATUSES):
+                if error is not None:
+                    raise error
+                return resp
+            delay = _backoff(attempt, resp)
+            logger.warning("openFDA %s (attempt %d), retrying in %.2fs: %s", error or f"HTTP {resp.status_code}",
+                           attempt + 1, delay, url)
+            time.sleep(delay)
+            backoff += delay
+            attempt += 1
+    finally:
+        if record is not None:
+            record.update(queued_ms=round(queued * 1000, 2), backoff_ms=round(backoff * 1000, 2), retries=attempt)
 
 def _make_label_text_from_result(result: Dict[str, Any]) -> str:
     pieces = []
-    fields = ["warnings", "drug_interactions", "contraindications", "precautions"]
-    for f in fields:
+    for f in LABEL_FIELDS:
         if f in result:
             try:
                 if isinstance(result[f], list):
@@ -27,69 +146,291 @@ def _make_label_text_from_result(result: Dict[str, Any]) -> str:
                 pieces.append(f"{f.upper()}:\n" + str(result[f]))
     return "\n\n".join(pieces).strip()
 
-def fetch_fda_label(drug_name: str, use_cache: bool = True, logger_debug: bool = True) -> Dict[str, Any]:
-    drug_clean = clean_drug_name(drug_name)
+def label_sections(label_text: str) -> List[Dict[str, Any]]:
+    """
+    Locate the "FIELD:\n" sections that _make_label_text_from_result (and the
+    sample fallback) write. Returns name/start/end offsets of each body.
+    """
+    matches = list(_SECTION_RE.finditer(label_text or ""))
+    sections = []
+    for m, nxt in zip(matches, matches[1:] + [None]):
+        end = nxt.start() if nxt else len(label_text)
+        sections.append({"name": m.group(1).lower(), "start": m.end(), "end": end})
+    return sections
+
+def _break_before(text: str, lo: int, hi: int) -> int:
+    """Offset to end a chunk at: the last line, sentence or word break in text[lo:hi]."""
+    for sep, keep in (("\n", 0), (". ", 1), ("; ", 1), (" ", 0)):
+        i = text.rfind(sep, lo, hi)
+        if i > lo:
+            return i + keep
+    return hi
+
+def chunk_label(label_text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[Dict[str, Any]]:
+    """
+    Section-aware chunks of a label as ``{"section", "start", "end"}``
+    offsets into ``label_text``. Windows end at a line, sentence or word
+    break where possible; text without section headers is one "label" section.
+    """
+    text = label_text or ""
+    sections = label_sections(text) or ([{"name": "label", "start": 0, "end": len(text)}] if text else [])
+    chunks = []
+    for section in sections:
+        start, end = section["start"], section["end"]
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        pos = start
+        while pos < end:
+            stop = end if pos + size >= end else _break_before(text, pos + size // 2, pos + size)
+            chunks.append({"section": section["name"], "start": pos, "end": stop})
+            if stop >= end:
+                break
+            # Step back by the overlap, to the start of a word
+            nxt = max(stop - overlap, pos + 1)
+            space = text.find(" ", nxt, stop)
+            pos = space + 1 if space != -1 else nxt
+            while pos < end and text[pos].isspace():
+                pos += 1
+    return chunks
+
+def compact_label_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Slim projection of a fetch result: what callers get unless they ask for raw labels."""
+    text = result.get("text") or ""
+    compact = {
+        "drug": result.get("drug"),
+        "success": result.get("success"),
+        "source": result.get("source"),
+        "text_length": len(text),
+        "sections": {s["name"]: s["end"] - s["start"] for s in label_sections(text)},
+        "chunks": len(result.get("chunks") or []),
+    }
+    if result.get("error"):
+        compact["error"] = result["error"]
+    for key in ("resolvedFrom", "didYouMean"):
+        if result.get(key):
+            compact[key] = result[key]
+    return compact
+
+def _openfda_names(raw: Dict[str, Any]) -> Dict[str, List[str]]:
+    names = raw.get("openfda", {}) if isinstance(raw, dict) else {}
+    return {k: names.get(k, []) for k in ("generic_name", "brand_name", "substance_name")}
+
+def _cache_label(drug_clean: str, label_text: str, raw: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Cache the slim label entry, with its chunks, and the raw openFDA document
+    separately. Returns the chunks.
+    """
+    chunks = chunk_label(label_text)
+    names = _openfda_names(raw)
+    save_cache(drug_clean, {"text": label_text, "openfda": names,
+                            "chunks": chunks, "chunker": CHUNKER})
+    save_cache(drug_clean, raw, namespace=RAW_NAMESPACE)
+    register_label(drug_clean, names)
+    return chunks
+
+def _load_cached_label(drug_clean: str, include_raw: bool) -> Optional[Dict[str, Any]]:
+    cached = load_cache(drug_clean)
+    if not cached:
+        return None
+    if "raw" in cached:
+        # Entry from before raw documents were split out; split it once
+        raw = cached["raw"]
+        try:
+            _cache_label(drug_clean, cached.get("text"), raw)
+        except Exception:
+            logger.exception("Failed to re-cache %s without raw label", drug_clean)
+    else:
+        raw = load_cache(drug_clean, namespace=RAW_NAMESPACE) if include_raw else None
+        if cached.get("chunker") != CHUNKER:
+            # Cached before chunking (or with other settings); chunk it once
+            cached = dict(cached, chunks=chunk_label(cached.get("text")), chunker=CHUNKER)
+            try:
+                save_cache(drug_clean, cached)
+            except Exception:
+                logger.exception("Failed to re-cache %s with chunks", drug_clean)
+    chunks = cached.get("chunks") if cached.get("chunker") == CHUNKER else chunk_label(cached.get("text"))
+    return {"text": cached.get("text"), "raw": raw if include_raw else None, "chunks": chunks}
+
+def _resolve_name(drug_name: str, debug: Dict[str, Any]) -> str:
+    """
+    The name to look ``drug_name`` up under: the generic its label is cached
+    under when name_resolver knows it as a brand or salt form, else itself.
+    """
+    try:
+        with span(debug, "resolve_name", drug=clean_drug_name(drug_name)) as s:
+            resolution = resolve(drug_name)
+            s["cache_hit"] = resolution["via"] != "none"
+            s["via"] = resolution["via"]
+    except Exception as e:
+        debug["errors"].append(f"resolve_error: {str(e)}")
+        logger.exception("Name resolution failed for %s", drug_name)
+        return drug_name
+    if resolution["drug"] == clean_drug_name(drug_name):
+        return drug_name
+    debug["steps"].append(f"Resolved '{drug_name}' to '{resolution['drug']}' ({resolution['via']}, "
+                          f"score {resolution['score']})")
+    return resolution["drug"].replace("_", " ")
+
+def _annotate_name(result: Dict[str, Any], drug_name: str) -> Dict[str, Any]:
+    """
+    Tell the caller which name was looked up (``resolvedFrom``) and, when
+    nothing was found, which known drug the name is close to (``didYouMean``).
+    """
+    # A copy: the result may be shared with coalesced fetches of other names
+    result = dict(result)
+    if result.get("success") and result.get("drug") != clean_drug_name(drug_name):
+        result["resolvedFrom"] = drug_name
+    elif not result.get("success"):
+        try:
+            hint = suggest(drug_name)
+        except Exception:
+            logger.exception("Name suggestion failed for %s", drug_name)
+            hint = None
+        if hint:
+            result["didYouMean"] = hint
+            debug = result.get("debug") or {}
+            result["debug"] = dict(debug, steps=debug.get("steps", []) + [
+                f"No label for '{drug_name}'; did you mean '{hint['drug']}' (score {hint['score']})?"])
+    return result
+
+def _load_mirrored_label(drug_name: str, include_raw: bool, debug: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Label from the local openFDA mirror (see label_mirror.py), if one has been built."""
+    from .label_mirror import get_mirror
+    mirror = get_mirror()
+    if mirror is None:
+        return None
+    try:
+        with span(debug, "label_mirror", drug=clean_drug_name(drug_name)) as s:
+            label = mirror.get_label(drug_name, include_raw)
+            s["cache_hit"] = label is not None
+            s["bytes"] = len(label["text"]) if label else 0
+    except Exception as e:
+        debug["errors"].append(f"mirror_error: {str(e)}")
+        logger.exception("Label mirror lookup failed for %s", drug_name)
+        return None
+    if label:
+        debug["steps"].append(f"Loaded from local label mirror (set_id {label['set_id']})")
+    return label
+
+def fetch_fda_label(drug_name: str, use_cache: bool = True, logger_debug: bool = True,
+                    include_raw: bool = False) -> Dict[str, Any]:
+    """
+    Label text for one drug from the cache, the local label mirror, openFDA
+    or the sample dataset. The raw openFDA document is only included when
+    ``include_raw`` is set. Brand names and salt forms of known drugs are
+    resolved to their generic first (``resolvedFrom``); a name nothing was
+    found for gets a ``didYouMean`` hint when it is close to a known drug.
+    """
     debug = {"steps": [], "errors": []}
+    requested = drug_name
+    drug_name = _resolve_name(drug_name, debug)
+    drug_clean = clean_drug_name(drug_name)
 
     # 1. Try cache
     try:
         if use_cache:
-            cached = load_cache(drug_clean)
+            with span(debug, "label_cache", drug=drug_clean) as s:
+                cached = _load_cached_label(drug_clean, include_raw)
+                s["cache_hit"] = bool(cached)
+                s["bytes"] = len(cached.get("text") or "") if cached else 0
             if cached:
                 debug["steps"].append("Loaded from local cache")
                 if logger_debug:
                     logger.debug("Loaded %s from cache", drug_clean)
-                return {
+                return _annotate_name({
                     "success": True,
                     "drug": drug_clean,
                     "text": cached.get("text"),
+                    "chunks": cached.get("chunks"),
                     "source": "cache",
                     "raw": cached.get("raw"),
                     "debug": debug,
-                }
+                }, requested)
     except Exception as e:
         debug["errors"].append(f"cache_error: {str(e)}")
         logger.exception("Cache load error for %s", drug_clean)
 
-    # 2. Try openFDA
+    return _annotate_name(_fetch_coalesced(drug_name, drug_clean, include_raw, debug, logger_debug), requested)
+
+def _follow(call: Call, drug_clean: str, debug: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Wait for another thread's fetch of the same label; None if it failed or took too long."""
+    with span(debug, "label_coalesced", drug=drug_clean) as s:
+        shared = call.wait(COALESCE_TIMEOUT)
+        s["cache_hit"] = shared is not None
+    if shared is None:
+        debug["steps"].append("In-flight fetch of the same label failed; fetching again")
+        return None
+    debug["steps"].append("Shared an in-flight fetch of the same label")
+    leader = shared.get("debug", {})
+    return dict(shared, debug={
+        "steps": debug["steps"] + leader.get("steps", []),
+        "errors": debug["errors"] + leader.get("errors", []),
+        "spans": list(debug.get("spans", [])),
+    })
+
+def _fetch_coalesced(drug_name: str, drug_clean: str, include_raw: bool, debug: Dict[str, Any],
+                     logger_debug: bool = True) -> Dict[str, Any]:
+    """
+    The uncached part of fetch_fda_label. Concurrent fetches of one label
+    share a single lookup (see single_flight).
+    """
+    key = (drug_clean, include_raw)
+    leader, call = _flights.begin(key)
+    if not leader:
+        shared = _follow(call, drug_clean, debug)
+        return shared or _fetch_uncached(drug_name, drug_clean, include_raw, debug, logger_debug)
     try:
-        params = {"search": f'openfda.generic_name:"{drug_name}"', "limit": 1}
-        resp = requests.get(OPENFDA_BASE, params=params, timeout=10)
-        debug["steps"].append(f"openfda_request: {resp.url} (status {resp.status_code})")
-        if resp.status_code != 200:
-            err = f"openFDA HTTP {resp.status_code} - {resp.text[:200]}"
-            debug["errors"].append(err)
-            logger.warning("openFDA non-200 for %s: %s", drug_clean, err)
-        else:
-            j = resp.json()
-            if "results" in j and len(j["results"]) > 0:
-                raw = j["results"][0]
-                label_text = _make_label_text_from_result(raw)
-                try:
-                    save_cache(drug_clean, {"text": label_text, "raw": raw})
-                except Exception:
-                    logger.exception("Failed to save cache.")
-                debug["steps"].append("Fetched from openFDA and cached")
-                return {
-                    "success": True,
-                    "drug": drug_clean,
-                    "text": label_text,
-                    "source": "openfda",
-                    "raw": raw,
-                    "debug": debug,
-                }
-            else:
-                debug["errors"].append("openFDA returned no results")
-    except requests.exceptions.Timeout:
-        debug["errors"].append("openFDA_timeout")
-        logger.exception("openFDA timeout for %s", drug_clean)
-    except Exception as e:
-        logger.exception("openFDA exception for %s: %s", drug_clean, e)
-        debug["errors"].append(f"openFDA_exception: {str(e)}\n{traceback.format_exc()}")
+        result = _fetch_uncached(drug_name, drug_clean, include_raw, debug, logger_debug)
+        call.set(result)
+        return result
+    finally:
+        _flights.end(key, call)
 
-    # 3. Fallback to sample labels
+def _known_missing(drug_clean: str, debug: Dict[str, Any]) -> bool:
+    """Whether openFDA recently had no label for this drug (negative cache)."""
+    with span(debug, "label_missing_cache", drug=drug_clean) as s:
+        missing = load_cache(drug_clean, namespace=MISSING_NAMESPACE)
+        s["cache_hit"] = missing is not None
+    if missing is not None:
+        debug["steps"].append(f"openFDA skipped: no label as of {missing.get('checked')} (negative cache)")
+    return missing is not None
+
+def _remember_missing(drug_clean: str, reason: str):
+    try:
+        save_cache(drug_clean, {"reason": reason, "checked": time.strftime("%Y-%m-%dT%H:%M:%S")},
+                   namespace=MISSING_NAMESPACE, ttl=MISSING_TTL)
+    except Exception:
+        logger.exception("Failed to cache missing label for %s", drug_clean)
+
+def _fetch_uncached(drug_name: str, drug_clean: str, include_raw: bool, debug: Dict[str, Any],
+                    logger_debug: bool = True) -> Dict[str, Any]:
+    """Steps 2-4 of fetch_fda_label: mirror, openFDA, sample dataset."""
+    # 2. Try the local label mirror
+    mirrored = _load_mirrored_label(drug_name, include_raw, debug)
+    if mirrored:
+        return {
+            "success": True,
+            "drug": drug_clean,
+            "text": mirrored["text"],
+            "chunks": mirrored["chunks"],
+            "source": "mirror",
+            "raw": mirrored["raw"],
+            "debug": debug,
+        }
+
+    # 3. Try openFDA, unless it recently had no label for this drug
+    if not _known_missing(drug_clean, debug):
+        found = _fetch_openfda_single(drug_name, drug_clean, include_raw, debug)
+        if found:
+            return found
+
+    # 4. Fallback to sample labels
     try:
-        sample = load_sample_labels()
+        with span(debug, "sample_labels", drug=drug_clean) as s:
+            sample = load_sample_labels()
+            s["cache_hit"] = drug_clean in sample
         if drug_clean in sample:
             entry = sample[drug_clean]
             sections = entry.get("sections", {})
@@ -107,8 +448,9 @@ def fetch_fda_label(drug_name: str, use_cache: bool = True, logger_debug: bool =
                 "success": True,
                 "drug": drug_clean,
                 "text": label_text,
+                "chunks": chunk_label(label_text),
                 "source": "sample",
-                "raw": entry,
+                "raw": entry if include_raw else None,
                 "debug": debug,
             }
         else:
@@ -128,3 +470,243 @@ def fetch_fda_label(drug_name: str, use_cache: bool = True, logger_debug: bool =
         "error": err_msg,
         "debug": debug,
     }
+
+
+def _fetch_openfda_single(drug_name: str, drug_clean: str, include_raw: bool,
+                          debug: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """One openFDA generic_name search. A definite "no such label" is remembered briefly."""
+    try:
+        params = {"search": f'openfda.generic_name:"{drug_name}"', "limit": 1}
+        with span(debug, "openfda_label", drug=drug_clean) as s:
+            resp = openfda_get(OPENFDA_BASE, params=params, timeout=10, record=s)
+            s["bytes"] = len(resp.content)
+            s["status"] = resp.status_code
+        debug["steps"].append(f"openfda_request: {redact_url(resp.url)} (status {resp.status_code})")
+        if resp.status_code == 404:
+            # openFDA answers a search without matches with 404 NOT_FOUND
+            debug["errors"].append("openFDA returned no results")
+            _remember_missing(drug_clean, "HTTP 404")
+        elif resp.status_code != 200:
+            err = f"openFDA HTTP {resp.status_code} - {resp.text[:200]}"
+            debug["errors"].append(err)
+            logger.warning("openFDA non-200 for %s: %s", drug_clean, err)
+        else:
+            j = resp.json()
+            if "results" in j and len(j["results"]) > 0:
+                raw = j["results"][0]
+                label_text = _make_label_text_from_result(raw)
+                chunks = None
+                try:
+                    chunks = _cache_label(drug_clean, label_text, raw)
+                except Exception:
+                    logger.exception("Failed to save cache.")
+                debug["steps"].append("Fetched from openFDA and cached")
+                return {
+                    "success": True,
+                    "drug": drug_clean,
+                    "text": label_text,
+                    "chunks": chunks or chunk_label(label_text),
+                    "source": "openfda",
+                    "raw": raw if include_raw else None,
+                    "debug": debug,
+                }
+            debug["errors"].append("openFDA returned no results")
+            _remember_missing(drug_clean, "no results")
+    except RateLimited as e:
+        debug["errors"].append(f"openFDA_rate_limited: {e}")
+        logger.warning("openFDA rate limit reached for %s: %s", drug_clean, e)
+    except requests.exceptions.Timeout:
+        debug["errors"].append("openFDA_timeout")
+        logger.exception("openFDA timeout for %s", drug_clean)
+    except Exception as e:
+        logger.exception("openFDA exception for %s: %s", drug_clean, e)
+        debug["errors"].append(f"openFDA_exception: {str(e)}\n{traceback.format_exc()}")
+    return None
+
+
+_INGREDIENT_SPLIT = re.compile(r",|\band\b|/")
+
+
+def _generic_name_match(raw: Dict[str, Any], drug_name: str) -> int:
+    """
+    2 if a generic name of ``raw`` is ``drug_name`` (salt forms aside), 1 if
+    ``raw`` is a combination product with it as one ingredient, 0 otherwise.
+    """
+    wanted = base_name(drug_name)
+    match = 0
+    for name in raw.get("openfda", {}).get("generic_name", []):
+        if base_name(name) == wanted:
+            return 2
+        if any(base_name(part) == wanted for part in _INGREDIENT_SPLIT.split(str(name).lower()) if part.strip()):
+            match = 1
+    return match
+
+
+def _pick_batch_result(results: List[Dict[str, Any]], drug_name: str) -> Optional[Dict[str, Any]]:
+    """The first single-ingredient label for ``drug_name``, else the first combination product."""
+    fallback = None
+    for raw in results:
+        match = _generic_name_match(raw, drug_name)
+        if match == 2:
+            return raw
+        if match == 1 and fallback is None:
+            fallback = raw
+    return fallback
+
+
+def _fetch_openfda_batch(drug_names: List[str], include_raw: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    Look up several generic names with one OR'ed openFDA search and split the
+    hits back per drug. Drugs without a matching result are left out.
+    """
+    search = " ".join(f'openfda.generic_name:"{d}"' for d in drug_names)
+    params = {"search": search, "limit": min(100, 10 * len(drug_names))}
+    found = {}
+    timing: Dict[str, Any] = {}
+    try:
+        with span(timing, "openfda_label_batch", drugs=len(drug_names)) as s:
+            resp = openfda_get(OPENFDA_BASE, params=params, timeout=10, record=s)
+            s["bytes"] = len(resp.content)
+            s["status"] = resp.status_code
+        if resp.status_code != 200:
+            logger.warning("openFDA batch non-200 for %s: HTTP %s", drug_names, resp.status_code)
+            return found
+        results = resp.json().get("results", [])
+    except Exception as e:
+        logger.warning("openFDA batch request failed for %s: %s", drug_names, e)
+        return found
+
+    for drug_name in drug_names:
+        raw = _pick_batch_result(results, drug_name)
+        if raw is None:
+            continue
+        drug_clean = clean_drug_name(drug_name)
+        label_text = _make_label_text_from_result(raw)
+        chunks = None
+        try:
+            chunks = _cache_label(drug_clean, label_text, raw)
+        except Exception:
+            logger.exception("Failed to save cache.")
+        found[drug_name] = {
+            "success": True,
+            "drug": drug_clean,
+            "text": label_text,
+            "chunks": chunks or chunk_label(label_text),
+            "source": "openfda",
+            "raw": raw if include_raw else None,
+            "debug": {"steps": [f"Fetched from openFDA batch of {len(drug_names)} and cached"], "errors": [],
+                      "spans": list(timing.get("spans", []))},
+        }
+    return found
+
+
+def fetch_fda_labels(drug_names: List[str], use_cache: bool = True, include_raw: bool = False,
+                     batch_size: int = BATCH_SIZE, max_workers: int = MAX_WORKERS) -> Dict[str, Dict[str, Any]]:
+    """
+    Batch version of fetch_fda_label.
+
+    Names are first resolved to the generic their label is cached under
+    (see name_resolver), so "Coumadin" and "warfarin" share one lookup.
+    Results carry ``resolvedFrom``/``didYouMean`` as in fetch_fda_label.
+    Cache hits and labels in the local mirror are answered locally; the
+    rest are looked up in OR'ed openFDA searches of up to ``batch_size``
+    names, run concurrently on the shared session. Anything a batch search
+    doesn't resolve goes through the regular single-drug path (including
+    the sample-label fallback). Raw openFDA documents are only included
+    with ``include_raw``. Returns a dict keyed by the names as given, in
+    input order.
+    """
+    names = list(dict.fromkeys(drug_names))
+    results: Dict[str, Dict[str, Any]] = {}
+
+    misses = []
+    lookups: Dict[str, Dict[str, Any]] = {}
+    query: Dict[str, str] = {}
+    for name in names:
+        cached = None
+        lookups[name] = {"steps": [], "errors": []}
+        query[name] = _resolve_name(name, lookups[name])
+        if use_cache:
+            try:
+                with span(lookups[name], "label_cache", drug=clean_drug_name(query[name])) as s:
+                    cached = _load_cached_label(clean_drug_name(query[name]), include_raw)
+                    s["cache_hit"] = bool(cached)
+                    s["bytes"] = len(cached.get("text") or "") if cached else 0
+            except Exception:
+                logger.exception("Cache load error for %s", name)
+        if cached:
+            lookups[name]["steps"].append("Loaded from local cache")
+            results[name] = {
+                "success": True,
+                "drug": clean_drug_name(query[name]),
+                "text": cached.get("text"),
+                "chunks": cached.get("chunks"),
+                "source": "cache",
+                "raw": cached.get("raw"),
+                "debug": lookups[name],
+            }
+        else:
+            misses.append(name)
+
+    remote = []
+    for name in misses:
+        mirrored = _load_mirrored_label(query[name], include_raw, lookups[name])
+        if mirrored:
+            results[name] = {
+                "success": True,
+                "drug": clean_drug_name(query[name]),
+                "text": mirrored["text"],
+                "chunks": mirrored["chunks"],
+                "source": "mirror",
+                "raw": mirrored["raw"],
+                "debug": lookups[name],
+            }
+        else:
+            remote.append(name)
+
+    if remote:
+        # Names resolving to the same drug share one lookup
+        queries = list(dict.fromkeys(query[name] for name in remote))
+        fetched: Dict[str, Dict[str, Any]] = {}
+        # Queries another thread is already fetching are waited for, not repeated
+        flights = {q: _flights.begin((clean_drug_name(q), include_raw)) for q in queries}
+        mine = [q for q in queries if flights[q][0]]
+        try:
+            # Names openFDA recently had nothing for skip the batch searches
+            searched = [q for q in mine if load_cache(clean_drug_name(q), namespace=MISSING_NAMESPACE) is None]
+            batches = [searched[i:i + batch_size] for i in range(0, len(searched), batch_size)]
+            if batches:
+                with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as pool:
+                    for found in pool.map(in_context(lambda b: _fetch_openfda_batch(b, include_raw)), batches):
+                        fetched.update(found)
+
+            leftovers = [q for q in mine if q not in fetched]
+            if leftovers:
+                with ThreadPoolExecutor(max_workers=min(max_workers, len(leftovers))) as pool:
+                    singles = pool.map(in_context(lambda n: _fetch_uncached(
+                        n, clean_drug_name(n), include_raw, {"steps": [], "errors": []})), leftovers)
+                    fetched.update(zip(leftovers, singles))
+            for q in mine:
+                flights[q][1].set(fetched[q])
+        finally:
+            for q in mine:
+                _flights.end((clean_drug_name(q), include_raw), flights[q][1])
+
+        # Only after publishing our own results, so two batches waiting on each other can't deadlock
+        for q in queries:
+            if q not in fetched:
+                debug = {"steps": [], "errors": []}
+                fetched[q] = (_follow(flights[q][1], clean_drug_name(q), debug)
+                              or _fetch_uncached(q, clean_drug_name(q), include_raw, debug))
+
+        for name in remote:
+            result = fetched[query[name]]
+            results[name] = dict(result, debug=dict(result.get("debug", {})))
+
+        # Keep the resolution and cache-miss spans in front of the spans of the fetch that followed
+        for name in remote:
+            debug = results[name]["debug"]
+            debug["steps"] = lookups[name]["steps"] + debug.get("steps", [])
+            debug["spans"] = lookups[name].get("spans", []) + debug.get("spans", [])
+
+    return {name: _annotate_name(results[name], name) for name in names}
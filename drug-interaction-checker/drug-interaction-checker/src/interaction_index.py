@@ -0,0 +1,317 @@
+"""
+Precomputed drug-mention index for rule-based interaction screening.
+
+For every label, the DRUG_INTERACTIONS section (the whole label if it has
+none) is split into sentences once and indexed:
+
+* ``terms``   -- every 1-3 word phrase -> the sentences it occurs in, so
+  "does warfarin's label mention erythromycin?" is a dict lookup;
+* ``classes`` -- drug classes the label talks about (by class keyword or by
+  a member drug) -> sentences;
+* per sentence, the mechanisms (CYP3A4, QT prolongation, bleeding, ...) and
+  the strongest severity cue it contains.
+
+Indexes are memoized in-process (the `MENTION_MEMO_SIZE` most recently used,
+default 256) and persisted in the cache store (keyed by
+a digest of the label text), like the BM25 indexes, so a pair screen never
+rescans label text. screen_interactions() runs before any LLM call and is
+the basis of the no-LLM fallback summary.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .fda_api import label_sections
+from .utils import logger, clean_drug_name, load_cache, save_cache
+
+MENTION_NAMESPACE = "mentions"
+INDEX_VERSION = 1
+MAX_SENTENCE_REFS = 3
+EVIDENCE_CHARS = 300
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_SENTENCE_RE = re.compile(r"(?<=[.;!?])\s+|\n+")
+
+
+def _plural(*words: str) -> List[str]:
+    return [form for w in words for form in (w, w + "s")]
+
+
+# Class -> (keywords used in label text, member drugs)
+DRUG_CLASSES: Dict[str, Tuple[List[str], List[str]]] = {
+    "anticoagulants": (_plural("anticoagulant", "vitamin k antagonist", "coumarin", "oral anticoagulant"),
+                       ["warfarin", "heparin", "enoxaparin", "apixaban", "rivaroxaban", "dabigatran", "edoxaban"]),
+    "antiplatelets": (_plural("antiplatelet", "antiplatelet agent", "platelet inhibitor"),
+                      ["aspirin", "clopidogrel", "prasugrel", "ticagrelor", "dipyridamole"]),
+    "nsaids": (_plural("nsaid", "nonsteroidal anti inflammatory drug"),
+               ["ibuprofen", "naproxen", "diclofenac", "celecoxib", "indomethacin", "meloxicam", "ketorolac"]),
+    "antibiotics": (_plural("antibiotic", "antibacterial", "antimicrobial"),
+                    ["amoxicillin", "ampicillin", "penicillin", "ciprofloxacin", "levofloxacin", "doxycycline",
+                     "metronidazole", "sulfamethoxazole", "trimethoprim", "rifampin", "cephalexin",
+                     "erythromycin", "clarithromycin", "azithromycin"]),
+    "macrolides": (_plural("macrolide", "macrolide antibiotic"),
+                   ["erythromycin", "clarithromycin", "azithromycin", "telithromycin"]),
+    "azole antifungals": (_plural("azole antifungal", "azole", "antifungal"),
+                          ["ketoconazole", "itraconazole", "fluconazole", "voriconazole", "posaconazole"]),
+    "statins": (_plural("statin", "hmg coa reductase inhibitor"),
+                ["simvastatin", "atorvastatin", "lovastatin", "rosuvastatin", "pravastatin", "fluvastatin"]),
+    "cyp3a4 inhibitors": (_plural("cyp3a4 inhibitor", "cyp3a inhibitor", "strong cyp3a4 inhibitor"),
+                          ["ketoconazole", "itraconazole", "clarithromycin", "erythromycin", "ritonavir",
+                           "verapamil", "diltiazem", "grapefruit juice"]),
+    "cyp3a4 inducers": (_plural("cyp3a4 inducer", "cyp3a inducer"),
+                        ["rifampin", "carbamazepine", "phenytoin", "st john s wort"]),
+    "calcium channel blockers": (_plural("calcium channel blocker", "calcium antagonist"),
+                                 ["verapamil", "diltiazem", "amlodipine", "nifedipine", "felodipine"]),
+    "beta blockers": (_plural("beta blocker", "beta adrenergic blocker", "beta adrenergic blocking agent"),
+                      ["metoprolol", "atenolol", "propranolol", "carvedilol", "bisoprolol"]),
+    "antiarrhythmics": (_plural("antiarrhythmic", "antiarrhythmic drug", "antiarrhythmic agent"),
+                        ["amiodarone", "quinidine", "dronedarone", "sotalol", "dofetilide", "flecainide"]),
+    "cardiac glycosides": (_plural("cardiac glycoside", "digitalis glycoside") + ["digitalis"],
+                           ["digoxin", "digitoxin"]),
+    "ssris": (_plural("ssri", "selective serotonin reuptake inhibitor"),
+              ["fluoxetine", "sertraline", "paroxetine", "citalopram", "escitalopram"]),
+    "maois": (_plural("maoi", "monoamine oxidase inhibitor"),
+              ["phenelzine", "tranylcypromine", "selegiline", "linezolid"]),
+    "opioids": (_plural("opioid", "opioid analgesic", "narcotic"),
+                ["morphine", "oxycodone", "hydrocodone", "fentanyl", "tramadol", "codeine", "methadone"]),
+    "benzodiazepines": (_plural("benzodiazepine"),
+                        ["diazepam", "lorazepam", "alprazolam", "midazolam", "clonazepam"]),
+    "ace inhibitors": (_plural("ace inhibitor", "angiotensin converting enzyme inhibitor"),
+                       ["lisinopril", "enalapril", "ramipril", "captopril"]),
+    "diuretics": (_plural("diuretic", "thiazide", "loop diuretic"),
+                  ["furosemide", "hydrochlorothiazide", "spironolactone", "bumetanide", "chlorthalidone"]),
+    "potassium sparing agents": (_plural("potassium sparing diuretic", "potassium supplement"),
+                                 ["spironolactone", "eplerenone", "amiloride", "triamterene"]),
+}
+
+MECHANISMS: Dict[str, re.Pattern] = {
+    "CYP3A4": re.compile(r"\bcyp\s*3a4?\b"),
+    "CYP2C9": re.compile(r"\bcyp\s*2c9\b"),
+    "CYP2C19": re.compile(r"\bcyp\s*2c19\b"),
+    "CYP2D6": re.compile(r"\bcyp\s*2d6\b"),
+    "CYP1A2": re.compile(r"\bcyp\s*1a2\b"),
+    "P-glycoprotein": re.compile(r"p[\s-]*glycoprotein|\bp[\s-]?gp\b"),
+    "QT prolongation": re.compile(r"\bqtc?\b|torsade"),
+    "bleeding": re.compile(r"bleed|hemorrhag|haemorrhag|\binr\b|prothrombin"),
+    "serotonin syndrome": re.compile(r"serotonin syndrome"),
+    "myopathy": re.compile(r"myopathy|rhabdomyolysis"),
+    "hyperkalemia": re.compile(r"hyperkal"),
+    "hypotension": re.compile(r"hypotension"),
+    "CNS depression": re.compile(r"cns depression|respiratory depression|sedation"),
+    "nephrotoxicity": re.compile(r"nephrotox|renal (?:failure|impairment|toxicity)"),
+    "hypoglycemia": re.compile(r"hypoglyc"),
+    "increased exposure": re.compile(r"increase[sd]? (?:the )?(?:plasma |serum )?(?:concentration|level|exposure|auc)"),
+}
+
+SEVERITY_ORDER = ["NONE", "MILD", "MODERATE", "SEVERE", "CRITICAL"]
+_SEVERITY_CUES: List[Tuple[str, re.Pattern]] = [
+    ("CRITICAL", re.compile(r"contraindicated|do not (?:use|coadminister|administer)")),
+    ("SEVERE", re.compile(r"\bavoid\b|not recommended|fatal|life[\s-]threatening|serious")),
+    ("MODERATE", re.compile(r"monitor|caution|adjust|reduce the dose|dose reduction")),
+]
+# Mechanisms that make an interaction severe even without an explicit cue
+_SEVERE_MECHANISMS = {"bleeding", "QT prolongation", "serotonin syndrome", "myopathy", "CNS depression"}
+
+_CLASS_TERMS: Dict[str, List[str]] = {}
+for _cls, (_keywords, _members) in DRUG_CLASSES.items():
+    for _term in _keywords + _members:
+        _CLASS_TERMS.setdefault(" ".join(_TOKEN_RE.findall(_term)), []).append(_cls)
+
+# drug -> (digest, index), least recently used first; one entry per drug
+MEMO_SIZE = int(os.getenv("MENTION_MEMO_SIZE", "256"))
+_memo: "OrderedDict[str, Tuple[str, Dict[str, Any]]]" = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def _phrases(tokens: List[str], max_len: int = 3):
+    for n in range(1, max_len + 1):
+        for i in range(len(tokens) - n + 1):
+            yield " ".join(tokens[i:i + n])
+
+
+def _severity(sentence: str, mechanisms: List[str]) -> str:
+    for level, pattern in _SEVERITY_CUES:
+        if pattern.search(sentence):
+            if level == "MODERATE" and _SEVERE_MECHANISMS.intersection(mechanisms):
+                return "SEVERE"
+            return level
+    return "SEVERE" if _SEVERE_MECHANISMS.intersection(mechanisms) else "MODERATE"
+
+
+def _interaction_text(label_text: str) -> str:
+    """The DRUG_INTERACTIONS section of a label text, or the whole text if it has none."""
+    sections = label_sections(label_text)
+    parts = [label_text[s["start"]:s["end"]] for s in sections if s["name"] == "drug_interactions"]
+    return "\n".join(parts) if parts else label_text
+
+
+def build_index(label_text: str, drug: str = "") -> Dict[str, Any]:
+    """
+    Mention index (see module docstring) for one label text. The label's own
+    drug name (``drug``) never counts as a mention of its classes.
+    """
+    own = set(_name_variants(drug)) if drug else set()
+    sentences, mechanisms, severities = [], [], []
+    terms: Dict[str, List[int]] = {}
+    classes: Dict[str, List[int]] = {}
+    for raw in _SENTENCE_RE.split(_interaction_text(label_text)):
+        sentence = " ".join(raw.split())
+        tokens = _TOKEN_RE.findall(sentence.lower())
+        if len(tokens) < 3:
+            continue
+        i = len(sentences)
+        lowered = sentence.lower()
+        found = [name for name, pattern in MECHANISMS.items() if pattern.search(lowered)]
+        sentences.append(sentence[:EVIDENCE_CHARS])
+        mechanisms.append(found)
+        severities.append(_severity(lowered, found))
+        for phrase in set(_phrases(tokens)):
+            refs = terms.setdefault(phrase, [])
+            if len(refs) < MAX_SENTENCE_REFS:
+                refs.append(i)
+            for cls in () if phrase in own else _CLASS_TERMS.get(phrase, ()):
+                refs = classes.setdefault(cls, [])
+                if i not in refs and len(refs) < MAX_SENTENCE_REFS:
+                    refs.append(i)
+    return {
+        "version": INDEX_VERSION,
+        "sentences": sentences,
+        "mechanisms": mechanisms,
+        "severities": severities,
+        "terms": terms,
+        "classes": classes,
+    }
+
+
+def _digest(label_text: str) -> str:
+    return hashlib.sha1(f"{INDEX_VERSION}\x00{label_text}".encode("utf-8")).hexdigest()
+
+
+def get_index(drug: str, label_text: str) -> Dict[str, Any]:
+    """Index for one label: from memory, then the cache store, else built and saved."""
+    drug = clean_drug_name(drug)
+    digest = _digest(label_text)
+    with _memo_lock:
+        entry = _memo.get(drug)
+        if entry is not None and entry[0] == digest:
+            _memo.move_to_end(drug)
+            return entry[1]
+    cached = load_cache(drug, namespace=MENTION_NAMESPACE)
+    if cached and cached.get("digest") == digest:
+        index = cached
+    else:
+        index = dict(build_index(label_text, drug), digest=digest)
+        try:
+            save_cache(drug, index, namespace=MENTION_NAMESPACE)
+        except Exception:
+            logger.exception("Failed to save mention index for %s", drug)
+    with _memo_lock:
+        _memo[drug] = (digest, index)
+        _memo.move_to_end(drug)
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+    return index
+
+
+def drug_classes(drug: str) -> List[str]:
+    """Classes ``drug`` belongs to (by member list)."""
+    name = " ".join(_TOKEN_RE.findall(drug.lower().replace("_", " ")))
+    return sorted({cls for cls, (_, members) in DRUG_CLASSES.items() if name in members
+                   or name.split(" ")[0] in members})
+
+
+def _name_variants(drug: str) -> List[str]:
+    """"verapamil hydrochloride" is looked up as itself, then as "verapamil"."""
+    tokens = _TOKEN_RE.findall(drug.lower().replace("_", " "))
+    variants = [" ".join(tokens[:3])]
+    if len(tokens) > 1:
+        variants.append(tokens[0])
+    return variants
+
+
+def _finding(label_drug: str, other: str, index: Dict[str, Any], refs: List[int], via: str) -> Dict[str, Any]:
+    mechanisms = sorted({m for i in refs for m in index["mechanisms"][i]})
+    severity = max((index["severities"][i] for i in refs), key=SEVERITY_ORDER.index)
+    return {
+        "label": label_drug,
+        "mentions": other,
+        "via": via,
+        "mechanisms": mechanisms,
+        "severity": severity,
+        "evidence": index["sentences"][refs[0]],
+    }
+
+
+def screen_pair(a: str, index_a: Dict[str, Any], b: str) -> Optional[Dict[str, Any]]:
+    """
+    What ``a``'s label says about ``b``: a direct mention first, else one of
+    b's classes (other than a's own, which labels mention in passing).
+    """
+    for variant in _name_variants(b):
+        refs = index_a["terms"].get(variant)
+        if refs:
+            return _finding(a, b, index_a, refs, "drug")
+    own_classes = set(drug_classes(a))
+    for cls in drug_classes(b):
+        if cls in own_classes:
+            continue
+        refs = index_a["classes"].get(cls)
+        if refs:
+            return _finding(a, b, index_a, refs, f"class: {cls}")
+    return None
+
+
+def screen_interactions(drug_list: List[str], label_texts: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Rule-based first pass over every pair in ``drug_list`` using the mention
+    indexes of the labels in ``label_texts`` (drug -> label text). Returns the
+    worst severity, the mechanisms involved and one finding per label that
+    mentions another drug in the list.
+    """
+    indexes = {}
+    for drug in drug_list:
+        text = label_texts.get(drug)
+        if text:
+            try:
+                indexes[drug] = get_index(drug, text)
+            except Exception:
+                logger.exception("Failed to index label for %s", drug)
+
+    findings = []
+    for a, index_a in indexes.items():
+        for b in drug_list:
+            if b == a or clean_drug_name(b) == clean_drug_name(a):
+                continue
+            finding = screen_pair(a, index_a, b)
+            if finding:
+                findings.append(finding)
+
+    severity = max((f["severity"] for f in findings), key=SEVERITY_ORDER.index, default="NONE")
+    return {
+        "severity": severity,
+        "interactionDetected": bool(findings),
+        "mechanisms": sorted({m for f in findings for m in f["mechanisms"]}),
+        "findings": findings,
+        "labels_screened": sorted(indexes),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Screen drugs with the label mention index")
+    parser.add_argument("drugs", nargs="+", help="Drug names (labels come from the cache, mirror or openFDA)")
+    args = parser.parse_args(argv)
+    from .fda_api import fetch_fda_labels
+    labels = fetch_fda_labels(args.drugs)
+    texts = {d: r["text"] for d, r in labels.items() if r.get("success") and r.get("text")}
+    print(json.dumps(screen_interactions(args.drugs, texts), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
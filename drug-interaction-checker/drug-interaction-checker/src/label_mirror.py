@@ -0,0 +1,481 @@
+"""
+Local mirror of the openFDA drug-label dataset.
+
+``ingest`` streams the bulk download (https://open.fda.gov/apis/downloads/,
+``drug-label-NNNN-of-NNNN.json.zip``) one label at a time into a SQLite
+database, so memory stays flat however large the partition is. The mirror keeps:
+
+* ``labels``  -- one row per set id (newest version wins) with the label text
+  fetch_fda_label() would build, its section-aware chunks (see
+  fda_api.chunk_label) and the zlib-compressed raw document;
+* ``names``   -- generic, brand and substance names -> set id;
+* ``label_fts`` -- an FTS5 index over the warnings, drug_interactions,
+  contraindications and precautions sections, whose rowids are those of
+  ``labels`` (so a replaced label's entry is deleted by rowid, not by a scan).
+
+fetch_fda_label() consults the mirror after the cache and before the live
+API, so a populated mirror answers lookups locally, brand names and set ids
+included.
+
+    python -m src.label_mirror ingest drug-label-0001-of-0013.json.zip ...
+    python -m src.label_mirror ingest --all          # every partition listed by download.json
+    python -m src.label_mirror lookup coumadin
+    python -m src.label_mirror search "cyp3a4 inhibitor"
+"""
+import argparse
+import io
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from pathlib import Path
+from typing import Any, Dict, IO, Iterator, List, Optional
+
+from .fda_api import (
+    CHUNKER,
+    LABEL_FIELDS,
+    OPENFDA_ROOT,
+    _make_label_text_from_result,
+    chunk_label,
+    http_session,
+)
+from .utils import PROJECT_ROOT, clean_drug_name, logger
+
+MIRROR_DB = Path(os.getenv("LABEL_MIRROR_DB", PROJECT_ROOT / "cache" / "label_mirror.sqlite3"))
+DOWNLOAD_MANIFEST = f"{OPENFDA_ROOT}/download.json"
+NAME_KINDS = {"generic_name": "generic", "brand_name": "brand", "substance_name": "substance"}
+BATCH = 500
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS labels (
+    set_id         TEXT PRIMARY KEY,
+    id             TEXT,
+    effective_time TEXT,
+    text           TEXT NOT NULL,
+    raw            BLOB NOT NULL,
+    chunks         TEXT
+);
+CREATE TABLE IF NOT EXISTS names (
+    name   TEXT NOT NULL,
+    kind   TEXT NOT NULL,
+    set_id TEXT NOT NULL,
+    PRIMARY KEY (name, kind, set_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS names_set_id ON names (set_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS label_fts USING fts5(
+    set_id UNINDEXED, {", ".join(LABEL_FIELDS)}
+);
+"""
+# PRAGMA user_version of a mirror whose label_fts rowids match labels.rowid
+SCHEMA_VERSION = 1
+
+
+def _normalize(name: str) -> str:
+    return " ".join(str(name).lower().split())
+
+
+# ------------------ Streaming bulk JSON reader ------------------
+def iter_results(stream: IO[str], chunk_size: int = 1 << 20) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the elements of the top-level ``"results"`` array of an openFDA
+    bulk file without loading the whole file.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buf, pos, eof
+        if eof:
+            return False
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    def skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf) or not fill():
+                return
+
+    def expect(char: str):
+        nonlocal pos
+        skip_ws()
+        if pos >= len(buf) or buf[pos] != char:
+            raise ValueError(f"Malformed openFDA bulk file: expected {char!r} at offset {pos}")
+        pos += 1
+
+    def decode():
+        nonlocal pos
+        while True:
+            skip_ws()
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if fill():
+                    continue
+                raise
+            # A number at the very end of the buffer may continue in the next chunk
+            if end == len(buf) and not eof and fill():
+                continue
+            pos = end
+            return value
+
+    expect("{")
+    skip_ws()
+    if pos < len(buf) and buf[pos] == "}":
+        return
+    while True:
+        key = decode()
+        expect(":")
+        skip_ws()
+        if key == "results" and pos < len(buf) and buf[pos] == "[":
+            pos += 1
+            skip_ws()
+            if pos < len(buf) and buf[pos] == "]":
+                pos += 1
+            else:
+                while True:
+                    yield decode()
+                    skip_ws()
+                    if pos < len(buf) and buf[pos] == ",":
+                        pos += 1
+                        continue
+                    expect("]")
+                    break
+        else:
+            decode()
+        skip_ws()
+        if pos < len(buf) and buf[pos] == ",":
+            pos += 1
+            continue
+        expect("}")
+        return
+
+
+def _open_source(source: str) -> Iterator[IO[str]]:
+    """Text streams for a local/remote ``.json`` or ``.json.zip`` bulk file."""
+    tmp = None
+    path = source
+    if source.startswith(("http://", "https://")):
+        # Zip members need a seekable file, so spool the download to disk first
+        tmp = tempfile.NamedTemporaryFile(suffix=Path(source).name, delete=False)
+        with http_session().get(source, stream=True, timeout=60) as resp:
+            resp.raise_for_status()
+            for block in resp.iter_content(chunk_size=1 << 20):
+                tmp.write(block)
+        tmp.close()
+        path = tmp.name
+    try:
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                for member in archive.namelist():
+                    if member.endswith(".json"):
+                        with archive.open(member) as raw:
+                            yield io.TextIOWrapper(raw, encoding="utf-8")
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                yield f
+    finally:
+        if tmp is not None:
+            os.unlink(tmp.name)
+
+
+def bulk_label_urls() -> List[str]:
+    """Partition URLs of the drug-label dataset, from openFDA's download manifest."""
+    resp = http_session().get(DOWNLOAD_MANIFEST, timeout=30)
+    resp.raise_for_status()
+    partitions = resp.json()["results"]["drug"]["label"]["partitions"]
+    return [p["file"] for p in partitions]
+
+
+# ------------------ Store ------------------
+def _dump_chunks(text: str, chunks: Optional[List[Dict[str, Any]]] = None) -> str:
+    return json.dumps({"chunker": CHUNKER, "chunks": chunks if chunks is not None else chunk_label(text)},
+                      separators=(",", ":"))
+
+
+class LabelMirror:
+    """SQLite-backed label store with name and full-text indexes."""
+
+    def __init__(self, path=MIRROR_DB):
+        self.path = Path(path)
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        if "chunks" not in {row[1] for row in conn.execute("PRAGMA table_info(labels)")}:
+            # Mirror built before chunks were stored
+            conn.execute("ALTER TABLE labels ADD COLUMN chunks TEXT")
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            try:
+                self._rebuild_fts(conn)
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            except sqlite3.OperationalError as e:
+                # A read-only mirror still answers lookups; only re-ingesting needs the new keys
+                logger.warning("Could not re-key the label mirror's full-text index: %s", e)
+        row = conn.execute("SELECT value FROM meta WHERE key = 'chunker'").fetchone()
+        if row is None or row[0] != CHUNKER:
+            try:
+                self._backfill_chunks(conn)
+            except sqlite3.OperationalError as e:
+                # get_label() chunks stale rows in memory instead
+                logger.warning("Could not re-chunk the label mirror: %s", e)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _fts_values(raw: Dict[str, Any]) -> List[str]:
+        return ["\n".join(raw[f]) if isinstance(raw.get(f), list) else str(raw.get(f) or "")
+                for f in LABEL_FIELDS]
+
+    def _rebuild_fts(self, conn: sqlite3.Connection):
+        """Re-key label_fts by labels.rowid (mirrors built before it was)."""
+        count = conn.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+        if count:
+            logger.info("Rebuilding the full-text index of %d mirrored label(s)", count)
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DELETE FROM label_fts")
+            for rowid, set_id, raw in conn.execute("SELECT rowid, set_id, raw FROM labels").fetchall():
+                self._index_fts(conn, rowid, set_id, json.loads(zlib.decompress(raw)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _index_fts(self, conn: sqlite3.Connection, rowid: int, set_id: str, raw: Dict[str, Any]):
+        conn.execute(
+            f"INSERT INTO label_fts (rowid, set_id, {', '.join(LABEL_FIELDS)}) "
+            f"VALUES (?, ?{', ?' * len(LABEL_FIELDS)})",
+            (rowid, set_id, *self._fts_values(raw)),
+        )
+
+    def _backfill_chunks(self, conn: sqlite3.Connection):
+        """Chunk labels stored without chunks or with other chunk settings, once per CHUNKER."""
+        prefix = _dump_chunks("", [])[:-len(',"chunks":[]}')]
+        stale = conn.execute(
+            "SELECT set_id, text FROM labels WHERE chunks IS NULL OR substr(chunks, 1, ?) != ?",
+            (len(prefix), prefix),
+        ).fetchall()
+        if stale:
+            logger.info("Chunking %d mirrored label(s) with %s", len(stale), CHUNKER)
+        conn.execute("BEGIN")
+        try:
+            conn.executemany("UPDATE labels SET chunks = ? WHERE set_id = ?",
+                             [(_dump_chunks(text), set_id) for set_id, text in stale])
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('chunker', ?)", (CHUNKER,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # --- ingest ---
+    def _store(self, conn: sqlite3.Connection, raw: Dict[str, Any]) -> bool:
+        set_id = raw.get("set_id") or raw.get("id")
+        if not set_id:
+            return False
+        effective = str(raw.get("effective_time") or "")
+        row = conn.execute("SELECT rowid, effective_time FROM labels WHERE set_id = ?", (set_id,)).fetchone()
+        if row is not None and (row[1] or "") > effective:
+            return False
+        conn.execute("DELETE FROM names WHERE set_id = ?", (set_id,))
+        if row is not None:
+            conn.execute("DELETE FROM label_fts WHERE rowid = ?", (row[0],))
+        text = _make_label_text_from_result(raw)
+        cursor = conn.execute(
+            "INSERT OR REPLACE INTO labels (set_id, id, effective_time, text, raw, chunks) VALUES (?, ?, ?, ?, ?, ?)",
+            (set_id, raw.get("id"), effective, text,
+             zlib.compress(json.dumps(raw, separators=(",", ":")).encode("utf-8")),
+             _dump_chunks(text)),
+        )
+        openfda = raw.get("openfda", {}) or {}
+        names = {
+            (_normalize(name), kind)
+            for field, kind in NAME_KINDS.items()
+            for name in openfda.get(field, []) or []
+            if str(name).strip()
+        }
+        conn.executemany("INSERT OR IGNORE INTO names (name, kind, set_id) VALUES (?, ?, ?)",
+                         [(name, kind, set_id) for name, kind in names])
+        self._index_fts(conn, cursor.lastrowid, set_id, raw)
+        return True
+
+    def ingest(self, sources: List[str]) -> Dict[str, Any]:
+        """Stream bulk files into the mirror; returns counts and timing."""
+        start = time.perf_counter()
+        seen = stored = 0
+        conn = self._conn()
+        for source in sources:
+            logger.info("Ingesting openFDA labels from %s", source)
+            for stream in _open_source(source):
+                conn.execute("BEGIN")
+                try:
+                    for raw in iter_results(stream):
+                        seen += 1
+                        stored += self._store(conn, raw)
+                        if seen % BATCH == 0:
+                            conn.execute("COMMIT")
+                            conn.execute("BEGIN")
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+        conn.execute("INSERT INTO label_fts (label_fts) VALUES ('optimize')")
+        return {"labels_read": seen, "labels_stored": stored,
+                "elapsed_s": round(time.perf_counter() - start, 2), **self.stats()}
+
+    # --- lookups ---
+    def _set_ids_for(self, name: str) -> List[str]:
+        """
+        Set ids for a name, best first: exact generic, brand or substance
+        name, then "<name> ..." prefixes, then a set id. Every step is an
+        index lookup.
+        """
+        conn = self._conn()
+        needle = _normalize(name)
+        for kind in ("generic", "brand", "substance"):
+            rows = conn.execute(
+                "SELECT n.set_id FROM names n JOIN labels l ON l.set_id = n.set_id "
+                "WHERE n.name = ? AND n.kind = ? ORDER BY l.effective_time DESC",
+                (needle, kind),
+            ).fetchall()
+            if rows:
+                return [r[0] for r in rows]
+        # "warfarin" should find "warfarin sodium", as openFDA's phrase search does
+        rows = conn.execute(
+            "SELECT n.set_id FROM names n JOIN labels l ON l.set_id = n.set_id "
+            "WHERE n.name >= ? AND n.name < ? AND n.kind IN ('generic', 'brand') "
+            "ORDER BY n.kind = 'generic' DESC, length(n.name), l.effective_time DESC",
+            (needle + " ", needle + "!"),
+        ).fetchall()
+        if rows:
+            return [r[0] for r in rows]
+        # Names only found inside combination products are left to openFDA:
+        # finding them here would take a scan of every name
+        row = conn.execute("SELECT set_id FROM labels WHERE set_id = ?", (name.strip(),)).fetchone()
+        return [row[0]] if row else []
+
+    def get_label(self, name: str, include_raw: bool = False) -> Optional[Dict[str, Any]]:
+        """``{"text", "chunks", "raw", "set_id"}`` for a generic name, brand name or set id, or None."""
+        set_ids = self._set_ids_for(name)
+        if not set_ids:
+            return None
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT set_id, text, raw, chunks FROM labels WHERE set_id = ?", (set_ids[0],)
+        ).fetchone()
+        stored = json.loads(row[3]) if row[3] else {}
+        # Stale chunks are only left behind when the mirror could not be
+        # re-chunked on open (read-only), so they are not written back here
+        chunks = stored["chunks"] if stored.get("chunker") == CHUNKER else chunk_label(row[1])
+        return {
+            "set_id": row[0],
+            "text": row[1],
+            "chunks": chunks,
+            "raw": json.loads(zlib.decompress(row[2])) if include_raw else None,
+        }
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Full-text search over the interaction-relevant sections, best match first."""
+        rows = self._conn().execute(
+            "SELECT f.set_id, bm25(label_fts), "
+            "(SELECT group_concat(name, '; ') FROM names n WHERE n.set_id = f.set_id AND n.kind = 'generic') "
+            "FROM label_fts f WHERE label_fts MATCH ? ORDER BY bm25(label_fts) LIMIT ?",
+            (query, limit),
+        ).fetchall()
+        return [{"set_id": r[0], "score": round(-r[1], 3), "generic_name": r[2]} for r in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._conn()
+        return {
+            "path": str(self.path),
+            "labels": conn.execute("SELECT COUNT(*) FROM labels").fetchone()[0],
+            "names": dict(conn.execute("SELECT kind, COUNT(*) FROM names GROUP BY kind").fetchall()),
+        }
+
+
+_mirror: Optional[LabelMirror] = None
+_mirror_lock = threading.Lock()
+
+
+def get_mirror() -> Optional[LabelMirror]:
+    """
+    The process-wide mirror, or None if it has not been built. Only an
+    opened mirror is kept, so a worker started before ``ingest`` picks the
+    mirror up once it exists.
+    """
+    global _mirror
+    if _mirror is not None:
+        return _mirror
+    if not MIRROR_DB.exists():
+        return None
+    with _mirror_lock:
+        if _mirror is None:
+            try:
+                _mirror = LabelMirror(MIRROR_DB)
+            except Exception:
+                logger.exception("Label mirror at %s is unusable", MIRROR_DB)
+                return None
+        return _mirror
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Local openFDA drug-label mirror")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ingest = sub.add_parser("ingest", help="Load bulk drug-label files (.json or .json.zip, paths or URLs)")
+    ingest.add_argument("sources", nargs="*")
+    ingest.add_argument("--all", action="store_true", help="Download every partition listed by openFDA")
+    lookup = sub.add_parser("lookup", help="Show the label text for a generic/brand name or set id")
+    lookup.add_argument("name")
+    search = sub.add_parser("search", help="Full-text search over the interaction sections")
+    search.add_argument("query")
+    search.add_argument("--limit", type=int, default=10)
+    sub.add_parser("stats", help="Row counts")
+    args = parser.parse_args(argv)
+
+    if args.command == "ingest":
+        sources = list(args.sources) + (bulk_label_urls() if args.all else [])
+        if not sources:
+            parser.error("ingest needs bulk files or --all")
+        result = LabelMirror(MIRROR_DB).ingest(sources)
+    else:
+        mirror = get_mirror()
+        if mirror is None:
+            print(f"No label mirror at {MIRROR_DB}; run 'ingest' first", file=sys.stderr)
+            return 1
+        if args.command == "lookup":
+            result = mirror.get_label(args.name) or {"error": f"No label for {clean_drug_name(args.name)}"}
+        elif args.command == "search":
+            result = mirror.search(args.query, args.limit)
+        else:
+            result = mirror.stats()
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+"""
+Non-blocking, rotated logging.
+
+Request threads only put records on an in-memory queue (QueueHandler); a
+background QueueListener thread formats them, tracebacks included, and
+writes them to ``logs/app.log``, which is rotated by size (LOG_MAX_BYTES,
+the default) or by time (LOG_ROTATE=time, LOG_ROTATE_WHEN). With
+LOG_FORMAT=json every line is a JSON object carrying the request id set by
+request_context() and, for stage records (see metrics.span), the stage name
+and duration:
+
+    {"ts": "...", "level": "INFO", "logger": "drug_rag_app", "msg": "...",
+     "request_id": "47", "stage": "bm25", "duration_ms": 1.9}
+
+Several processes must not rotate one file, so pooled worker processes
+write their own: ``logs/app.<pid>.log``, or whatever a ``{pid}`` in LOG_FILE
+expands to (``LOG_FILE=logs/app-{pid}.log`` gives every process its own).
+"""
+import atexit
+import contextvars
+import copy
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+LOG_DIR = Path(__file__).resolve().parent.parent / "logs"
+LOG_FILE_TEMPLATE = os.getenv("LOG_FILE", str(LOG_DIR / "app.log"))
+LOG_FILE = Path(LOG_FILE_TEMPLATE.format(pid=os.getpid()))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json"
+LOG_ROTATE = os.getenv("LOG_ROTATE", "size")  # "size", "time" or "none"
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "midnight")
+
+TEXT_FORMAT = "%(asctime)s — %(levelname)s — %(name)s — %(message)s"
+
+# Fields copied into JSON lines when a record carries them (via ``extra=``)
+EXTRA_FIELDS = ("request_id", "stage", "duration_ms", "drug", "provider", "cache_hit")
+
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+# ------------------ Request ids ------------------
+@contextmanager
+def request_context(request_id: Optional[str] = None) -> Iterator[str]:
+    """Tag every record logged inside the block (and in_context() threads) with a request id."""
+    request_id = str(request_id) if request_id is not None else uuid.uuid4().hex[:12]
+    token = _request_id.set(request_id)
+    try:
+        yield request_id
+    finally:
+        _request_id.reset(token)
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def in_context(fn: Callable) -> Callable:
+    """
+    Wrap ``fn`` for a thread pool so it runs with the caller's context (and
+    so its request id). Each call gets its own copy, so concurrent calls are fine.
+    """
+    ctx = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        return ctx.copy().run(fn, *args, **kwargs)
+    return run
+
+
+class _RequestIdFilter(logging.Filter):
+    """Stamps the current request id on records, in the thread that logged them."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "request_id", None) is None:
+            record.request_id = _request_id.get()
+        return True
+
+
+# ------------------ Handlers ------------------
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueue without formatting: the message is interpolated here (its
+    arguments may change later) but tracebacks are formatted by the
+    listener thread, off the request path.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class _LazyDirMixin:
+    """Only create the log directory when the first record is written."""
+
+    def _open(self):
+        Path(self.baseFilename).parent.mkdir(parents=True, exist_ok=True)
+        return super()._open()
+
+
+class _FileHandler(_LazyDirMixin, logging.FileHandler):
+    pass
+
+
+class _SizeRotatingHandler(_LazyDirMixin, logging.handlers.RotatingFileHandler):
+    pass
+
+
+class _TimeRotatingHandler(_LazyDirMixin, logging.handlers.TimedRotatingFileHandler):
+    pass
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _file_handler() -> logging.Handler:
+    if LOG_ROTATE == "time":
+        handler = _TimeRotatingHandler(LOG_FILE, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT,
+                                       encoding="utf-8", delay=True)
+    elif LOG_ROTATE == "none":
+        handler = _FileHandler(LOG_FILE, encoding="utf-8", delay=True)
+    else:
+        handler = _SizeRotatingHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                       encoding="utf-8", delay=True)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+def _start_listener(root: logging.Logger):
+    """(Re)attach a fresh queue, listener thread and file handler to the root logger."""
+    global _listener
+    for h in [h for h in root.handlers if isinstance(h, _QueueHandler)]:
+        root.removeHandler(h)
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(_RequestIdFilter())
+    root.addHandler(handler)
+    _listener = logging.handlers.QueueListener(log_queue, _file_handler(), respect_handler_level=True)
+    _listener.start()
+
+
+def _process_log_file() -> Path:
+    """This process's own log file: ``{pid}`` expanded, else ``app.<pid>.log``."""
+    if "{pid}" in LOG_FILE_TEMPLATE:
+        return Path(LOG_FILE_TEMPLATE.format(pid=os.getpid()))
+    path = Path(LOG_FILE_TEMPLATE)
+    return path.with_name(f"{path.stem}.{os.getpid()}{path.suffix}")
+
+
+def _after_fork_in_child():
+    # The listener thread does not survive fork(); without a new one the
+    # child's records would pile up in the inherited queue. Forked children
+    # are pool workers, which must not rotate the parent's file.
+    global LOG_FILE
+    LOG_FILE = _process_log_file()
+    if _listener is not None:
+        _start_listener(logging.getLogger())
+
+
+def use_process_log_file():
+    """
+    Switch this process to its own log file. Pool initializers call it, so
+    workers started with spawn (which never see the fork hook) don't share
+    the parent's file either.
+    """
+    global LOG_FILE
+    path = _process_log_file()
+    if path == LOG_FILE:
+        return
+    LOG_FILE = path
+    if _listener is not None:
+        stop_logging()
+        _start_listener(logging.getLogger())
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread (registered with atexit)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configure_logging() -> logging.Logger:
+    """Install the queue handler on the root logger once; returns the app logger."""
+    root = logging.getLogger()
+    if _listener is None:
+        root.setLevel(LOG_LEVEL)
+        _start_listener(root)
+        atexit.register(stop_logging)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=_after_fork_in_child)
+    return logging.getLogger("drug_rag_app")
@@ -0,0 +1,175 @@
+"""
+Timing spans and latency histograms for the interaction pipeline.
+
+Each stage (label cache, openFDA, allergy queries, splitting, retrieval, LLM
+providers, ...) is wrapped in a span. A span is appended to the request's
+``debug["spans"]`` as ``{"name", "start", "duration_ms", "cache_hit",
+"bytes", ...}`` and also folded into process-wide histograms, which a
+long-running worker can write out in the Prometheus text format
+(``METRICS_FILE``, picked up by e.g. node_exporter's textfile collector).
+
+    with span(debug, "openfda_label", drug=drug) as s:
+        resp = http_session().get(...)
+        s["bytes"] = len(resp.content)
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from .utils import logger
+
+# Upper bounds in seconds, Prometheus style
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRICS_EXPORT_INTERVAL = float(os.getenv("METRICS_EXPORT_INTERVAL", "15"))
+METRIC_PREFIX = "drug_checker"
+# Level of the per-stage log records ("Stage bm25 took 1.9 ms")
+STAGE_LOG_LEVEL = logging.getLevelName(os.getenv("LOG_STAGE_LEVEL", "INFO").upper())
+if not isinstance(STAGE_LOG_LEVEL, int):
+    STAGE_LOG_LEVEL = logging.INFO
+
+
+class Histogram:
+    """Cumulative latency histogram plus cache and byte counters for one stage."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def observe(self, seconds: float, cache_hit: Optional[bool] = None, nbytes: int = 0, error: bool = False):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += seconds
+        self.count += 1
+        if cache_hit is True:
+            self.cache_hits += 1
+        elif cache_hit is False:
+            self.cache_misses += 1
+        self.bytes += nbytes or 0
+        self.errors += 1 if error else 0
+
+
+_lock = threading.Lock()
+_histograms: Dict[str, Histogram] = {}
+_last_export = 0.0
+
+
+def observe(name: str, seconds: float, cache_hit: Optional[bool] = None, nbytes: int = 0, error: bool = False):
+    with _lock:
+        _histograms.setdefault(name, Histogram()).observe(seconds, cache_hit, nbytes, error)
+
+
+@contextmanager
+def span(debug: Optional[Dict[str, Any]], name: str, **attrs) -> Iterator[Dict[str, Any]]:
+    """
+    Time the enclosed block as stage ``name``. The yielded dict may be given
+    ``cache_hit`` and ``bytes`` (or any other attribute) before it closes.
+    With ``debug`` None the span only feeds the histograms.
+    """
+    record: Dict[str, Any] = {"name": name, "start": round(time.time(), 3), "cache_hit": None, "bytes": None}
+    record.update(attrs)
+    started = time.perf_counter()
+    error = False
+    try:
+        yield record
+    except GeneratorExit:
+        # A streaming consumer stopped early; not a stage failure
+        raise
+    except BaseException:
+        error = True
+        record["error"] = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        record["duration_ms"] = round(elapsed * 1000, 3)
+        observe(name, elapsed, record.get("cache_hit"), record.get("bytes") or 0, error)
+        if logger.isEnabledFor(STAGE_LOG_LEVEL):
+            logger.log(STAGE_LOG_LEVEL, "Stage %s took %.1f ms", name, record["duration_ms"],
+                       extra={"stage": name, "duration_ms": record["duration_ms"],
+                              "cache_hit": record.get("cache_hit"), "drug": record.get("drug")})
+        if debug is not None:
+            # list.append is atomic, so concurrent stages can share one debug dict
+            debug.setdefault("spans", []).append(record)
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    """Per-stage totals (count, sum, cache hits/misses, bytes, errors) for the process."""
+    with _lock:
+        return {
+            name: {
+                "count": h.count,
+                "sum_s": round(h.total, 6),
+                "cache_hits": h.cache_hits,
+                "cache_misses": h.cache_misses,
+                "bytes": h.bytes,
+                "errors": h.errors,
+            }
+            for name, h in sorted(_histograms.items())
+        }
+
+
+def render_prometheus() -> str:
+    """All histograms in the Prometheus text exposition format."""
+    p = METRIC_PREFIX
+    lines = [
+        f"# HELP {p}_stage_duration_seconds Time spent per pipeline stage.",
+        f"# TYPE {p}_stage_duration_seconds histogram",
+    ]
+    counters = {
+        "cache_hits": "Stage lookups answered from a cache.",
+        "cache_misses": "Stage lookups that missed the cache.",
+        "bytes": "Payload bytes fetched or stored by the stage.",
+        "errors": "Stage runs that raised.",
+    }
+    with _lock:
+        items = sorted((name, h) for name, h in _histograms.items())
+        for name, h in items:
+            cumulative = 0
+            for bound, n in zip(BUCKETS, h.counts):
+                cumulative += n
+                lines.append(f'{p}_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{p}_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {h.count}')
+            lines.append(f'{p}_stage_duration_seconds_sum{{stage="{name}"}} {h.total:.6f}')
+            lines.append(f'{p}_stage_duration_seconds_count{{stage="{name}"}} {h.count}')
+        for field, help_text in counters.items():
+            lines.append(f"# HELP {p}_stage_{field}_total {help_text}")
+            lines.append(f"# TYPE {p}_stage_{field}_total counter")
+            for name, h in items:
+                lines.append(f'{p}_stage_{field}_total{{stage="{name}"}} {getattr(h, field)}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str):
+    """Atomically replace ``path`` with the current metrics (``{pid}`` is expanded)."""
+    target = path.format(pid=os.getpid())
+    tmp = f"{target}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp, target)
+
+
+def maybe_export(force: bool = False):
+    """Write METRICS_FILE if configured and at least METRICS_EXPORT_INTERVAL seconds have passed."""
+    global _last_export
+    path = os.getenv("METRICS_FILE")
+    if not path:
+        return
+    now = time.monotonic()
+    with _lock:
+        if not force and now - _last_export < METRICS_EXPORT_INTERVAL:
+            return
+        _last_export = now
+    try:
+        write_prometheus(path)
+    except Exception:
+        logger.exception("Failed to write metrics to %s", path)
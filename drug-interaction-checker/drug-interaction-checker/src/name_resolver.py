@@ -0,0 +1,256 @@
+"""
+Drug-name resolution ahead of the label cache.
+
+clean_drug_name() only lowercases, so "Coumadin" and "warfarin sodium" each
+missed the cache entry for "warfarin" and sent their own (usually fruitless)
+openFDA generic_name query. resolve() maps a name to the drug key a label is
+cached under:
+
+1. exact alias -- generic, brand and substance names of every cached label,
+   stored in the cache's "names" namespace when the label is cached;
+2. salt form   -- "warfarin sodium", "verapamil HCl" -> the base name's alias.
+
+Names that resolve to nothing are returned unchanged, so behaviour for
+unknown drugs is what it was.
+
+Near misses are never substituted: many different drugs have look-alike
+names (prednisone/prednisolone). suggest() runs a character-trigram index
+over all aliases and returns the closest within FUZZY_MIN_RATIO, which
+callers only offer as a "did you mean" once every lookup has failed.
+
+    python -m src.name_resolver coumadin "warfarin sodium" warfarn
+    python -m src.name_resolver rebuild      # re-register every cached label
+"""
+import argparse
+import difflib
+import json
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from .utils import clean_drug_name, load_cache, load_sample_labels, logger, save_cache
+
+NAMES_NAMESPACE = "names"
+META_NAMESPACE = "names_meta"
+FUZZY_MIN_RATIO = 0.85
+FUZZY_MIN_LENGTH = 5
+# How long a process trusts its fuzzy index before checking for aliases other processes added
+FUZZY_REFRESH_S = 60.0
+
+# Salt and hydrate words dropped to find the base name ("warfarin sodium" -> "warfarin")
+SALT_WORDS = {
+    "sodium", "potassium", "calcium", "magnesium", "hydrochloride", "hcl", "dihydrochloride",
+    "hydrobromide", "sulfate", "bisulfate", "succinate", "tartrate", "bitartrate", "maleate",
+    "mesylate", "besylate", "citrate", "phosphate", "acetate", "fumarate", "hyclate", "lactate",
+    "monohydrate", "dihydrate", "trihydrate", "anhydrous", "extended", "release", "er", "xr",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize(name: str) -> str:
+    """Lowercase words separated by single spaces ("Warfarin_Sodium " -> "warfarin sodium")."""
+    return " ".join(_TOKEN_RE.findall(str(name).lower()))
+
+
+def base_name(name: str) -> str:
+    """``name`` without trailing salt/hydrate/release words, keeping at least one word."""
+    tokens = normalize(name).split()
+    while len(tokens) > 1 and tokens[-1] in SALT_WORDS:
+        tokens.pop()
+    return " ".join(tokens)
+
+
+def _trigrams(name: str) -> Set[str]:
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# ------------------ Alias registration ------------------
+def label_aliases(drug: str, openfda: Dict[str, List[str]]) -> Dict[str, str]:
+    """
+    Aliases a cached label contributes: alias -> kind. A label only vouches
+    for its brand and substance names when its generic name is the drug it
+    was cached under (a combination product found for "simvastatin" must
+    not claim "simvastatin"'s brand names).
+    """
+    drug_base = base_name(drug)
+    aliases = {normalize(drug): "generic"}
+    generics = [normalize(g) for g in openfda.get("generic_name", []) or []]
+    if not any(base_name(g) == drug_base for g in generics):
+        return aliases
+    for kind, field in (("generic", "generic_name"), ("brand", "brand_name"), ("substance", "substance_name")):
+        for name in openfda.get(field, []) or []:
+            for alias in {normalize(name), base_name(name)}:
+                if alias:
+                    aliases.setdefault(alias, kind)
+    return aliases
+
+
+def register_label(drug: str, openfda: Dict[str, List[str]]):
+    """Record the aliases of a label just cached under ``drug`` (see fda_api._cache_label)."""
+    drug_clean = clean_drug_name(drug)
+    own = normalize(drug)
+    for alias, kind in label_aliases(drug, openfda).items():
+        existing = load_cache(alias, namespace=NAMES_NAMESPACE)
+        # First come, first served, except that a drug's own name is always its own
+        if existing and (existing.get("drug") == drug_clean or alias != own):
+            continue
+        save_cache(alias, {"drug": drug_clean, "kind": kind}, namespace=NAMES_NAMESPACE)
+        _fuzzy.add(alias)
+
+
+def rebuild() -> int:
+    """Register the aliases of every cached label; returns how many labels were read."""
+    from .cache_store import get_cache
+    cache = get_cache()
+    count = 0
+    for drug in cache.keys("labels"):
+        entry = cache.get("labels", drug) or {}
+        openfda = entry.get("openfda") or (entry.get("raw") or {}).get("openfda") or {}
+        register_label(drug, openfda)
+        count += 1
+    for drug in load_sample_labels():
+        alias = normalize(drug)
+        if not load_cache(alias, namespace=NAMES_NAMESPACE):
+            save_cache(alias, {"drug": clean_drug_name(drug), "kind": "sample"}, namespace=NAMES_NAMESPACE)
+    save_cache("backfill", {"labels": count, "at": time.time()}, namespace=META_NAMESPACE)
+    _fuzzy.invalidate()
+    return count
+
+
+_backfill_checked = False
+
+
+def _ensure_backfilled():
+    """Register labels cached before name resolution existed, once per cache."""
+    global _backfill_checked
+    if _backfill_checked:
+        return
+    _backfill_checked = True
+    if load_cache("backfill", namespace=META_NAMESPACE) is None:
+        try:
+            logger.info("Registered aliases of %d cached label(s)", rebuild())
+        except Exception:
+            logger.exception("Failed to backfill drug-name aliases")
+
+
+# ------------------ Fuzzy index ------------------
+class _FuzzyIndex:
+    """Trigram -> aliases, over every alias in the names namespace."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings: Dict[str, Set[str]] = defaultdict(set)
+        self._loaded_at = 0.0
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = 0.0
+
+    def add(self, alias: str):
+        with self._lock:
+            if self._loaded_at:
+                for gram in _trigrams(alias):
+                    self._postings[gram].add(alias)
+
+    def _refresh(self):
+        from .cache_store import get_cache
+        if time.monotonic() - self._loaded_at < FUZZY_REFRESH_S:
+            return
+        # Keys are stored clean_drug_name()-style ("warfarin_sodium")
+        aliases = [normalize(key) for key in get_cache().keys(NAMES_NAMESPACE)]
+        postings: Dict[str, Set[str]] = defaultdict(set)
+        for alias in aliases:
+            for gram in _trigrams(alias):
+                postings[gram].add(alias)
+        self._postings, self._loaded_at = postings, time.monotonic()
+
+    def closest(self, name: str) -> Optional[Dict[str, Any]]:
+        """Best alias for ``name`` with its similarity ratio, or None below FUZZY_MIN_RATIO."""
+        with self._lock:
+            self._refresh()
+            grams = _trigrams(name)
+            shared = Counter(alias for gram in grams for alias in self._postings.get(gram, ()))
+        best, best_ratio = None, 0.0
+        # Only aliases sharing enough trigrams can be within the ratio
+        for alias, n in shared.most_common(20):
+            if n < len(grams) / 3:
+                break
+            ratio = difflib.SequenceMatcher(None, name, alias).ratio()
+            if ratio > best_ratio:
+                best, best_ratio = alias, ratio
+        if best is None or best_ratio < FUZZY_MIN_RATIO:
+            return None
+        return {"alias": best, "score": round(best_ratio, 3)}
+
+
+_fuzzy = _FuzzyIndex()
+
+
+# ------------------ Resolution ------------------
+def _lookup(alias: str) -> Optional[str]:
+    entry = load_cache(alias, namespace=NAMES_NAMESPACE) if alias else None
+    return entry.get("drug") if entry else None
+
+
+def resolve(name: str) -> Dict[str, Any]:
+    """
+    ``{"query", "drug", "via", "score"}``: the cache key the label for
+    ``name`` lives under and how it was found ("alias", "salt", or "none"
+    when ``drug`` is just clean_drug_name(name)).
+    """
+    _ensure_backfilled()
+    alias = normalize(name)
+    drug = _lookup(alias)
+    if drug:
+        return {"query": name, "drug": drug, "via": "alias", "score": 1.0}
+    base = base_name(alias)
+    if base != alias:
+        drug = _lookup(base)
+        if drug:
+            return {"query": name, "drug": drug, "via": "salt", "score": 1.0}
+    return {"query": name, "drug": clean_drug_name(name), "via": "none", "score": None}
+
+
+def suggest(name: str) -> Optional[Dict[str, Any]]:
+    """
+    ``{"drug", "alias", "score"}`` for the known drug whose name is closest
+    to ``name`` (a typo, or a different drug with a similar name), or None.
+    Only for "did you mean" hints; never look a label up under it.
+    """
+    _ensure_backfilled()
+    alias = normalize(name)
+    if len(alias) < FUZZY_MIN_LENGTH:
+        return None
+    try:
+        match = _fuzzy.closest(alias)
+    except Exception:
+        logger.exception("Fuzzy name lookup failed for %s", name)
+        return None
+    drug = _lookup(match["alias"]) if match else None
+    if not drug or drug == clean_drug_name(name):
+        return None
+    return {"drug": drug, "alias": match["alias"], "score": match["score"]}
+
+
+def resolve_many(names: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    return {name: dict(resolve(name), suggestion=suggest(name)) for name in names}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Resolve drug names to cached label keys")
+    parser.add_argument("names", nargs="+", help='Drug names, or "rebuild" to re-register every cached label')
+    args = parser.parse_args(argv)
+    if args.names == ["rebuild"]:
+        print(json.dumps({"labels": rebuild()}))
+        return 0
+    print(json.dumps(resolve_many(args.names), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+Token-budgeted evidence assembly for the LLM prompt.
+
+Retrieved chunks overlap (neighbouring chunks share CHUNK_OVERLAP characters)
+and different drugs' labels often repeat the same boilerplate, so the prompt
+used to carry the same sentences several times. pack_contexts() walks the
+evidence best first and:
+
+* drops a chunk when most of its word shingles are already in the prompt;
+* trims the leading words of a chunk that the previous chunks already cover;
+* stops adding chunks once PROMPT_CONTEXT_TOKENS would be exceeded (smaller
+  ones further down the list may still fit).
+
+Tokens are counted with tiktoken when it is installed and estimated at four
+characters per token otherwise.
+"""
+import functools
+import importlib
+import os
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .utils import logger
+
+PROMPT_CONTEXT_TOKENS = int(os.getenv("PROMPT_CONTEXT_TOKENS", "1500"))
+TOKENIZER_MODEL = os.getenv("PROMPT_TOKENIZER_MODEL", "gpt-4o-mini")
+SHINGLE = 4
+# Share of a chunk's shingles already in the prompt above which it is a duplicate
+DUPLICATE_RATIO = 0.8
+# Trimmed chunks keep at least this many characters, or are dropped
+MIN_CHUNK_CHARS = 40
+
+_WORD_RE = re.compile(r"\S+")
+
+
+@functools.lru_cache(maxsize=None)
+def _encoder():
+    """tiktoken encoding for TOKENIZER_MODEL, or None when tiktoken is missing."""
+    try:
+        tiktoken = importlib.import_module("tiktoken")
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(TOKENIZER_MODEL)
+    except Exception:
+        logger.warning("No tiktoken encoding for %s, using cl100k_base", TOKENIZER_MODEL)
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    encoder = _encoder()
+    if encoder is not None:
+        return len(encoder.encode(text))
+    return (len(text) + 3) // 4
+
+
+def token_counter() -> str:
+    return "tiktoken" if _encoder() is not None else "chars/4"
+
+
+def _split_header(context: str) -> Tuple[str, str]:
+    """Chunks look like "<drug> <SECTION>:\\n<text>"; the header is kept out of dedup."""
+    head, sep, body = context.partition("\n")
+    if sep and head.endswith(":") and len(head) < 80:
+        return head + "\n", body
+    return "", context
+
+
+def _shingles(words: List[str]) -> List[Tuple[str, ...]]:
+    lowered = [w.lower() for w in words]
+    if len(lowered) < SHINGLE:
+        return [tuple(lowered)] if lowered else []
+    return [tuple(lowered[i:i + SHINGLE]) for i in range(len(lowered) - SHINGLE + 1)]
+
+
+def _novel_part(body: str, seen: Set[Tuple[str, ...]]) -> Optional[str]:
+    """
+    ``body`` minus a leading run already in ``seen``, or None when the chunk
+    is a near duplicate of what is already packed.
+    """
+    matches = list(_WORD_RE.finditer(body))
+    shingles = _shingles([m.group() for m in matches])
+    if not shingles:
+        return None
+    covered = sum(1 for s in shingles if s in seen)
+    if covered / len(shingles) >= DUPLICATE_RATIO:
+        return None
+    lead = 0
+    while lead < len(shingles) and shingles[lead] in seen:
+        lead += 1
+    if lead == 0:
+        return body
+    # Words lead .. lead + SHINGLE - 2 already appeared as the tail of a seen shingle
+    first = min(lead + SHINGLE - 1, len(matches) - 1)
+    trimmed = "… " + body[matches[first].start():]
+    return trimmed if len(trimmed) >= MIN_CHUNK_CHARS else None
+
+
+def pack_contexts(contexts: List[str], allergy_contexts: Optional[List[str]] = None,
+                  budget: Optional[int] = None, debug: Optional[Dict[str, Any]] = None) -> List[str]:
+    """
+    Deduplicated evidence for the prompt, most relevant first, within
+    ``budget`` tokens (PROMPT_CONTEXT_TOKENS by default). ``contexts`` must be
+    ordered best first; allergy lines (one short line per drug, see
+    allergy_summary_context) are packed after them without deduplication.
+    Token counts and what was dropped are recorded in ``debug["tokens"]``.
+    """
+    budget = PROMPT_CONTEXT_TOKENS if budget is None else budget
+    allergy_contexts = list(allergy_contexts or [])
+    candidates = list(contexts) + allergy_contexts
+    seen: Set[Tuple[str, ...]] = set()
+    packed, used = [], 0
+    stats = {"duplicates": 0, "trimmed": 0, "over_budget": 0}
+    for i, context in enumerate(candidates):
+        header, body = _split_header(context)
+        novel = body if i >= len(contexts) else _novel_part(body, seen)
+        if novel is None:
+            stats["duplicates"] += 1
+            continue
+        piece = header + novel
+        tokens = count_tokens(piece)
+        if used + tokens > budget:
+            stats["over_budget"] += 1
+            continue
+        if novel is not body:
+            stats["trimmed"] += 1
+        seen.update(_shingles(_WORD_RE.findall(body)))
+        packed.append(piece)
+        used += tokens
+    if debug is not None:
+        debug["tokens"] = {
+            "budget": budget,
+            "counter": token_counter(),
+            "candidates": len(candidates),
+            "candidate_tokens": sum(count_tokens(c) for c in candidates),
+            "packed": len(packed),
+            "context_tokens": used,
+            **stats,
+        }
+    return packed
@@ -1,42 +1,67 @@
 import os
-import math
 import json
+import time
+import queue
+import threading
+import functools
+import importlib
+import importlib.util
 import traceback
-import requests
-from typing import List, Dict, Any
-from .utils import logger, clean_drug_name
-
-# try to import langchain pieces; if they fail we'll provide a clear fallback
-_langchain_available = True
-try:
-    from langchain.chat_models import ChatOpenAI
-    from langchain.embeddings import OpenAIEmbeddings
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
-    from langchain.vectorstores import FAISS
-    from langchain.chains import RetrievalQA
-except Exception as e:
-    _langchain_available = False
-    logger.warning("LangChain components not available: %s", e)
-
-# try import Google Gemini library
-_gemini_available = True
-try:
-    import google.generativeai as genai
-    if os.getenv("GOOGLE_API_KEY"):
-        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-    else:
-        raise RuntimeError("GOOGLE_API_KEY not set in environment for Gemini fallback")
-except Exception as e:
-    _gemini_available = False
-    logger.warning("Gemini API not available: %s", e)
-
-# try import openai library as final LLM fallback
-_openai_available = True
-try:
-    import openai
-except Exception:
-    _openai_available = False
-    logger.warning("openai package not available; install it for fallback LLM usage.")
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from . import bm25
+from .circuit_breaker import get_breaker
+from .fda_api import chunk_label, openfda_get, OPENFDA_ROOT
+from .interaction_index import screen_interactions
+from .prompt_context import count_tokens, pack_contexts
+from .metrics import span
+from .utils import logger, clean_drug_name, get_genai, get_openai, in_context, load_cache, save_cache
+from .verdict_cache import verdict_key, load_verdict, save_verdict
+
+# ------------------ Optional dependencies (loaded on first use) ------------------
+# LangChain, Gemini and OpenAI each take hundreds of milliseconds to import, so
+# nothing heavy is imported until the pipeline actually reaches a step needing it.
+def _langchain_installed() -> bool:
+    """Cheap availability check that doesn't import langchain itself."""
+    return importlib.util.find_spec("langchain") is not None
+
+
+@functools.lru_cache(maxsize=None)
+def _optional(module: str, attr: str):
+    """Return ``module.attr``, or None (logged once) if it cannot be imported."""
+    try:
+        return getattr(importlib.import_module(module), attr)
+    except Exception as e:
+        logger.warning("LangChain component %s.%s not available: %s", module, attr, e)
+        return None
+
+
+def _embeddings_cls():
+    return _optional("langchain.embeddings", "OpenAIEmbeddings")
+
+
+def _faiss_cls():
+    return _optional("langchain.vectorstores", "FAISS")
+
+
+def _chat_model_cls():
+    return _optional("langchain.chat_models", "ChatOpenAI")
+
+
+def _gemini():
+    """Configured google.generativeai module, or None when unusable."""
+    if not os.getenv("GOOGLE_API_KEY"):
+        return None
+    return get_genai()
+
+
+def preload():
+    """Import every optional dependency now (used by long-lived workers)."""
+    if _langchain_installed():
+        for loader in (_embeddings_cls, _faiss_cls, _chat_model_cls):
+            loader()
+    _gemini()
+    get_openai()
 
 # ------------------ Allergy-specific integration ------------------
 ALLERGY_TERMS = [
@@ -44,47 +69,99 @@ ALLERGY_TERMS = [
     "anaphylaxis", "angioedema"
 ]
 
-def query_openfda_allergies(drug_name: str, limit: int = 5) -> List[Dict[str, Any]]:
+ALLERGY_CACHE_TTL = 7 * 24 * 3600  # FAERS is refreshed quarterly; a week is plenty fresh
+
+def _fetch_allergy_events(drug_name: str, limit: int,
+                          debug: Optional[Dict[str, Any]] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    One FAERS request per drug with all ALLERGY_TERMS OR'ed together.
+    Returns None when the request failed (so the miss isn't cached).
+    """
+    base_url = f"{OPENFDA_ROOT}/drug/event.json"
+    terms = "+".join(f'"{term}"' for term in ALLERGY_TERMS)
+    query = f"patient.drug.medicinalproduct:{drug_name}+AND+patient.reaction.reactionmeddrapt:({terms})"
+    url = f"{base_url}?search={query}&limit={min(100, limit * len(ALLERGY_TERMS))}"
+    try:
+        with span(debug, "openfda_events", drug=drug_name) as s:
+            r = openfda_get(url, timeout=5, record=s)
+            s["bytes"] = len(r.content)
+            s["status"] = r.status_code
+    except Exception as e:
+        logger.warning(f"Failed to query openFDA for {drug_name}: {e}")
+        return None
+    if r.status_code == 404:
+        # openFDA answers "No matches found!" with a 404
+        return []
+    if r.status_code != 200:
+        logger.warning(f"openFDA allergy query for {drug_name} returned HTTP {r.status_code}")
+        return None
+
+    try:
+        data = r.json()
+    except ValueError as e:
+        logger.warning(f"Invalid openFDA allergy response for {drug_name}: {e}")
+        return None
+
+    results = []
+    for item in data.get("results", []):
+        reaction_list = item.get("patient", {}).get("reaction", [])
+        for rct in reaction_list:
+            reaction = rct.get("reactionmeddrapt", "")
+            if any(term in reaction.lower() for term in ALLERGY_TERMS):
+                results.append({
+                    "drug": drug_name,
+                    "reaction": reaction,
+                    "serious": rct.get("serious", None)
+                })
+    return results
+
+def query_openfda_allergies(drug_name: str, limit: int = 5,
+                            debug: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
     """
     Query openFDA FAERS for allergy-related adverse events for a given drug.
     Returns a list of dicts with 'drug', 'reaction', and 'serious'.
+    Answers (including empty ones) are cached for ALLERGY_CACHE_TTL seconds.
     """
-    base_url = "https://api.fda.gov/drug/event.json"
-    results = []
-    for term in ALLERGY_TERMS:
-        query = f'patient.drug.medicinalproduct:{drug_name}+AND+patient.reaction.reactionmeddrapt:"{term}"'
-        url = f"{base_url}?search={query}&limit={limit}"
-        try:
-            r = requests.get(url, timeout=5)
-            if r.status_code == 200:
-                data = r.json()
-                for item in data.get("results", []):
-                    reaction_list = item.get("patient", {}).get("reaction", [])
-                    for rct in reaction_list:
-                        if term.lower() in rct.get("reactionmeddrapt", "").lower():
-                            results.append({
-                                "drug": drug_name,
-                                "reaction": rct.get("reactionmeddrapt"),
-                                "serious": rct.get("serious", None)
-                            })
-        except Exception as e:
-            logger.warning(f"Failed to query openFDA for {drug_name}: {e}")
+    cache_key = f"{drug_name}_{limit}"
+    with span(debug, "allergy_cache", drug=drug_name) as s:
+        cached = load_cache(cache_key, namespace="allergies")
+        s["cache_hit"] = cached is not None
+    if cached is not None:
+        return cached
+
+    results = _fetch_allergy_events(drug_name, limit, debug)
+    if results is None:
+        return []
+    try:
+        save_cache(cache_key, results, namespace="allergies", ttl=ALLERGY_CACHE_TTL)
+    except Exception:
+        logger.exception("Failed to save allergy cache for %s", drug_name)
     return results
 
-def allergy_summary_context(drug_list: List[str]) -> List[str]:
+def allergy_summary_context(drug_list: List[str], debug: Optional[Dict[str, Any]] = None) -> List[str]:
     """
-    Build textual allergy context for each drug from openFDA data.
-    Includes explicit note if no allergic reactions are reported.
+    Build textual allergy context for each drug from openFDA data: one line
+    per drug with a count per reaction, or an explicit note if no allergic
+    reactions are reported. Drugs are looked up concurrently.
     """
     contexts = []
-    for drug in drug_list:
-        allergy_data = query_openfda_allergies(drug)
+    if not drug_list:
+        return contexts
+    with ThreadPoolExecutor(max_workers=min(8, len(drug_list))) as pool:
+        per_drug = list(pool.map(in_context(lambda d: query_openfda_allergies(d, debug=debug)), drug_list))
+    for drug, allergy_data in zip(drug_list, per_drug):
         if allergy_data:
+            counts: Dict[str, List[int]] = {}
             for a in allergy_data:
-                contexts.append(
-                    f"openFDA reports: {a['drug']} caused {a['reaction']}"
-                    + (f", serious: {a['serious']}" if a['serious'] else "")
-                )
+                reaction = counts.setdefault(a["reaction"].lower(), [0, 0])
+                reaction[0] += 1
+                # FAERS codes serious as "1" and non-serious as "2"
+                reaction[1] += 1 if str(a.get("serious")) == "1" else 0
+            reactions = ", ".join(
+                f"{name} x{n}" + (f" ({serious} serious)" if serious else "")
+                for name, (n, serious) in sorted(counts.items(), key=lambda kv: -kv[1][0])
+            )
+            contexts.append(f"openFDA reports for {drug}: {len(allergy_data)} allergic reactions ({reactions}).")
         else:
             # Explicit note that no allergy was reported
             contexts.append(f"openFDA reports: No allergic reactions found for {drug}.")
@@ -98,11 +175,27 @@ def _safe_prompt_for_llm(drug_list: List[str], contexts: List[str]) -> str:
         "If evidence indicates no interaction, say 'No major interaction found based on the provided sources.' "
     )
     drug_line = f"Drugs to evaluate: {', '.join(drug_list)}\n\n"
-    ctx = "\n\n---\n\n".join(contexts[:8])  # limit contexts
+    ctx = "\n\n---\n\n".join(contexts)  # already packed to the token budget (see prompt_context)
     prompt = f"{header}\n\n{drug_line}\n\nRelevant extracts:\n{ctx}\n\nNow, summarize the potential interactions and the confidence of the evidence. Give a one-line top-level verdict and a short explanation. Cite 'openFDA' or 'sample' where appropriate if present in the extracts."
     return prompt
 
-def _simple_fallback_summary(drug_list: List[str], contexts: List[str]) -> str:
+def _screen_summary(screen: Dict[str, Any]) -> str:
+    """Fallback answer from the mention-index screen (see interaction_index)."""
+    findings = screen["findings"]
+    severity = screen["severity"].lower()
+    mechanisms = screen["mechanisms"]
+    verdict = f"Potential {severity} interaction"
+    verdict += f" ({', '.join(mechanisms)})." if mechanisms else "."
+    reasons = []
+    for f in findings:
+        via = "" if f["via"] == "drug" else f" ({f['via']})"
+        reasons.append(f"The {f['label']} label mentions {f['mentions']}{via}: \"{f['evidence']}\"")
+    return f"{verdict}\n\nReasoning:\n- " + "\n- ".join(reasons)
+
+def _simple_fallback_summary(drug_list: List[str], contexts: List[str],
+                             screen: Optional[Dict[str, Any]] = None) -> str:
+    if screen and screen.get("findings"):
+        return _screen_summary(screen)
     combined = " ".join(contexts).lower()
     verdict = "No major interaction found based on the provided extracts."
     reasons = []
@@ -115,186 +208,515 @@ def _simple_fallback_summary(drug_list: List[str], contexts: List[str]) -> str:
     if "qt" in combined or "qtc" in combined or "torsade" in combined:
         verdict = "Potential interaction: Combined QT-prolonging risk."
         reasons.append("QT prolongation terms found in extracts.")
+    if not reasons and screen and screen.get("labels_screened"):
+        reasons.append(f"None of the screened labels ({', '.join(screen['labels_screened'])}) "
+                       f"mention the other drugs or their classes.")
     if not reasons:
         reasons.append("No specific mechanism or interaction terms found in extracts.")
     return f"{verdict}\n\nReasoning:\n- " + "\n- ".join(reasons)
 
 # ------------------ Main RAG pipeline ------------------
-def run_rag_pipeline(all_texts: List[str], drug_list: List[str], top_k: int = 5, use_openai: bool = True) -> Dict[str, Any]:
+def _drug_of(text: str) -> str:
+    """Label texts arrive as "<drug>:\n<label text>"; recover the drug name."""
+    head = text.split("\n", 1)[0].strip()
+    return head[:-1] if head.endswith(":") else "unknown"
+
+def _chunk_contexts(drug: str, text: str, chunks: List[Dict[str, Any]],
+                    sections: Optional[List[str]] = None) -> List[str]:
+    """Chunk offsets (see fda_api.chunk_label) -> "<drug> <SECTION>:\n<slice>" contexts."""
+    return [f"{drug} {c['section'].upper()}:\n{text[c['start']:c['end']]}"
+            for c in chunks if sections is None or c["section"] in sections]
+
+def label_chunks(fda_results: Dict[str, Dict[str, Any]], debug: Optional[Dict[str, Any]] = None,
+                 sections: Optional[List[str]] = None) -> Tuple[List[str], List[str]]:
     """
-    Runs the RAG pipeline with:
-      - LangChain embeddings + FAISS retrieval if available
-      - LLM summarization via LangChain, Gemini, or OpenAI
-      - Allergy-specific context from openFDA
-      - Fallback to simple summary if all else fails
+    Retrieval chunks for fetch_fda_labels() results, sliced from the chunk
+    offsets stored with each label (chunked only if a result has none).
+    ``sections`` keeps only chunks of those sections (e.g. ["drug_interactions"]).
+    Returns the chunks and, in parallel, the drug each came from; the "split"
+    span goes to ``debug["spans"]``.
     """
-    debug = {"steps": [], "errors": [], "notes": []}
-    try:
-        # -----------------------------
-        # 1) Split texts into chunks
-        # -----------------------------
-        debug["steps"].append("splitting_texts")
-        if _langchain_available:
-            try:
-                text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=80)
-                docs = text_splitter.create_documents(all_texts)
-                contexts = [d.page_content for d in docs]
-                debug["steps"].append(f"langchain_split: created {len(contexts)} chunks")
-            except Exception as e:
-                debug["errors"].append(f"text_split_error: {repr(e)}")
-                logger.exception("Text splitting failed: %s", e)
-                contexts = all_texts.copy()
-        else:
-            contexts = []
-            for t in all_texts:
-                if not t:
-                    continue
-                size = 1000
-                for i in range(0, len(t), size):
-                    contexts.append(t[i:i+size])
-            debug["steps"].append(f"naive_split: created {len(contexts)} chunks")
-
-        # -----------------------------
-        # 2) Retrieve relevant contexts
-        # -----------------------------
-        retrieved_contexts = []
-        if _langchain_available:
-            try:
-                debug["steps"].append("attempting_langchain_embeddings_and_faiss")
-                embeddings = OpenAIEmbeddings()
+    contexts, chunk_drugs = [], []
+    with span(debug, "split", texts=len(fda_results), stored=True) as s:
+        for drug, result in fda_results.items():
+            text = result.get("text") if result.get("success") else None
+            if text:
+                chunks = result.get("chunks") or chunk_label(text)
+                drug_contexts = _chunk_contexts(drug, text, chunks, sections)
+            else:
+                drug_contexts = [f"{drug}:\nNo data for {drug}"]
+            contexts.extend(drug_contexts)
+            chunk_drugs.extend([drug] * len(drug_contexts))
+        s["bytes"] = sum(len(c) for c in contexts)
+        s["chunks"] = len(contexts)
+    return contexts, chunk_drugs
+
+def split_label_texts(all_texts: List[str], debug: Optional[Dict[str, Any]] = None) -> Tuple[List[str], List[str]]:
+    """
+    Split "<drug>:\n<label>" texts that came without stored chunks (e.g. the
+    sample fallback) into the same section-aware chunks as label_chunks().
+    Returns the chunks and, in parallel, the drug whose label each chunk came from.
+    """
+    debug = debug if debug is not None else {"steps": [], "errors": [], "notes": []}
+    debug["steps"].append("splitting_texts")
+    contexts, chunk_drugs = [], []
+    with span(debug, "split", texts=len(all_texts)) as s:
+        for t in all_texts:
+            if not t:
+                continue
+            drug = _drug_of(t)
+            body = t.split("\n", 1)[1] if "\n" in t else t
+            drug_contexts = _chunk_contexts(drug, body, chunk_label(body))
+            contexts.extend(drug_contexts)
+            chunk_drugs.extend([drug] * len(drug_contexts))
+        s["bytes"] = sum(len(c) for c in contexts)
+        s["chunks"] = len(contexts)
+    debug["steps"].append(f"section_split: created {len(contexts)} chunks")
+    return contexts, chunk_drugs
+
+def retrieve_contexts(contexts: List[str], chunk_drugs: List[str], drug_list: List[str], top_k: int = 5,
+                      debug: Optional[Dict[str, Any]] = None) -> List[str]:
+    """
+    Pick the ``top_k`` chunks most relevant to ``drug_list``: stored
+    embeddings + FAISS when LangChain and an OpenAI key are available,
+    local BM25 otherwise. Returns an empty list if retrieval failed.
+    """
+    debug = debug if debug is not None else {"steps": [], "errors": [], "notes": []}
+    retrieved_contexts = []
+    # Embeddings need both LangChain and an OpenAI key; skip the imports otherwise
+    embeddings_cls = _embeddings_cls() if _langchain_installed() and os.getenv("OPENAI_API_KEY") else None
+    if embeddings_cls is not None:
+        try:
+            debug["steps"].append("attempting_langchain_embeddings_and_faiss")
+            from .embedding_store import EmbeddingStore, get_embedding_store, top_k_cosine
+            embeddings = embeddings_cls()
+            store = get_embedding_store(str(getattr(embeddings, "model", "default")))
+            # Only chunks not seen before are sent to the embedding API
+            keys = [EmbeddingStore.key(d, c) for d, c in zip(chunk_drugs, contexts)]
+            with span(debug, "embeddings", chunks=len(keys)) as s:
+                stored = sum(1 for k in keys if k in store.ids)
+                doc_vecs = store.get_or_embed(keys, contexts, embeddings.embed_documents)
+                query = " ".join(drug_list)
+                query_vec = store.get_or_embed(
+                    [EmbeddingStore.key("_query", query)], [query],
+                    lambda q: [embeddings.embed_query(q[0])],
+                )[0]
+                s["cache_hit"] = stored == len(keys)
+                s["embedded"] = len(keys) - stored
+                s["bytes"] = int(doc_vecs.nbytes)
+            debug["steps"].append(f"embedding_store_vectors: {len(keys)}")
+            faiss_cls = _faiss_cls()
+            if faiss_cls is not None:
                 try:
-                    db = FAISS.from_documents([type("D", (), {"page_content": c})() for c in contexts], embeddings)
-                    retriever = db.as_retriever(search_kwargs={"k": top_k})
-                    query = " ".join(drug_list)
-                    retrieved_docs = retriever.get_relevant_documents(query)
+                    with span(debug, "faiss"):
+                        db = faiss_cls.from_embeddings(list(zip(contexts, doc_vecs.tolist())), embeddings)
+                        retrieved_docs = db.similarity_search_by_vector(query_vec.tolist(), k=top_k)
                     retrieved_contexts = [d.page_content for d in retrieved_docs]
                     debug["steps"].append(f"faiss_retrieved: {len(retrieved_contexts)}")
                 except Exception as e:
+                    faiss_cls = None
                     debug["errors"].append(f"faiss_error: {repr(e)}")
                     logger.exception("FAISS creation/retrieval failed: %s", e)
-                    debug["steps"].append("fallback_to_embed_similarity")
-                    doc_vecs = embeddings.embed_documents(contexts)
-                    query_vec = embeddings.embed_query(" ".join(drug_list))
-                    def cosine(a, b):
-                        dot = sum(x * y for x, y in zip(a, b))
-                        na = math.sqrt(sum(x * x for x in a))
-                        nb = math.sqrt(sum(y * y for y in b))
-                        return dot / (na * nb + 1e-12)
-                    sims = [(i, cosine(query_vec, v)) for i, v in enumerate(doc_vecs)]
-                    sims.sort(key=lambda x: x[1], reverse=True)
-                    top = sims[:top_k]
-                    retrieved_contexts = [contexts[i] for i, _ in top]
-                    debug["steps"].append(f"embed_similarity_retrieved: {len(retrieved_contexts)}")
-            except Exception as e:
-                debug["errors"].append(f"embeddings_or_faiss_error: {repr(e)}")
-                logger.exception("Embeddings or FAISS path failed: %s", e)
-        else:
-            debug["steps"].append("no_langchain: naive retrieval")
-            q = " ".join(drug_list).lower()
-            scored = []
-            for i, c in enumerate(contexts):
-                score = sum(1 for token in q.split() if token in c.lower())
-                scored.append((i, score))
-            scored.sort(key=lambda x: x[1], reverse=True)
-            retrieved_contexts = [contexts[i] for i, s in scored[:top_k]]
-            debug["steps"].append(f"naive_retrieved: {len(retrieved_contexts)}")
-
-        if not retrieved_contexts:
-            debug["notes"].append("no_context_retrieved_using_all_texts")
-            retrieved_contexts = contexts[:min(len(contexts), top_k)]
-
-        # -----------------------------
-        # 2a) Integrate openFDA allergy data
-        # -----------------------------
-        allergy_contexts = allergy_summary_context(drug_list)
-        if allergy_contexts:
-            debug["steps"].append(f"allergy_contexts_added: {len(allergy_contexts)}")
-            retrieved_contexts.extend(allergy_contexts)
-        else:
-            debug["notes"].append("no_allergy_context_found_in_openfda")
-
-        # -----------------------------
-        # 3) Build prompt
-        # -----------------------------
-        prompt = _safe_prompt_for_llm(drug_list, retrieved_contexts)
-        debug["steps"].append("built_prompt_for_llm")
-
-        # -----------------------------
-        # 4) Try LangChain ChatOpenAI
-        # -----------------------------
-        if _langchain_available and use_openai:
-            try:
-                debug["steps"].append("attempting_langchain_llm_call")
-                llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.0)
-                try:
-                    answer = llm.predict(prompt)
-                except Exception:
-                    answer = llm(prompt)
-                debug["steps"].append("langchain_llm_success")
-                return {"success": True, "answer": answer, "debug": debug}
-            except Exception as e:
-                debug["errors"].append(f"langchain_llm_error: {repr(e)}")
-                logger.exception("LangChain LLM call failed: %s", e)
-
-        # -----------------------------
-        # 5) Try Gemini API
-        # -----------------------------
-        if _gemini_available:
-            try:
-                debug["steps"].append("attempting_gemini_api_call")
-                model = genai.GenerativeModel("models/gemini-flash-latest")
-                resp = model.generate_content(prompt)
-                answer = getattr(resp, "text", None) or getattr(resp.candidates[0].content.parts[0], "text", "")
-                answer = answer.strip() if answer else None
-                if answer:
-                    debug["steps"].append("gemini_api_success")
-                    return {"success": True, "answer": answer, "debug": debug}
-            except Exception as e:
-                debug["errors"].append(f"gemini_api_error: {repr(e)}\n{traceback.format_exc()}")
-                logger.exception("Gemini API path failed: %s", e)
-
-        # -----------------------------
-        # 6) Direct OpenAI fallback
-        # -----------------------------
-        if _openai_available and use_openai:
+            if faiss_cls is None:
+                debug["steps"].append("fallback_to_embed_similarity")
+                with span(debug, "embed_similarity"):
+                    top = top_k_cosine(doc_vecs, query_vec, top_k)
+                retrieved_contexts = [contexts[i] for i in top]
+                debug["steps"].append(f"embed_similarity_retrieved: {len(retrieved_contexts)}")
+        except Exception as e:
+            debug["errors"].append(f"embeddings_or_faiss_error: {repr(e)}")
+            logger.exception("Embeddings or FAISS path failed: %s", e)
+    else:
+        debug["steps"].append("no_embeddings: bm25 retrieval")
+        try:
+            with span(debug, "bm25", chunks=len(contexts)):
+                top = bm25.rank_chunks(contexts, chunk_drugs, " ".join(drug_list), top_k)
+            retrieved_contexts = [contexts[i] for i in top]
+            debug["steps"].append(f"bm25_retrieved: {len(retrieved_contexts)}")
+        except Exception as e:
+            debug["errors"].append(f"bm25_error: {repr(e)}")
+            logger.exception("BM25 retrieval failed: %s", e)
+    return retrieved_contexts
+
+def _langchain_stream(prompt: str) -> Iterator[str]:
+    llm = _chat_model_cls()(model_name="gpt-4o-mini", temperature=0.0)
+    if hasattr(llm, "stream"):
+        for chunk in llm.stream(prompt):
+            yield getattr(chunk, "content", chunk)
+        return
+    try:
+        yield llm.predict(prompt)
+    except Exception:
+        yield llm(prompt)
+
+
+def _gemini_stream(prompt: str) -> Iterator[str]:
+    model = _gemini().GenerativeModel("models/gemini-flash-latest")
+    for chunk in model.generate_content(prompt, stream=True):
+        try:
+            text = chunk.text
+        except (ValueError, AttributeError):
+            # Blocked or empty chunks have no text accessor; read the parts directly
+            text = getattr(chunk.candidates[0].content.parts[0], "text", "") if chunk.candidates else ""
+        if text:
+            yield text
+
+
+def _openai_stream(prompt: str) -> Iterator[str]:
+    api_key = os.getenv("OPENAI_API_KEY", None)
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY not set in environment for openai fallback")
+    openai = get_openai()
+    openai.api_key = api_key
+
+    model = "gpt-4o-mini"
+    try:
+        stream = openai.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.0,
+            max_tokens=650,
+            stream=True,
+        )
+    except Exception as e:
+        logger.warning("openai model %s failed: %s, falling back to gpt-3.5-turbo", model, e)
+        stream = openai.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.0,
+            max_tokens=650,
+            stream=True,
+        )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+# (provider, debug step tag, availability check, token stream), in fallback order.
+# Availability is checked lazily so a provider's SDK is only imported when reached.
+LLM_PROVIDERS: List[Tuple[str, str, Callable[[bool], bool], Callable[[str], Iterator[str]]]] = [
+    ("langchain", "langchain_llm",
+     lambda use_openai: bool(use_openai and _langchain_installed() and os.getenv("OPENAI_API_KEY")
+                             and _chat_model_cls() is not None),
+     _langchain_stream),
+    ("gemini", "gemini_api", lambda use_openai: _gemini() is not None, _gemini_stream),
+    ("openai", "openai_api",
+     lambda use_openai: bool(use_openai and os.getenv("OPENAI_API_KEY") and get_openai() is not None),
+     _openai_stream),
+]
+
+
+# With LLM_HEDGE_AFTER_MS > 0, a provider that has not produced its first token
+# by then is raced against the next one in the chain (first token wins).
+LLM_HEDGE_AFTER_MS = float(os.getenv("LLM_HEDGE_AFTER_MS", "0"))
+
+
+def _llm_candidates(use_openai: bool, debug: Dict[str, Any]) -> Iterator[Tuple[str, str, Callable]]:
+    """Providers in fallback order that are configured and whose circuit is not open."""
+    for provider, tag, available, stream in LLM_PROVIDERS:
+        if not available(use_openai):
+            continue
+        if not get_breaker(provider).allow():
+            debug["steps"].append(f"skipped_{tag}: circuit open")
+            continue
+        yield provider, tag, stream
+
+
+def _run_provider(candidate: Tuple[str, str, Callable], prompt: str, debug: Dict[str, Any],
+                  stop: Optional[threading.Event] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Stream one provider: delta events, then an answer event on success.
+    Failures are recorded (debug + circuit breaker) and end the stream
+    without an answer. Setting ``stop``, or closing the generator (the
+    consumer went away), abandons the call without a verdict.
+    """
+    provider, tag, stream = candidate
+    breaker = get_breaker(provider)
+    debug["steps"].append(f"attempting_{tag}_call")
+    pieces: List[str] = []
+    tokens = None
+    settled = False
+    try:
+        with span(debug, f"llm_{provider}") as s:
+            started = time.perf_counter()
+            tokens = stream(prompt)
+            for piece in tokens:
+                if stop is not None and stop.is_set():
+                    s["abandoned"] = True
+                    debug["steps"].append(f"{tag}_abandoned")
+                    return
+                if not piece:
+                    continue
+                if not pieces:
+                    s["first_token_ms"] = round((time.perf_counter() - started) * 1000, 3)
+                pieces.append(piece)
+                yield {"type": "delta", "text": piece}
+            s["bytes"] = sum(len(p) for p in pieces)
+        answer = "".join(pieces).strip()
+        if not answer:
+            raise RuntimeError("empty answer")
+        breaker.record_success()
+        settled = True
+        debug["steps"].append(f"{tag}_success")
+        yield {"type": "answer", "answer": answer, "provider": provider}
+    except Exception as e:
+        breaker.record_failure(e)
+        settled = True
+        debug["errors"].append(f"{tag}_error: {repr(e)}\n{traceback.format_exc()}")
+        logger.exception("%s LLM call failed: %s", provider, e)
+    finally:
+        if not settled:
+            # Abandoned (stop, or GeneratorExit from a closed stream): free a
+            # half-open probe slot, or the provider stays disabled for good
+            breaker.release()
+            if tokens is not None and hasattr(tokens, "close"):
+                tokens.close()
+
+
+def _hedged(first: Tuple[str, str, Callable], candidates: Iterator, prompt: str, debug: Dict[str, Any],
+            hedge_after: float) -> Iterator[Dict[str, Any]]:
+    """
+    Run ``first``; if it shows no token within ``hedge_after`` seconds, start
+    the next candidate as well. Whichever produces a token first wins and the
+    other is abandoned. Yields the winner's events.
+    """
+    events: "queue.Queue" = queue.Queue()
+    stops: Dict[str, threading.Event] = {}
+
+    def pump(candidate, stop):
+        try:
+            for event in _run_provider(candidate, prompt, debug, stop):
+                events.put((candidate[0], event))
+        finally:
+            events.put((candidate[0], None))
+
+    def start(candidate):
+        stops[candidate[0]] = threading.Event()
+        threading.Thread(target=in_context(pump), args=(candidate, stops[candidate[0]]), daemon=True).start()
+
+    start(first)
+    running = {first[0]}
+    winner = None
+    exhausted = False
+    deadline = time.monotonic() + hedge_after
+    try:
+        while (winner is None and running) or winner in running:
+            hedge_pending = winner is None and len(stops) == 1 and not exhausted
             try:
-                debug["steps"].append("attempting_openai_api_call")
-                key = os.getenv("OPENAI_API_KEY", None)
-                if not key:
-                    raise RuntimeError("OPENAI_API_KEY not set in environment for openai fallback")
-                openai.api_key = key
+                provider, event = events.get(timeout=max(0.0, deadline - time.monotonic()) if hedge_pending else None)
+            except queue.Empty:
+                second = next(candidates, None)
+                if second is None:
+                    exhausted = True
+                    continue
+                debug["steps"].append(f"hedged_{second[0]}_after_{int(hedge_after * 1000)}ms")
+                start(second)
+                running.add(second[0])
+                continue
+            if event is None:
+                running.discard(provider)
+                continue
+            if winner is None and event["type"] == "delta":
+                winner = provider
+                for other, stop in stops.items():
+                    if other != provider:
+                        stop.set()
+            if provider == winner:
+                yield event
+    finally:
+        # The winner too: if the consumer closed the stream, nobody reads its tokens
+        for stop in stops.values():
+            stop.set()
+
 
-                model = "gpt-4o-mini"
+def stream_answer(prompt: str, use_openai: bool = True, debug: Optional[Dict[str, Any]] = None,
+                  hedge_after_ms: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Run the LLM provider chain on ``prompt``, streaming. Yields
+    ``{"type": "delta", "text": ...}`` as tokens arrive, ``{"type": "reset"}``
+    when a provider fails mid-answer (whatever was shown should be discarded;
+    the next provider starts over) and finally ``{"type": "answer", "answer":
+    ..., "provider": ...}`` from the first provider that answered. Yields no
+    answer event if every provider failed.
+
+    Providers whose circuit breaker is open are skipped. With
+    ``hedge_after_ms`` (default LLM_HEDGE_AFTER_MS; 0 disables) a slow
+    provider is raced against the next one.
+    """
+    debug = debug if debug is not None else {"steps": [], "errors": [], "notes": []}
+    hedge_after_ms = LLM_HEDGE_AFTER_MS if hedge_after_ms is None else hedge_after_ms
+    candidates = _llm_candidates(use_openai, debug)
+    for candidate in candidates:
+        if hedge_after_ms > 0:
+            attempt = _hedged(candidate, candidates, prompt, debug, hedge_after_ms / 1000.0)
+        else:
+            attempt = _run_provider(candidate, prompt, debug)
+        shown = False
+        for event in attempt:
+            yield event
+            if event["type"] == "answer":
+                return
+            shown = True
+        if shown:
+            yield {"type": "reset"}
+
+
+def generate_answer(prompt: str, use_openai: bool = True,
+                    debug: Optional[Dict[str, Any]] = None) -> Optional[Tuple[str, str]]:
+    """
+    Non-streaming stream_answer(): (answer, provider) from the first provider
+    that answers, or None if none did.
+    """
+    for event in stream_answer(prompt, use_openai, debug):
+        if event["type"] == "answer":
+            return event["answer"], event["provider"]
+    return None
+
+def screen_label_texts(all_texts: List[str], drug_list: List[str],
+                       debug: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Rule-based screen (interaction_index) over "<drug>:\n<label>" texts."""
+    label_texts = {}
+    for t in all_texts:
+        if t and "\n" in t:
+            label_texts[_drug_of(t)] = t.split("\n", 1)[1]
+    with span(debug, "screen", labels=len(label_texts)) as s:
+        screen = screen_interactions(drug_list, label_texts)
+        s["findings"] = len(screen["findings"])
+    return screen
+
+def run_rag_pipeline(all_texts: List[str], drug_list: List[str], top_k: int = 5, use_openai: bool = True,
+                     chunks: Optional[Tuple[List[str], List[str]]] = None,
+                     screen: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Runs the RAG pipeline with:
+      - LangChain embeddings + FAISS retrieval if available, BM25 otherwise
+      - LLM summarization via LangChain, Gemini, or OpenAI
+      - Allergy-specific context from openFDA
+      - Fallback to simple summary if all else fails
+    LLM answers are memoized per drug set + evidence (see verdict_cache).
+    ``chunks`` may carry a label_chunks() or split_label_texts() result, in which
+    case ``all_texts`` is not split again; likewise ``screen`` for a
+    precomputed screen_label_texts() result.
+    """
+    result: Dict[str, Any] = {}
+    for event in stream_rag_pipeline(all_texts, drug_list, top_k, use_openai, chunks, screen):
+        if event["type"] == "result":
+            result = event["result"]
+    return result
+
+def stream_rag_pipeline(all_texts: List[str], drug_list: List[str], top_k: int = 5, use_openai: bool = True,
+                        chunks: Optional[Tuple[List[str], List[str]]] = None,
+                        screen: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Streaming run_rag_pipeline(). First yields the rule-based screen as
+    ``{"type": "screen", "screen": ...}``, then the answer as ``{"type": "delta"}``
+    and ``{"type": "reset"}`` events (see stream_answer) and ends with
+    ``{"type": "result", "result": ...}`` carrying what run_rag_pipeline()
+    would have returned. Cached verdicts and the fallback summary arrive as a
+    single delta.
+    """
+    debug = {"steps": [], "errors": [], "notes": []}
+    with span(debug, "rag_pipeline", drugs=len(drug_list)):
+        try:
+            # -----------------------------
+            # 0) Rule-based screen, before any retrieval or LLM call
+            # -----------------------------
+            if screen is None:
                 try:
-                    resp = openai.chat.completions.create(
-                        model=model,
-                        messages=[{"role": "user", "content": prompt}],
-                        temperature=0.0,
-                        max_tokens=650
-                    )
+                    screen = screen_label_texts(all_texts, drug_list, debug)
                 except Exception as e:
-                    logger.warning("openai model %s failed: %s, falling back to gpt-3.5-turbo", model, e)
-                    resp = openai.chat.completions.create(
-                        model="gpt-3.5-turbo",
-                        messages=[{"role": "user", "content": prompt}],
-                        temperature=0.0,
-                        max_tokens=650
-                    )
-                answer = resp["choices"][0]["message"]["content"].strip()
-                debug["steps"].append("openai_api_success")
-                return {"success": True, "answer": answer, "debug": debug}
-            except Exception as e:
-                debug["errors"].append(f"openai_api_error: {repr(e)}\n{traceback.format_exc()}")
-                logger.exception("OpenAI API path failed: %s", e)
-
-        # -----------------------------
-        # 7) Final fallback
-        # -----------------------------
-        fallback = _simple_fallback_summary(drug_list, retrieved_contexts)
-        debug["notes"].append("used_simple_fallback_summary")
-        return {"success": True, "answer": fallback, "debug": debug}
+                    logger.exception("Mention screen failed: %s", e)
+                    debug["errors"].append(f"screen_error: {repr(e)}")
+            if screen is not None:
+                debug["steps"].append(f"screen: {screen['severity']} ({len(screen['findings'])} findings)")
+                yield {"type": "screen", "screen": screen}
 
-    except Exception as e:
-        logger.exception("Unexpected error in run_rag_pipeline: %s", e)
-        debug["errors"].append(f"unexpected_error: {repr(e)}\n{traceback.format_exc()}")
-        return {"success": False, "answer": None, "debug": debug}
+            # -----------------------------
+            # 1) Split texts into chunks
+            # -----------------------------
+            if chunks is not None:
+                contexts, chunk_drugs = list(chunks[0]), list(chunks[1])
+                debug["steps"].append(f"reused_chunks: {len(contexts)}")
+            else:
+                contexts, chunk_drugs = split_label_texts(all_texts, debug)
+
+            # -----------------------------
+            # 2) Retrieve relevant contexts
+            # -----------------------------
+            with span(debug, "retrieve", chunks=len(contexts)):
+                retrieved_contexts = retrieve_contexts(contexts, chunk_drugs, drug_list, top_k, debug)
+
+            if not retrieved_contexts:
+                debug["notes"].append("no_context_retrieved_using_all_texts")
+                retrieved_contexts = contexts[:min(len(contexts), top_k)]
+
+            # -----------------------------
+            # 2a) Integrate openFDA allergy data
+            # -----------------------------
+            with span(debug, "allergies", drugs=len(drug_list)):
+                allergy_contexts = allergy_summary_context(drug_list, debug)
+            if allergy_contexts:
+                debug["steps"].append(f"allergy_contexts_added: {len(allergy_contexts)}")
+            else:
+                debug["notes"].append("no_allergy_context_found_in_openfda")
+
+            # -----------------------------
+            # 3) Build prompt from deduplicated evidence within the token budget
+            # -----------------------------
+            with span(debug, "prompt") as s:
+                packed_contexts = pack_contexts(retrieved_contexts, allergy_contexts, debug=debug)
+                prompt = _safe_prompt_for_llm(drug_list, packed_contexts)
+                debug["tokens"]["prompt_tokens"] = count_tokens(prompt)
+                s["bytes"] = len(prompt)
+                s["tokens"] = debug["tokens"]["prompt_tokens"]
+            debug["steps"].append(f"built_prompt_for_llm: {debug['tokens']['prompt_tokens']} tokens")
+            retrieved_contexts = retrieved_contexts + allergy_contexts
+
+            # -----------------------------
+            # 3a) Memoized verdict for this drug set + evidence
+            # -----------------------------
+            with span(debug, "verdict_cache") as s:
+                key = verdict_key(drug_list, packed_contexts)
+                cached = load_verdict(key)
+                s["cache_hit"] = bool(cached and cached.get("answer"))
+            if cached and cached.get("answer"):
+                debug["steps"].append(f"verdict_cache_hit ({cached.get('provider')})")
+                yield {"type": "delta", "text": cached["answer"]}
+                yield {"type": "result", "result": {"success": True, "answer": cached["answer"], "debug": debug,
+                                                    "cached": True, "verdict_key": key, "verdict": cached,
+                                                    "screen": screen}}
+                return
+
+            # -----------------------------
+            # 4) LLM provider chain
+            # -----------------------------
+            llm_result = None
+            with span(debug, "llm"):
+                for event in stream_answer(prompt, use_openai, debug):
+                    if event["type"] == "answer":
+                        llm_result = event
+                    else:
+                        yield event
+            if llm_result is not None:
+                try:
+                    save_verdict(key, answer=llm_result["answer"], provider=llm_result["provider"])
+                except Exception:
+                    logger.exception("Failed to cache verdict for %s", drug_list)
+                yield {"type": "result", "result": {"success": True, "answer": llm_result["answer"], "debug": debug,
+                                                    "cached": False, "verdict_key": key, "screen": screen}}
+                return
+
+            # -----------------------------
+            # 5) Final fallback (cheap and deterministic, so never memoized)
+            # -----------------------------
+            fallback = _simple_fallback_summary(drug_list, retrieved_contexts, screen)
+            debug["notes"].append("used_simple_fallback_summary")
+            yield {"type": "delta", "text": fallback}
+            yield {"type": "result", "result": {"success": True, "answer": fallback, "debug": debug,
+                                                "screen": screen}}
+
+        except Exception as e:
+            logger.exception("Unexpected error in run_rag_pipeline: %s", e)
+            debug["errors"].append(f"unexpected_error: {repr(e)}\n{traceback.format_exc()}")
+            yield {"type": "result", "result": {"success": False, "answer": None, "debug": debug,
+                                                "screen": screen}}
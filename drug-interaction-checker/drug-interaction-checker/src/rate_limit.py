@@ -0,0 +1,137 @@
+"""
+Token-bucket rate limiting shared by every process on the host.
+
+openFDA allows 240 requests a minute per client and 1,000 a day without an
+API key (120,000 a day with one). The CLI, the Streamlit app and every
+worker process draw from the same buckets, whose state lives in one small
+SQLite database (``OPENFDA_RATE_DB`` or ``cache/openfda_rate.sqlite3``).
+Each acquire is one short ``BEGIN IMMEDIATE`` transaction, so concurrent
+processes never hand out the same token.
+
+    limiter = openfda_limiter()
+    waited = limiter.acquire()      # seconds spent queueing; RateLimited if too long
+
+Buckets are named after the quota they model ("ip:minute",
+"key-1a2b3c4d:day"), so processes using different API keys don't share them.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .utils import PROJECT_ROOT, logger
+
+RATE_DB = Path(os.getenv("OPENFDA_RATE_DB", PROJECT_ROOT / "cache" / "openfda_rate.sqlite3"))
+OPENFDA_API_KEY = os.getenv("OPENFDA_API_KEY", "")
+RATE_PER_MINUTE = float(os.getenv("OPENFDA_RATE_PER_MIN", "240"))
+# Requests that may go out back to back before the per-minute rate applies
+BURST = float(os.getenv("OPENFDA_BURST", "20"))
+DAILY_LIMIT = float(os.getenv("OPENFDA_DAILY_LIMIT", "120000" if OPENFDA_API_KEY else "1000"))
+# Longest a request queues for a token before giving up with RateLimited
+MAX_QUEUE_S = float(os.getenv("OPENFDA_MAX_QUEUE_S", "30"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name    TEXT PRIMARY KEY,
+    tokens  REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+class RateLimited(Exception):
+    """No token within the allowed queueing time (e.g. the daily quota is used up)."""
+
+    def __init__(self, bucket: str, wait: float):
+        super().__init__(f"openFDA rate limit: bucket {bucket} has no token for {wait:.0f}s")
+        self.bucket = bucket
+        self.wait = wait
+
+
+class TokenBucketLimiter:
+    """Several token buckets, all of which must hold a token for a request to go out."""
+
+    def __init__(self, buckets: List[Tuple[str, float, float]], path=RATE_DB, max_queue: float = MAX_QUEUE_S):
+        # (name, capacity, refill per second)
+        self.buckets = buckets
+        self.path = Path(path)
+        self.max_queue = max_queue
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _try_take(self) -> Tuple[float, str]:
+        """Take a token from every bucket, or none; returns (seconds until possible, bucket) -- 0 on success."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels: Dict[str, float] = {}
+            wait, blocking = 0.0, ""
+            for name, capacity, rate in self.buckets:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+                levels[name] = tokens
+                if tokens < 1 and (1 - tokens) / rate > wait:
+                    wait, blocking = (1 - tokens) / rate, name
+            if wait == 0:
+                conn.executemany("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                                 [(name, tokens - 1, now) for name, tokens in levels.items()])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait, blocking
+
+    def acquire(self) -> float:
+        """Block until a request may go out; returns the seconds spent waiting."""
+        started = time.monotonic()
+        while True:
+            wait, bucket = self._try_take()
+            if wait == 0:
+                return time.monotonic() - started
+            queued = time.monotonic() - started
+            if queued + wait > self.max_queue:
+                raise RateLimited(bucket, wait)
+            # Another process may take the token first, so re-check after sleeping
+            time.sleep(wait)
+
+    def levels(self) -> Dict[str, float]:
+        """Current token count per bucket (for diagnostics)."""
+        now = time.time()
+        out = {}
+        for name, capacity, rate in self.buckets:
+            row = self._conn().execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+            out[name] = round(capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate), 2)
+        return out
+
+
+_limiter: Optional[TokenBucketLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def openfda_limiter() -> TokenBucketLimiter:
+    """The process-wide limiter for api.fda.gov, built from the OPENFDA_* settings."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            scope = f"key-{hashlib.sha1(OPENFDA_API_KEY.encode()).hexdigest()[:8]}" if OPENFDA_API_KEY else "ip"
+            _limiter = TokenBucketLimiter([
+                (f"{scope}:minute", BURST, RATE_PER_MINUTE / 60),
+                (f"{scope}:day", DAILY_LIMIT, DAILY_LIMIT / 86400),
+            ])
+            logger.debug("openFDA limiter: %s", _limiter.buckets)
+        return _limiter
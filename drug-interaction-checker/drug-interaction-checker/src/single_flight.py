@@ -0,0 +1,68 @@
+"""
+Single-flight coalescing of concurrent identical work.
+
+When several threads miss the cache for the same key at once, only the first
+(the leader) does the work; the rest wait for its result instead of each
+repeating the same upstream request.
+
+    leader, call = flights.begin(key)
+    if leader:
+        try:
+            value = fetch()
+            call.set(value)
+        finally:
+            flights.end(key, call)
+    else:
+        value = call.wait(timeout)   # None if the leader failed or timed out
+
+Coalescing is per process; the shared cache covers the cross-process case
+once the leader has stored its result.
+"""
+import threading
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class Call:
+    """One in-flight piece of work and, once done, its result."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.value: Any = None
+        self.followers = 0
+
+    def set(self, value: Any):
+        self.value = value
+        self._done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> Any:
+        """The leader's result, or None if it failed or ``timeout`` passed first."""
+        self._done.wait(timeout)
+        return self.value
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Call] = {}
+
+    def begin(self, key: Hashable) -> Tuple[bool, Call]:
+        """``(True, call)`` for the leader, who must end() it; ``(False, call)`` to wait on."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                return False, call
+            call = self._calls[key] = Call()
+            return True, call
+
+    def end(self, key: Hashable, call: Call):
+        """Retire the leader's call; followers of a failed leader are released with None."""
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        if not call._done.is_set():
+            call.set(None)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
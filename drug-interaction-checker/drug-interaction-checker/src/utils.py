@@ -1,26 +1,18 @@
 import os
 import json
-import logging
+import functools
+import time
 from pathlib import Path
+from typing import List, Optional
 from dotenv import load_dotenv
 
-# External APIs
-import openai
-import google.generativeai as genai
+from .logging_setup import LOG_DIR, LOG_FILE, configure_logging, in_context, request_context
 
 # -------------------------------
-# Logging setup
+# Logging setup (queued, rotated; see logging_setup)
 # -------------------------------
-LOG_DIR = Path(__file__).resolve().parent.parent / "logs"
-LOG_DIR.mkdir(exist_ok=True)
-LOG_FILE = LOG_DIR / "app.log"
-
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format="%(asctime)s — %(levelname)s — %(name)s — %(message)s",
-)
-logger = logging.getLogger("drug_rag_app")
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+logger = configure_logging()
 
 # -------------------------------
 # Env
@@ -29,10 +21,33 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
-if OPENAI_API_KEY:
-    openai.api_key = OPENAI_API_KEY
-if GOOGLE_API_KEY:
-    genai.configure(api_key=GOOGLE_API_KEY)
+# -------------------------------
+# External API clients (imported on first use; both are slow to import)
+# -------------------------------
+@functools.lru_cache(maxsize=None)
+def get_openai():
+    """Import and configure the openai module, or return None if it is missing."""
+    try:
+        import openai
+    except Exception as e:
+        logger.warning("openai package not available: %s", e)
+        return None
+    if OPENAI_API_KEY:
+        openai.api_key = OPENAI_API_KEY
+    return openai
+
+
+@functools.lru_cache(maxsize=None)
+def get_genai():
+    """Import and configure google.generativeai, or return None if it is missing."""
+    try:
+        import google.generativeai as genai
+    except Exception as e:
+        logger.warning("google.generativeai package not available: %s", e)
+        return None
+    if GOOGLE_API_KEY:
+        genai.configure(api_key=GOOGLE_API_KEY)
+    return genai
 
 # -------------------------------
 # Utility functions
@@ -42,28 +57,29 @@ def clean_drug_name(name: str) -> str:
     return name.strip().lower().replace(" ", "_")
 
 
-def save_cache(drug: str, data: dict, cache_dir="cache"):
-    """Save FDA result to cache."""
-    cache_dir = Path(cache_dir)
-    cache_dir.mkdir(exist_ok=True)
-    path = cache_dir / f"{clean_drug_name(drug)}.json"
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+def save_cache(drug: str, data, namespace: str = "labels", ttl: Optional[float] = None):
+    """Save FDA result to the shared cache (see cache_store); ``ttl`` in seconds."""
+    from .cache_store import get_cache, DEFAULT_LABEL_TTL
+    # Raw openFDA documents expire with the labels they were cut from
+    if ttl is None and namespace in ("labels", "labels_raw"):
+        ttl = DEFAULT_LABEL_TTL
+    get_cache().put(namespace, clean_drug_name(drug), data, ttl=ttl)
 
 
-def load_cache(drug: str, cache_dir="cache"):
-    """Load cached FDA result if available."""
-    path = Path(cache_dir) / f"{clean_drug_name(drug)}.json"
-    if path.exists():
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as e:
-            logger.warning("Cache load failed for %s: %s", drug, e)
+def load_cache(drug: str, namespace: str = "labels"):
+    """Load cached FDA result if available and not expired."""
+    from .cache_store import get_cache
+    try:
+        return get_cache().get(namespace, clean_drug_name(drug))
+    except Exception as e:
+        logger.warning("Cache load failed for %s: %s", drug, e)
     return None
 
 
-def load_sample_labels(sample_file):
+SAMPLE_LABELS_FILE = PROJECT_ROOT / "data" / "sample_labels.json"
+
+
+def load_sample_labels(sample_file=SAMPLE_LABELS_FILE):
     """Load sample labels from a file (ensures Path)."""
     sample_file = Path(sample_file)
     if sample_file.exists():
@@ -83,6 +99,9 @@ def list_gemini_models():
     try:
         if not GOOGLE_API_KEY:
             return ["❌ No GOOGLE_API_KEY set"]
+        genai = get_genai()
+        if genai is None:
+            return ["❌ google-generativeai not installed"]
         models = genai.list_models()
         return [m.name for m in models if "generateContent" in m.supported_generation_methods]
     except Exception as e:
@@ -92,14 +111,16 @@ def list_gemini_models():
 # -------------------------------
 # API connectivity check
 # -------------------------------
-def show_api_status():
-    import streamlit as st
-
-    st.subheader("🔌 API Connectivity Check")
-
+def check_api_status() -> dict:
+    """
+    Live round trip to each configured LLM provider plus the Gemini model
+    list. Costs real completions; callers should cache the result (app.py
+    keeps it for API_STATUS_TTL seconds).
+    """
     # Test OpenAI
     openai_status = "❌ Not available"
-    if OPENAI_API_KEY:
+    openai = get_openai() if OPENAI_API_KEY else None
+    if openai is not None:
         try:
             resp = openai.chat.completions.create(
                 model="gpt-3.5-turbo",
@@ -110,11 +131,11 @@ def show_api_status():
             openai_status = f"✅ OpenAI working: '{msg}'"
         except Exception as e:
             openai_status = f"⚠️ OpenAI error: {str(e)[:120]}"
-    st.markdown(f"<h3 style='color:blue;'>{openai_status}</h3>", unsafe_allow_html=True)
 
     # Test Gemini
     gemini_status = "❌ Not available"
-    if GOOGLE_API_KEY:
+    genai = get_genai() if GOOGLE_API_KEY else None
+    if genai is not None:
         try:
             model = genai.GenerativeModel("gemini-1.5-flash")
             resp = model.generate_content("Hello Gemini!")
@@ -122,8 +143,44 @@ def show_api_status():
             gemini_status = f"✅ Gemini working: '{msg}'"
         except Exception as e:
             gemini_status = f"⚠️ Gemini error: {str(e)[:120]}"
-    st.markdown(f"<h3 style='color:green;'>{gemini_status}</h3>", unsafe_allow_html=True)
+
+    return {
+        "openai": openai_status,
+        "gemini": gemini_status,
+        "gemini_models": list_gemini_models(),
+        "checked_at": time.time(),
+    }
+
+
+def show_api_status(status: Optional[dict] = None):
+    """Render a check_api_status() result (checking now if none is given)."""
+    import streamlit as st
+
+    status = status or check_api_status()
+    st.subheader("🔌 API Connectivity Check")
+    st.markdown(f"<h3 style='color:blue;'>{status['openai']}</h3>", unsafe_allow_html=True)
+    st.markdown(f"<h3 style='color:green;'>{status['gemini']}</h3>", unsafe_allow_html=True)
 
     # Show available Gemini models
     st.write("Available Gemini models:")
-    st.json(list_gemini_models())
+    st.json(status["gemini_models"])
+    st.caption(f"Checked {time.strftime('%H:%M:%S', time.localtime(status['checked_at']))}")
+
+
+def tail_lines(path, n: int = 200, block_size: int = 8192) -> List[str]:
+    """
+    Last ``n`` lines of a text file, read backwards from the end in blocks,
+    so the cost depends on ``n`` and not on the size of the file.
+    """
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        # One extra newline: the file normally ends with one
+        while pos > 0 and data.count(b"\n") <= n:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    lines = data.decode("utf-8", errors="ignore").splitlines(keepends=True)
+    return lines[-n:]
@@ -0,0 +1,37 @@
+"""
+Memoized interaction verdicts.
+
+An LLM verdict is a function of the drugs being checked and the evidence
+placed in the prompt. Keying on the sorted, normalized drug set plus a hash
+of that evidence lets repeat checks skip the LLM entirely, and any change to
+the underlying label text (or allergy data) changes the key, so stale
+verdicts are never served.
+"""
+import hashlib
+from typing import Any, Dict, List, Optional
+
+from .utils import clean_drug_name, load_cache, save_cache
+
+VERDICT_NAMESPACE = "verdicts"
+VERDICT_CACHE_TTL = 7 * 24 * 3600
+
+
+def verdict_key(drug_list: List[str], evidence: List[str]) -> str:
+    drugs = ",".join(sorted({clean_drug_name(d) for d in drug_list}))
+    h = hashlib.sha1()
+    # Order-independent: the same drugs listed differently retrieve the same evidence
+    for piece in sorted(evidence):
+        h.update(piece.encode("utf-8"))
+        h.update(b"\x00")
+    return f"{drugs}/{h.hexdigest()}"
+
+
+def load_verdict(key: str) -> Optional[Dict[str, Any]]:
+    return load_cache(key, namespace=VERDICT_NAMESPACE)
+
+
+def save_verdict(key: str, **fields):
+    """Merge ``fields`` (answer, severity, alternatives, ...) into the stored verdict."""
+    record = load_verdict(key) or {}
+    record.update(fields)
+    save_cache(key, record, namespace=VERDICT_NAMESPACE, ttl=VERDICT_CACHE_TTL)
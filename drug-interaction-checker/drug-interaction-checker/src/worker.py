@@ -0,0 +1,270 @@
+"""
+Long-lived worker mode for the interaction checker.
+
+Instead of paying interpreter start-up and library imports for every check,
+a worker stays resident and answers newline-delimited JSON requests:
+
+    {"id": "42", "drugs": ["warfarin", "amoxicillin"]}
+    {"id": "43", "drugs": ["warfarin", "amoxicillin"], "raw": true}
+    {"id": "45", "drugs": ["warfarin", "amoxicillin", "digoxin"], "mode": "matrix",
+     "previous": [...pairs from an earlier matrix result...]}
+    {"id": "47", "drugs": ["warfarin", "amoxicillin"], "stream": true}
+    {"id": "44", "op": "ping"}
+    {"id": "46", "op": "metrics"}
+
+Each response is a single JSON line carrying the same ``id`` plus the usual
+``check_interactions()`` result. Requests can arrive on stdin (one worker per
+child process, as the Node backend uses it) or on a local socket. With
+``--processes N`` requests are fanned out to a small pool of warm processes.
+
+With ``"stream": true`` the rule-based screen (see interaction_index) is
+sent first as a ``{"id", "type": "screen", "screen"}`` line and the answer
+as it is generated, as ``{"id", "type": "delta", "text"}`` lines (and ``{"id", "type": "reset"}``
+when a provider fails mid-answer), before the final line, which then carries
+``"type": "result"``. Pooled workers (``--processes`` > 1) send only the final line.
+
+Stage latency histograms (see metrics.py) are returned by the ``metrics`` op
+and, with ``--metrics-file``, written out in the Prometheus text format every
+``METRICS_EXPORT_INTERVAL`` seconds.
+"""
+import argparse
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional, TextIO
+
+from . import metrics
+from .circuit_breaker import breaker_states
+from .logging_setup import use_process_log_file
+from .utils import logger, request_context
+
+
+def _warm_up():
+    """Import the pipeline and its lazy dependencies so the first request doesn't pay for them."""
+    from . import check_interactions  # noqa: F401
+    from . import fda_api  # noqa: F401
+    from . import rag_pipeline
+    rag_pipeline.preload()
+    logger.info("Interaction worker %s ready", os.getpid())
+
+
+def _init_pool_process():
+    """Pool process initializer: its own log file (see logging_setup), then warm up."""
+    use_process_log_file()
+    _warm_up()
+
+
+def handle_request(request: Any, emit: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    Run a single protocol request and return the response object. Streamed
+    answer events go to ``emit``, if given.
+    """
+    if not isinstance(request, dict):
+        return {"id": None, "success": False, "error": "Request must be a JSON object"}
+
+    req_id = request.get("id")
+    op = request.get("op", "check")
+
+    if op == "ping":
+        return {"id": req_id, "success": True, "pong": True, "pid": os.getpid()}
+
+    if op == "metrics":
+        return {"id": req_id, "success": True, "pid": os.getpid(), "stages": metrics.snapshot(),
+                "providers": breaker_states(), "prometheus": metrics.render_prometheus()}
+
+    if op != "check":
+        return {"id": req_id, "success": False, "error": f"Unknown op '{op}'"}
+
+    drugs = request.get("drugs")
+    if not isinstance(drugs, list) or len(drugs) < 2:
+        return {"id": req_id, "success": False, "error": "Please provide at least 2 drugs as a JSON array"}
+    if not all(isinstance(drug, str) and drug.strip() for drug in drugs):
+        return {"id": req_id, "success": False, "error": "Drug names must be non-empty strings"}
+
+    started = time.perf_counter()
+    with request_context(req_id):
+        result = _run_check(request, drugs, emit)
+        duration_ms = round((time.perf_counter() - started) * 1000, 3)
+        logger.info("Request %s: %s for %d drugs in %.1f ms", req_id, request.get("mode") or "check",
+                    len(drugs), duration_ms, extra={"stage": "request", "duration_ms": duration_ms})
+    result["id"] = req_id
+    metrics.maybe_export()
+    return result
+
+
+def _run_check(request: Dict[str, Any], drugs: list,
+               emit: Optional[Callable[[Dict[str, Any]], None]]) -> Dict[str, Any]:
+    from .check_interactions import check_interactions, check_interaction_matrix
+    req_id = request.get("id")
+    include_raw = bool(request.get("raw", False))
+    try:
+        if request.get("mode") == "matrix":
+            result = check_interaction_matrix(drugs, include_raw=include_raw, previous=request.get("previous"))
+        elif request.get("stream") and emit is not None:
+            result = check_interactions(drugs, include_raw=include_raw,
+                                        on_event=lambda event: emit({"id": req_id, **event}))
+            result["type"] = "result"
+        else:
+            result = check_interactions(drugs, include_raw=include_raw)
+    except Exception as e:
+        logger.exception("Worker request %s failed: %s", req_id, e)
+        result = {"success": False, "error": f"Unexpected error: {str(e)}"}
+    return result
+
+
+def _parse_line(line: str) -> Optional[Any]:
+    line = line.strip()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+class Dispatcher:
+    """Runs requests inline, or on a pool of pre-warmed processes."""
+
+    def __init__(self, processes: int = 1):
+        self.pool = None
+        if processes > 1:
+            self.pool = ProcessPoolExecutor(max_workers=processes, initializer=_init_pool_process)
+        else:
+            _warm_up()
+
+    def submit(self, request: Any, callback):
+        if self.pool is None:
+            callback(handle_request(request, emit=callback))
+            return
+        future = self.pool.submit(handle_request, request)
+
+        def _done(f):
+            try:
+                callback(f.result())
+            except Exception as e:
+                logger.exception("Worker pool request failed: %s", e)
+                req_id = request.get("id") if isinstance(request, dict) else None
+                callback({"id": req_id, "success": False, "error": f"Worker failure: {str(e)}"})
+
+        future.add_done_callback(_done)
+
+    def run(self, request: Any, emit=None) -> Dict[str, Any]:
+        if self.pool is None:
+            return handle_request(request, emit)
+        return self.pool.submit(handle_request, request).result()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+        else:
+            metrics.maybe_export(force=True)
+
+
+def serve_stdin(processes: int = 1, out: Optional[TextIO] = None):
+    """Answer requests from stdin until EOF, writing responses to ``out``."""
+    # Anything printed by libraries must not corrupt the protocol stream.
+    out = out or sys.stdout
+    sys.stdout = sys.stderr
+
+    lock = threading.Lock()
+
+    def write(response: Dict[str, Any]):
+        with lock:
+            out.write(json.dumps(response) + "\n")
+            out.flush()
+
+    dispatcher = Dispatcher(processes)
+    try:
+        for line in sys.stdin:
+            try:
+                request = _parse_line(line)
+            except json.JSONDecodeError as e:
+                write({"id": None, "success": False, "error": f"Invalid JSON input: {str(e)}"})
+                continue
+            if request is not None:
+                dispatcher.submit(request, write)
+    finally:
+        dispatcher.close()
+
+
+class _SocketHandler(socketserver.StreamRequestHandler):
+    def _send(self, response: Dict[str, Any]):
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def handle(self):
+        for raw in self.rfile:
+            try:
+                request = _parse_line(raw.decode("utf-8"))
+            except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                response = {"id": None, "success": False, "error": f"Invalid JSON input: {str(e)}"}
+            else:
+                if request is None:
+                    continue
+                response = self.server.dispatcher.run(request, emit=self._send)
+            self._send(response)
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve_socket(socket_path: Optional[str] = None, port: Optional[int] = None,
+                 host: str = "127.0.0.1", processes: int = 1):
+    """Serve the NDJSON protocol on a Unix socket or a local TCP port."""
+    if socket_path:
+        if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+            raise RuntimeError("Unix sockets are not supported on this platform; use --port")
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = socketserver.ThreadingUnixStreamServer(socket_path, _SocketHandler)
+        server.daemon_threads = True
+        where = socket_path
+    else:
+        server = _ThreadingTCPServer((host, port), _SocketHandler)
+        where = f"{host}:{port}"
+
+    server.dispatcher = Dispatcher(processes)
+    logger.info("Interaction worker listening on %s (%d process(es))", where, processes)
+    print(f"Listening on {where}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.dispatcher.close()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Long-lived drug interaction worker (NDJSON protocol)")
+    parser.add_argument("--socket", help="Listen on this Unix socket path instead of stdin")
+    parser.add_argument("--port", type=int, help="Listen on this local TCP port instead of stdin")
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address for --port (default: 127.0.0.1)")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("WORKER_PROCESSES", "1")),
+                        help="Number of warm worker processes (default: 1)")
+    parser.add_argument("--metrics-file", default=os.getenv("METRICS_FILE"),
+                        help="Write stage latency histograms here in the Prometheus text format")
+    args = parser.parse_args(argv)
+
+    processes = max(1, args.processes)
+    if args.metrics_file:
+        path = args.metrics_file
+        if processes > 1 and "{pid}" not in path:
+            # Each pool process keeps its own histograms, so each gets its own file
+            root, ext = os.path.splitext(path)
+            path = f"{root}.{{pid}}{ext}"
+        os.environ["METRICS_FILE"] = path
+    if args.socket or args.port:
+        serve_socket(socket_path=args.socket, port=args.port, host=args.host, processes=processes)
+    else:
+        serve_stdin(processes=processes)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())